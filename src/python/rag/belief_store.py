@@ -0,0 +1,275 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    SmallInteger,
+    String,
+    Table,
+    and_,
+    bindparam,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+
+from rag.database import Database
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def roll_up(previous: dict, score: int, round_number: int) -> tuple:
+    """
+    folds one round's score of a belief into that session's rollup (None before the first round)
+    returns the new rollup and the increments it adds to the population rollup
+    """
+    previous = previous or {
+        "rounds": 0,
+        "score_sum": 0,
+        "last_score": None,
+        "transitions": 0,
+        "first_positive_round": None,
+    }
+    # -1 -> 1: the user came round to the belief
+    transition = int(previous["last_score"] == -1 and score == 1)
+    turned_positive = previous["first_positive_round"] is None and score == 1
+
+    rollup = {
+        "rounds": previous["rounds"] + 1,
+        "score_sum": previous["score_sum"] + score,
+        "last_score": score,
+        "transitions": previous["transitions"] + transition,
+        "first_positive_round": round_number
+        if turned_positive
+        else previous["first_positive_round"],
+    }
+    increments = {
+        "sessions": int(previous["rounds"] == 0),
+        "rounds": 1,
+        "score_sum": score,
+        "transitions": transition,
+        "positive_sessions": int(turned_positive),
+        "rounds_to_positive": round_number if turned_positive else 0,
+    }
+    return rollup, increments
+
+
+class BeliefStore:
+    """
+    belief scores of every session, one row per session, round and belief, kept in IRIS
+    per-session and population rollups are updated in the same transaction as each round is recorded,
+    so the population view reads one row per belief however many sessions there are
+    """
+
+    def __init__(self, database: Database, categories: dict):
+        self.database = database
+        # category -> belief keys
+        self.categories = categories
+        self.beliefs = [belief for beliefs in categories.values() for belief in beliefs]
+
+        self.metadata = MetaData()
+        self.scores = Table(
+            "belief_scores",
+            self.metadata,
+            Column("session_id", String(64), primary_key=True),
+            Column("round_number", Integer, primary_key=True),
+            Column("belief", String(64), primary_key=True),
+            Column("score", SmallInteger, nullable=False),
+            Column("scored_at", DateTime, default=_now),
+        )
+        self.session_rollups = Table(
+            "belief_session_rollups",
+            self.metadata,
+            Column("session_id", String(64), primary_key=True),
+            Column("belief", String(64), primary_key=True),
+            Column("rounds", Integer, nullable=False),
+            Column("score_sum", Integer, nullable=False),
+            Column("last_score", SmallInteger, nullable=False),
+            Column("transitions", Integer, nullable=False),
+            Column("first_positive_round", Integer),
+            Column("updated_at", DateTime, default=_now, onupdate=_now),
+        )
+        self.population_rollups = Table(
+            "belief_population_rollups",
+            self.metadata,
+            Column("belief", String(64), primary_key=True),
+            Column("sessions", Integer, nullable=False, default=0),
+            Column("rounds", Integer, nullable=False, default=0),
+            Column("score_sum", Integer, nullable=False, default=0),
+            Column("transitions", Integer, nullable=False, default=0),
+            Column("positive_sessions", Integer, nullable=False, default=0),
+            # summed over the sessions that turned positive, divided by positive_sessions for the mean
+            Column("rounds_to_positive", Integer, nullable=False, default=0),
+        )
+        self.database.create_all(self.metadata)
+        self.init_statements()
+        self.init_population()
+
+    #*INFO: Built once, executed with bound parameters (executemany for the per-belief rows)
+    def init_statements(self):
+        session, population = self.session_rollups, self.population_rollups
+        increments = (
+            "sessions",
+            "rounds",
+            "score_sum",
+            "transitions",
+            "positive_sessions",
+            "rounds_to_positive",
+        )
+        self.statements = {
+            "insert_scores": insert(self.scores),
+            "session": select(
+                session.c.belief,
+                session.c.rounds,
+                session.c.score_sum,
+                session.c.last_score,
+                session.c.transitions,
+                session.c.first_positive_round,
+            ).where(session.c.session_id == bindparam("b_session_id")),
+            "insert_session": insert(session),
+            # SET takes the rollup columns from the parameters
+            "update_session": update(session).where(
+                and_(
+                    session.c.session_id == bindparam("b_session_id"),
+                    session.c.belief == bindparam("b_belief"),
+                )
+            ),
+            # increments rather than new values, so jobs recording concurrently never overwrite each other
+            "update_population": update(population)
+            .where(population.c.belief == bindparam("b_belief"))
+            .values(
+                {
+                    column: population.c[column] + bindparam(f"d_{column}")
+                    for column in increments
+                }
+            ),
+            "population": select(population),
+            "population_beliefs": select(population.c.belief),
+        }
+
+    def init_population(self):
+        try:
+            with self.database.begin() as connection:
+                existing = set(
+                    connection.execute(self.statements["population_beliefs"]).scalars()
+                )
+                missing = [
+                    {"belief": belief}
+                    for belief in self.beliefs
+                    if belief not in existing
+                ]
+                if missing:
+                    connection.execute(insert(self.population_rollups), missing)
+        except IntegrityError:
+            # another job added them first
+            pass
+
+    def record(self, session_id: str, round_data: dict) -> int:
+        """
+        stores a scored round of `session_id` and folds it into the rollups, returns its round number
+        """
+        with self.database.begin() as connection:
+            previous = {
+                row["belief"]: dict(row)
+                for row in connection.execute(
+                    self.statements["session"], {"b_session_id": session_id}
+                ).mappings()
+            }
+            round_number = max(
+                (rollup["rounds"] for rollup in previous.values()), default=0
+            )
+
+            scores, inserts, updates, increments = [], [], [], []
+            for belief in self.beliefs:
+                score = int(round_data.get(belief, 0))
+                rollup, delta = roll_up(previous.get(belief), score, round_number)
+                scores.append(
+                    {
+                        "session_id": session_id,
+                        "round_number": round_number,
+                        "belief": belief,
+                        "score": score,
+                    }
+                )
+                if belief in previous:
+                    updates.append(
+                        {"b_session_id": session_id, "b_belief": belief, **rollup}
+                    )
+                else:
+                    inserts.append(
+                        {"session_id": session_id, "belief": belief, **rollup}
+                    )
+                increments.append(
+                    {
+                        "b_belief": belief,
+                        **{f"d_{key}": value for key, value in delta.items()},
+                    }
+                )
+
+            connection.execute(self.statements["insert_scores"], scores)
+            if inserts:
+                connection.execute(self.statements["insert_session"], inserts)
+            if updates:
+                connection.execute(self.statements["update_session"], updates)
+            connection.execute(self.statements["update_population"], increments)
+        return round_number
+
+    def population(self) -> dict:
+        """
+        population view from the rollups: per-belief and per-category means, transitions from -1 to 1,
+        share of sessions that turned positive and mean rounds it took them
+        """
+        with self.database.connect() as connection:
+            rows = {
+                row["belief"]: dict(row)
+                for row in connection.execute(self.statements["population"]).mappings()
+            }
+
+        def summarize(rows: list) -> dict:
+            totals = {
+                key: sum(row[key] for row in rows)
+                for key in (
+                    "sessions",
+                    "rounds",
+                    "score_sum",
+                    "transitions",
+                    "positive_sessions",
+                    "rounds_to_positive",
+                )
+            }
+            return {
+                "sessions": max((row["sessions"] for row in rows), default=0),
+                "mean_score": totals["score_sum"] / totals["rounds"]
+                if totals["rounds"]
+                else 0.0,
+                "transitions": totals["transitions"],
+                "positive_rate": totals["positive_sessions"] / totals["sessions"]
+                if totals["sessions"]
+                else 0.0,
+                "mean_rounds_to_positive": (
+                    totals["rounds_to_positive"] / totals["positive_sessions"]
+                    if totals["positive_sessions"]
+                    else None
+                ),
+            }
+
+        known = [rows[belief] for belief in self.beliefs if belief in rows]
+        return {
+            "sessions": max((row["sessions"] for row in known), default=0),
+            "beliefs": {
+                belief: summarize([rows[belief]])
+                for belief in self.beliefs
+                if belief in rows
+            },
+            "categories": {
+                category: summarize(
+                    [rows[belief] for belief in beliefs if belief in rows]
+                )
+                for category, beliefs in self.categories.items()
+            },
+        }
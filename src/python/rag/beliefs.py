@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+BELIEF_PROMPT_HEADER = (
+    "The [SCORING AGENT] evaluated the [USER]'s beliefs and recommend the following: \n"
+)
+# sentence per score, indexed by score + 1
+BELIEF_TEMPLATES = (
+    "[ASSISTANT] can help [USER] understand that {}. \n",
+    "[ASSISTANT] can ask [USER] whether they believe that {}. \n",
+    "[ASSISTANT] can affirm [USER]'s belief that {}. \n",
+)
+RELOAD_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def _read(file_path: str, parse, default, log_warning):
+    try:
+        with open(file_path, "r") as file:
+            return parse(file)
+    except FileNotFoundError:
+        log_warning(f"{file_path} not found, using {default!r}")
+        return default
+
+
+class CompiledBeliefs:
+    """
+    belief tools, map and system prompt compiled into arrays: a round of scores is an int8 state
+    vector (one slot per belief key, in tool order) and each belief's sentences are prebuilt per score,
+    so rendering the belief prompt is a lookup and a join
+    the prompt lists the beliefs in belief map order, as it always has; scores off the -1/0/1 grid
+    are rounded to it, where they used to get no sentence at all
+    """
+
+    def __init__(self, tools: list, belief_map: dict, prompt: str, version: int = 0):
+        self.tools = tools
+        self.belief_map = belief_map
+        self.prompt = prompt
+        self.version = version
+
+        # category -> belief keys, e.g. calculate_incentive_belief_policy -> incentive
+        self.categories = {
+            tool["function"]["name"]
+            .removeprefix("calculate_")
+            .removesuffix("_belief_policy"): list(
+                tool["function"]["parameters"]["properties"].keys()
+            )
+            for tool in tools
+        }
+        self.keys = [key for keys in self.categories.values() for key in keys]
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        # (belief map key x score) sentences
+        self.fragments = np.array(
+            [
+                [template.format(belief) for template in BELIEF_TEMPLATES]
+                for belief in belief_map.values()
+            ],
+            dtype=object,
+        ).reshape(len(belief_map), len(BELIEF_TEMPLATES))
+        self._rows = np.arange(len(belief_map))
+        # state slot of each belief map key, beliefs no tool scores read the extra slot (always 0)
+        self._slots = np.array(
+            [self.index.get(key, len(self.keys)) for key in belief_map], dtype=np.intp
+        )
+
+    def state(self, arguments: list) -> np.ndarray:
+        """
+        state vector of the scores in `arguments` (the parsed arguments of each tool call),
+        rounded to -1, 0 or 1; beliefs no call scored are 0
+        """
+        state = np.zeros(len(self.keys), dtype=np.int8)
+        for function_args in arguments:
+            for key, value in function_args.items():
+                i = self.index.get(key)
+                if i is not None:
+                    state[i] = min(max(round(float(value)), -1), 1)
+        return state
+
+    def as_dict(self, state: np.ndarray) -> dict:
+        return dict(zip(self.keys, state.tolist()))
+
+    def render(self, state: np.ndarray) -> str:
+        scores = np.append(state, 0).astype(np.intp)[self._slots]
+        return BELIEF_PROMPT_HEADER + "".join(self.fragments[self._rows, scores + 1])
+
+
+class BeliefConfig:
+    """
+    process-wide belief configuration, compiled once and recompiled when one of its files changes
+    (checked at most every `reload_interval` seconds)
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, src_path: str, reload_interval: float = RELOAD_INTERVAL):
+        self.paths = (
+            f"{src_path}/tools/belief_tools.json",
+            f"{src_path}/tools/belief_map.json",
+            f"{src_path}/prompts/belief_prompt.txt",
+        )
+        self.reload_interval = reload_interval
+        self.checked_at = 0.0
+        self.mtimes = None
+        self.compiled = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, src_path: str, **kwargs) -> "BeliefConfig":
+        """
+        returns the configuration under `src_path`, created on first use (later arguments are ignored)
+        """
+        with cls._instances_lock:
+            config = cls._instances.get(src_path)
+            if config is None:
+                config = cls._instances[src_path] = cls(src_path, **kwargs)
+            return config
+
+    def _mtimes(self) -> tuple:
+        return tuple(
+            os.stat(path).st_mtime_ns if os.path.exists(path) else None
+            for path in self.paths
+        )
+
+    def _compile(self, version: int, log_warning) -> CompiledBeliefs:
+        tools_path, map_path, prompt_path = self.paths
+        return CompiledBeliefs(
+            tools=_read(tools_path, json.load, [], log_warning),
+            belief_map=_read(map_path, json.load, {}, log_warning),
+            prompt=_read(prompt_path, lambda file: file.read(), "", log_warning),
+            version=version,
+        )
+
+    def current(self, log_warning=None) -> CompiledBeliefs:
+        """
+        the compiled configuration, recompiled first if a file changed since it was compiled
+        problems with the files are reported to `log_warning` (e.g. the calling host's), or this module's logger
+        """
+        if (
+            self.compiled is not None
+            and time.monotonic() - self.checked_at < self.reload_interval
+        ):
+            return self.compiled
+        log_warning = log_warning or logger.warning
+        with self._lock:
+            mtimes = self._mtimes()
+            if self.compiled is None:
+                self.compiled = self._compile(0, log_warning)
+            elif mtimes != self.mtimes:
+                try:
+                    # swapped in whole, readers hold on to the one they got
+                    self.compiled = self._compile(
+                        self.compiled.version + 1, log_warning
+                    )
+                except (ValueError, KeyError) as e:
+                    # e.g. a file saved half-edited, the previous configuration stays until the next change
+                    log_warning(f"Belief configuration not reloaded: {e!r}")
+            self.mtimes = mtimes
+            self.checked_at = time.monotonic()
+            return self.compiled
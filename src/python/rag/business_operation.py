@@ -1,179 +1,1003 @@
+import abc
+import json
 import os
+import time
 import uuid
-import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
 from typing import Union
 
+import numpy as np
 from dotenv import load_dotenv
 from grongier.pex import BusinessOperation
-from langchain.document_loaders import PyPDFLoader, TextLoader
+from langchain.docstore.document import Document
 from langchain.embeddings import FastEmbedEmbeddings
-from langchain.text_splitter import (
-    MarkdownHeaderTextSplitter,
-    RecursiveCharacterTextSplitter,
-)
 from langchain.vectorstores import Chroma
-from langchain.vectorstores.utils import filter_complex_metadata
 from langchain_iris import IRISVector
-from openai import OpenAI
+from sqlalchemy import asc, bindparam, delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from rag.belief_store import BeliefStore
+from rag.beliefs import BeliefConfig, CompiledBeliefs
+from rag.cache import ResponseCache
+from rag.context import count_tokens, trim_to_budget
+from rag.database import Database, PooledIRISVector
+from rag.embedding import CachedEmbeddings, EmbeddingCache, EmbeddingService
+from rag.index import IVFIndex
+from rag.ingestion import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    count_pages,
+    create_text_splitter,
+    get_file_type,
+    hash_file,
+    list_files,
+    load_pages,
+    parse_file,
+    python_executable,
+    split_pages,
+)
+from rag.lexical import BM25Index, reciprocal_rank_fusion
+from rag.limits import SharedCalls, SharedSemaphore
+from rag.llm import LLMGateway, MockLLM
+from rag.manifest import DocumentManifest
 from rag.msg import (
     BeliefRetrievalRequest,
     BeliefRetrievalResponse,
+    BulkIngestionRequest,
+    BulkIngestionResponse,
+    CacheStatsRetrievalRequest,
+    CacheStatsRetrievalResponse,
     ChatClearRequest,
+    ChatHistoryAppendRequest,
     ChatRequest,
     ChatResponse,
     ChatRetrievalRequest,
     ChatRetrievalResponse,
     FileIngestionRequest,
+    IndexRebuildRequest,
+    IndexRestoreRequest,
+    IndexSnapshotRequest,
+    IndexSnapshotResponse,
+    PoolStatsRetrievalRequest,
+    PoolStatsRetrievalResponse,
+    PopulationScoreRetrievalRequest,
+    PopulationScoreRetrievalResponse,
+    ResponseCacheStoreRequest,
+    ScoreDeltaRetrievalRequest,
+    ScoreDeltaRetrievalResponse,
+    ScoreResponse,
     ScoreRetrievalRequest,
     ScoreRetrievalResponse,
     VectorSearchRequest,
     VectorSearchResponse,
 )
-from sqlalchemy import text
-from sqlalchemy.exc import IntegrityError
+from rag.session import Session, SessionStore, SharedSessionStore
+from rag.stream import StreamChannel
 
 load_dotenv()
 
 #*==================== CONSTS ====================#
 SRC_PATH = "/irisdev/app/src/python/rag"
+CACHE_PATH = f"{SRC_PATH}/.cache"
 MODEL_NAME = "gpt-4o"
+SUMMARY_MODEL_NAME = "gpt-4o-mini"
+EMBED_BATCH_SIZE = 64
+EMBED_CACHE_SIZE = 20000
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_THRESHOLD = 0.92
+QUERY_CACHE_SIZE = 512
+INGEST_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+ANN_MODE = "exact"
+ANN_NLIST = 0
+ANN_NPROBE = 8
+ANN_MIN_TRAIN_SIZE = 1024
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+RERANK_TOP_N = 10
+SNAPSHOT_BATCH_SIZE = 1000
+DB_POOL_SIZE = 5
+DB_POOL_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+SESSION_STORE = "iris"
+SESSION_TTL = 3600
+MAX_SESSIONS = 1000
+MAX_HISTORY = 50
+CONTEXT_BUDGET = 6000
+SUMMARY_MAX_TOKENS = 256
+LLM_TIMEOUT = 60
+LLM_MAX_RETRIES = 4
+LLM_MAX_CONCURRENCY = 8
+MOCK_LATENCY = "lognormal:0.8,0.5"
+SCORE_STORE = "iris"
 #*==================== CONSTS ====================#
 
+
+#*==================== DATABASE ====================#
+class DatabaseMixin:
+    #*INFO: Every IRIS-backed operation in the job shares one engine, the first to start sizes its pool
+    def init_database(self):
+        if not hasattr(self, "pool_size"):
+            self.pool_size = DB_POOL_SIZE
+        if not hasattr(self, "pool_max_overflow"):
+            self.pool_max_overflow = DB_POOL_MAX_OVERFLOW
+        if not hasattr(self, "pool_timeout"):
+            self.pool_timeout = DB_POOL_TIMEOUT
+
+        self.database = Database.shared(
+            pool_size=int(self.pool_size),
+            max_overflow=int(self.pool_max_overflow),
+            pool_timeout=float(self.pool_timeout),
+        )
+
+
+#*==================== DATABASE ====================#
+
+
 #*==================== VECTORS ====================#
 class VectorBaseOperation(BusinessOperation):
     def __init__(self):
         self.text_splitter = None
+        self.embeddings = None
+        self.embedding_cache = None
+        self.response_cache = None
+        self.query_embeddings = OrderedDict()
         self.vector_store = Union[IRISVector, Chroma]
 
+    def init_batch_size(self):
+        #*INFO: Number of chunks embedded (and written) per batch, configurable via %settings
+        if not hasattr(self, "batch_size"):
+            self.batch_size = EMBED_BATCH_SIZE
+        self.batch_size = max(1, int(self.batch_size))
+        # number of worker processes parsing files during bulk ingestion
+        if not hasattr(self, "ingest_workers"):
+            self.ingest_workers = INGEST_WORKERS
+        self.ingest_workers = max(1, int(self.ingest_workers))
+        # interpreter the workers are started with, found automatically when empty
+        if not hasattr(self, "ingest_python"):
+            self.ingest_python = ""
+
+    def init_embeddings(self):
+        #*INFO: Chunk embeddings are cached on disk, so unchanged documents skip the model on re-ingestion
+        if not hasattr(self, "cache_size"):
+            self.cache_size = EMBED_CACHE_SIZE
+        #* One model per process, loaded and warmed up once however many operations or restarts use it
+        model = EmbeddingService.shared("fastembed", FastEmbedEmbeddings)
+        #* Each operation runs in its own job, so each class has its own cache directory
+        self.embedding_cache = EmbeddingCache(
+            cache_dir=f"{CACHE_PATH}/embeddings/{self.__class__.__name__}",
+            model_name=model.model_name,
+            capacity=int(self.cache_size),
+        )
+        self.query_embeddings = OrderedDict()
+        return CachedEmbeddings(model, self.embedding_cache)
+
+    #*INFO: Releases the embedding cache's lock, so the operation restarted in this job can write to it again
+    def on_tear_down(self):
+        if getattr(self, "embedding_cache", None) is not None:
+            self.embedding_cache.close()
+
+    #*INFO: Answers to previously asked questions, dropped whenever the knowledge base changes
+    def init_response_cache(self):
+        if not hasattr(self, "response_cache_size"):
+            self.response_cache_size = RESPONSE_CACHE_SIZE
+        if not hasattr(self, "response_cache_ttl"):
+            self.response_cache_ttl = RESPONSE_CACHE_TTL
+        if not hasattr(self, "response_cache_threshold"):
+            self.response_cache_threshold = RESPONSE_CACHE_THRESHOLD
+
+        self.response_cache = ResponseCache(
+            embeddings=self.embeddings,
+            capacity=int(self.response_cache_size),
+            ttl=int(self.response_cache_ttl),
+            threshold=float(self.response_cache_threshold),
+        )
+
+    #*INFO: Streams the file page by page: load -> split -> embed -> write, one batch at a time,
+    #* so memory stays flat and earlier batches are searchable while later pages still load
     def ingest(self, request: FileIngestionRequest):
         file_path = request.file_path
-        file_type = self._get_file_type(file_path)
-        if file_type == "pdf":
-            self._ingest_pdf(file_path)
-        elif file_type == "markdown":
-            self._ingest_markdown(file_path)
-        elif file_type == "text":
-            self._ingest_text(file_path)
-        else:
-            raise Exception(f"Unknown file type: {file_type}")
+        source = request.source or file_path
+        file_hash = hash_file(file_path)
+        if self.manifest.is_unchanged(source, file_hash, self._existing_ids):
+            self.log_info(f"{source} is unchanged, skipping")
+            return
 
-    def clear(self, request: ChatClearRequest):
-        self.on_tear_down()
+        file_type = get_file_type(file_path)
+        pages = load_pages(file_path, file_type)
+        total_pages = count_pages(file_path, file_type)
 
-    def similar(self, request: VectorSearchRequest):
-        # do a similarity search
-        docs = self.vector_store.similarity_search(request.query)
-        # return the response
-        return VectorSearchResponse(docs=docs)
+        progress = StreamChannel(request.progress_id) if request.progress_id else None
+        chunk_ids = set()
+        chunks = 0
+        stored = 0
+        try:
+            for batch, pages_read in self._iter_batches(
+                split_pages(pages, self.text_splitter)
+            ):
+                chunk_ids.update(self._chunk_id(chunk) for chunk in batch)
+                chunks += len(batch)
+                stored += self._store_chunks(batch)
+                if progress:
+                    progress.write(
+                        json.dumps(
+                            {
+                                "file_path": file_path,
+                                "pages": pages_read,
+                                "total_pages": total_pages,
+                                "chunks": chunks,
+                                "stored": stored,
+                            }
+                        )
+                    )
+        finally:
+            if progress:
+                progress.close()
 
-    def on_tear_down(self):
-        docs = self.vector_store.get()
-        self.log_info(f"Deleting {len(docs['ids'])} documents")
-        for id in docs["ids"]:
-            self.vector_store.delete(id)
-
-    def _get_file_type(self, file_path: str):
-        if file_path.lower().endswith(".pdf"):
-            return "pdf"
-        elif file_path.lower().endswith(".md"):
-            return "markdown"
-        elif file_path.lower().endswith(".txt"):
-            return "text"
-        else:
-            return "unknown"
+        self._update_manifest(source, file_hash, chunk_ids)
 
-    def _store_chunks(self, chunks):
-        ids = [str(uuid.uuid5(uuid.NAMESPACE_DNS, doc.page_content)) for doc in chunks]
-        unique_ids = list(set(ids))
+    #*INFO: Files are parsed and split in a process pool, chunks are embedded and written here
+    #* in batches as each file finishes, so one model instance serves every worker
+    def ingest_bulk(self, request: BulkIngestionRequest):
+        sources = {file_path: file_path for file_path in request.file_paths or []}
+        if request.directory:
+            sources.update(
+                {
+                    file_path: os.path.relpath(file_path, request.directory)
+                    for file_path in list_files(request.directory)
+                }
+            )
 
-        for chunk, id in zip(chunks, unique_ids):
-            try:
-                self.vector_store.add_documents([chunk], ids=[id])
-            except IntegrityError:
-                self.log_warning(f"Duplicate entry for id {id}, skipping...")
+        # Unchanged files are skipped by hash, before they are ever parsed
+        reports = []
+        file_hashes = {}
+        file_paths = []
+        for file_path, source in sources.items():
+            file_hashes[file_path] = hash_file(file_path)
+            if self.manifest.is_unchanged(
+                source, file_hashes[file_path], self._existing_ids
+            ):
+                reports.append(
+                    {
+                        "file_path": file_path,
+                        "chunks": 0,
+                        "stored": 0,
+                        "skipped": 0,
+                        "unchanged": True,
+                    }
+                )
+            else:
+                file_paths.append(file_path)
+        if not file_paths:
+            return BulkIngestionResponse(files=reports)
+
+        with self._parse_executor(len(file_paths)) as executor:
+            futures = {
+                executor.submit(
+                    parse_file, file_path, CHUNK_SIZE, CHUNK_OVERLAP
+                ): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                file_path = futures[future]
+                report = {
+                    "file_path": file_path,
+                    "chunks": 0,
+                    "stored": 0,
+                    "skipped": 0,
+                }
+                try:
+                    chunks, report["parse_seconds"] = future.result()
+                    start = time.perf_counter()
+                    for batch_start in range(0, len(chunks), self.batch_size):
+                        report["stored"] += self._store_chunks(
+                            chunks[batch_start : batch_start + self.batch_size]
+                        )
+                    report["deleted"] = self._update_manifest(
+                        sources[file_path],
+                        file_hashes[file_path],
+                        {self._chunk_id(chunk) for chunk in chunks},
+                    )
+                    report["store_seconds"] = time.perf_counter() - start
+                    report["chunks"] = len(chunks)
+                    report["skipped"] = len(chunks) - report["stored"]
+                except Exception as e:
+                    self.log_warning(f"Failed to ingest {file_path}: {e}")
+                    report["error"] = str(e)
+                reports.append(report)
+
+        return BulkIngestionResponse(files=reports)
+
+    #*INFO: Worker processes need a Python interpreter to start, without one (or with a single worker)
+    #* files are parsed in-process, one at a time
+    def _parse_executor(self, files: int):
+        workers = min(self.ingest_workers, files)
+        executable = python_executable(self.ingest_python) if workers > 1 else ""
+        if not executable:
+            return ThreadPoolExecutor(max_workers=1)
 
-    def _ingest_text(self, file_path: str):
-        docs = TextLoader(file_path).load()
-        chunks = self.text_splitter.split_documents(docs)
-        chunks = filter_complex_metadata(chunks)
+        context = get_context("spawn")
+        context.set_executable(executable)
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
 
-        self._store_chunks(chunks)
+    #*INFO: Removes the chunks the previous version of a source had and the new one does not
+    def _update_manifest(self, source: str, file_hash: str, chunk_ids: set) -> int:
+        stale_ids = self.manifest.stale_ids(source, chunk_ids)
+        if stale_ids:
+            self._delete_ids(list(stale_ids))
+            self.response_cache.clear()
+            self.log_info(f"Deleted {len(stale_ids)} stale chunks of {source}")
+        self.manifest.set(source, file_hash, chunk_ids)
+        return len(stale_ids)
 
-    def _ingest_pdf(self, file_path: str):
-        docs = PyPDFLoader(file_path=file_path).load()
-        chunks = self.text_splitter.split_documents(docs)
-        chunks = filter_complex_metadata(chunks)
+    #*INFO: Knowledge-base maintenance, kept apart from per-conversation resets (ChatClearRequest)
+    def rebuild(self, request: IndexRebuildRequest):
+        self.log_info("Rebuilding index")
+        self._delete_all()
+        self.manifest.clear()
+        self.response_cache.clear()
+        self.init_data()
 
-        self._store_chunks(chunks)
+    def similar(self, request: VectorSearchRequest):
+        embedding = self._embed_query(request.query, request.session_id)
+        #*INFO: A question already answered in the same conversation is served from the response cache,
+        #* looked up with the embedding the search needs anyway
+        if request.history_hash:
+            cached_response = self.response_cache.get(
+                request.query, request.history_hash, embedding
+            )
+            if cached_response:
+                return VectorSearchResponse(docs=[], cached_response=cached_response)
 
-    def _ingest_markdown(self, file_path: str):
-        # Document loader
-        docs = TextLoader(file_path).load()
+        # do a similarity search
+        docs = []
+        tokens = 0
+        for doc in self._rank(
+            request.query, embedding, request.k, request.score_threshold
+        ):
+            # stop before the snippets outgrow the context budget
+            tokens += count_tokens(doc.page_content)
+            if request.max_tokens and docs and tokens > request.max_tokens:
+                break
+            docs.append(
+                {
+                    "id": self._chunk_id(doc),
+                    "page_content": " ".join(doc.page_content.split()),
+                }
+            )
+        # return the response
+        return VectorSearchResponse(docs=docs)
 
-        # MD splits
-        headers_to_split_on = [
-            ("#", "Header 1"),
-            ("##", "Header 2"),
+    def _rank(
+        self, query: str, embedding: list, k: int, score_threshold: float
+    ) -> list:
+        relevance_score_fn = self.vector_store._select_relevance_score_fn()
+        return [
+            doc
+            for doc, distance in self._search(embedding, k)
+            if relevance_score_fn(distance) >= score_threshold
         ]
 
-        markdown_splitter = MarkdownHeaderTextSplitter(
-            headers_to_split_on=headers_to_split_on
-        )
-        md_header_splits = markdown_splitter.split_text(docs[0].page_content)
+    #*INFO: Query embeddings are memoised per session, a rephrased follow-up is the only thing re-embedded
+    def _embed_query(self, query: str, session_id: str) -> list:
+        key = (session_id, query)
+        embedding = self.query_embeddings.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            self.query_embeddings[key] = embedding
+            if len(self.query_embeddings) > QUERY_CACHE_SIZE:
+                self.query_embeddings.popitem(last=False)
+        self.query_embeddings.move_to_end(key)
+        return embedding
 
-        # Split
-        chunks = self.text_splitter.split_documents(md_header_splits)
-        chunks = filter_complex_metadata(chunks)
+    @abc.abstractmethod
+    def _search(self, embedding: list, k: int) -> list:
+        """
+        the k nearest chunks to the embedding, as (document, distance) pairs
+        """
 
-        self._store_chunks(chunks)
+    def store_response(self, request: ResponseCacheStoreRequest):
+        self.response_cache.put(request.query, request.history_hash, request.response)
+
+    def retrieve_pool_stats(self, request: PoolStatsRetrievalRequest):
+        # only IRIS-backed operations hold a connection pool
+        return PoolStatsRetrievalResponse(stats={})
+
+    def retrieve_cache_stats(self, request: CacheStatsRetrievalRequest):
+        return CacheStatsRetrievalResponse(
+            stats={
+                "embedding": self.embedding_cache.stats(),
+                "response": self.response_cache.stats(),
+            }
+        )
 
-class IrisVectorOperation(VectorBaseOperation):
-    #*==================== INIT ====================#
     # Provides base knowledge to the model
     def init_data(self):
         file_path = f"{SRC_PATH}/data/factsheet.pdf"
         if os.path.exists(file_path):
             self.log_info(f"File exists {file_path}")
 
-            ingest_request =  FileIngestionRequest(file_path=file_path)
+            ingest_request = FileIngestionRequest(file_path=file_path)
             self.ingest(ingest_request)
         else:
             self.log_info(f"File does not exist. {file_path}")
 
+    #*INFO: Storage hooks, implemented by each vector store
+    @abc.abstractmethod
+    def _delete_all(self):
+        """
+        removes every chunk of the collection
+        """
+
+    @abc.abstractmethod
+    def _delete_ids(self, ids: list):
+        """
+        removes the chunks with these ids
+        """
+
+    @abc.abstractmethod
+    def _existing_ids(self, ids: list) -> set:
+        """
+        the ids among `ids` already stored
+        """
+
+    @abc.abstractmethod
+    def _write_chunks(self, ids: list, chunks: list, embeddings: list):
+        """
+        writes the chunks in one go, raises IntegrityError if any id is already stored
+        """
+
+    def _embed_chunks(self, chunks) -> list:
+        texts = [chunk.page_content for chunk in chunks]
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(
+                self.embeddings.embed_documents(texts[start : start + self.batch_size])
+            )
+        return embeddings
+
+    #*INFO: Ids are derived from the chunk content, so re-ingesting a file is idempotent
+    def _chunk_id(self, chunk) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_DNS, chunk.page_content))
+
+    def _store_chunks(self, chunks):
+        unique_chunks = {}
+        for chunk in chunks:
+            unique_chunks.setdefault(self._chunk_id(chunk), chunk)
+
+        # Single existence check, then only embed and write what is new
+        existing_ids = self._existing_ids(list(unique_chunks.keys()))
+        new_chunks = {
+            id: chunk for id, chunk in unique_chunks.items() if id not in existing_ids
+        }
+        skipped = len(chunks) - len(new_chunks)
+        if not new_chunks:
+            self.log_info(f"No new chunks to store, skipped {skipped} duplicates")
+            return 0
+
+        ids = list(new_chunks.keys())
+        docs = list(new_chunks.values())
+        embeddings = self._embed_chunks(docs)
+
+        try:
+            self._write_chunks(ids, docs, embeddings)
+            stored = len(ids)
+        except IntegrityError:
+            self.log_warning(
+                f"Duplicate entries in batch of {len(ids)} chunks, storing the new ones one by one"
+            )
+            stored = self._write_each(ids, docs, embeddings)
+        skipped = len(chunks) - stored
+        if not stored:
+            return 0
+
+        # Cached answers may no longer reflect the knowledge base
+        self.response_cache.clear()
+        self.log_info(f"Stored {stored} chunks, skipped {skipped} duplicates")
+        return stored
+
+    #*INFO: Another writer stored some of the batch since it was checked, the rest still gets written
+    def _write_each(self, ids: list, chunks: list, embeddings: list) -> int:
+        existing_ids = self._existing_ids(ids)
+        stored = 0
+        for id, chunk, embedding in zip(ids, chunks, embeddings):
+            if id in existing_ids:
+                continue
+            try:
+                self._write_chunks([id], [chunk], [embedding])
+                stored += 1
+            except IntegrityError:
+                pass
+        return stored
+
+    def _iter_batches(self, page_chunks):
+        """
+        buffers the chunks of each page and yields (chunks, pages read) once batch_size chunks are buffered
+        """
+        buffer = []
+        pages_read = 0
+        for pages_read, chunks in enumerate(page_chunks, start=1):
+            buffer.extend(chunks)
+            while len(buffer) >= self.batch_size:
+                yield buffer[: self.batch_size], pages_read
+                buffer = buffer[self.batch_size :]
+
+        if buffer:
+            yield buffer, pages_read
+
+
+class IrisVectorOperation(DatabaseMixin, VectorBaseOperation):
+    COLLECTION_NAME = "vector"
+
+    #*==================== INIT ====================#
     def on_init(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1024, chunk_overlap=100
+        self.init_batch_size()
+        self.text_splitter = create_text_splitter(CHUNK_SIZE, CHUNK_OVERLAP)
+        self.embeddings = self.init_embeddings()
+        self.init_response_cache()
+        self.init_database()
+        self.vector_store = PooledIRISVector(
+            database=self.database,
+            collection_name=self.COLLECTION_NAME,
+            embedding_function=self.embeddings,
         )
-        self.vector_store = IRISVector(
-            collection_name="vector", embedding_function=FastEmbedEmbeddings()
+        self.table = self.vector_store.table
+        self.init_statements()
+        self.manifest = DocumentManifest(
+            f"{CACHE_PATH}/manifests/{self.__class__.__name__}.json"
         )
+        self.init_indexes()
         self.init_data()
+
+    #*INFO: Built once and executed with bound parameters, so SQLAlchemy compiles each of them once
+    def init_statements(self):
+        ids = bindparam("ids", expanding=True)
+        self.statements = {
+            "existing": select(self.table.c.id).where(self.table.c.id.in_(ids)),
+            "fetch": select(
+                self.table.c.id, self.table.c.document, self.table.c.metadata
+            ).where(self.table.c.id.in_(ids)),
+            # executemany of one statement, instead of a multi-row VALUES per batch size
+            "insert": insert(self.table),
+            "delete": delete(self.table).where(self.table.c.id.in_(ids)),
+            "delete_all": delete(self.table),
+        }
+
+    #*INFO: In-process indexes are rebuilt from the table on start, the table is the source of truth
+    def init_indexes(self):
+        self.init_ann_index()
+
+    #*INFO: "exact" scans the whole table in IRIS, "ivf" searches an in-process index kept in sync with it
+    #* ann_nprobe is the recall/latency knob: more clusters probed, better recall, slower search
+    def init_ann_index(self):
+        if not hasattr(self, "ann_mode"):
+            self.ann_mode = ANN_MODE
+        if not hasattr(self, "ann_nlist"):
+            self.ann_nlist = ANN_NLIST
+        if not hasattr(self, "ann_nprobe"):
+            self.ann_nprobe = ANN_NPROBE
+
+        self.ann_index = None
+        if self.ann_mode == "exact":
+            return
+        if self.ann_mode != "ivf":
+            raise ValueError(f"Unknown ann_mode: {self.ann_mode}")
+
+        self.ann_index = IVFIndex(
+            nlist=int(self.ann_nlist),
+            nprobe=int(self.ann_nprobe),
+            min_train_size=ANN_MIN_TRAIN_SIZE,
+        )
+        for rows in self._iter_rows(self.table.c.embedding):
+            self.ann_index.add(
+                [row.id for row in rows], [row.embedding for row in rows]
+            )
+        self.log_info(f"Loaded ANN index: {self.ann_index.stats()}")
+
     #*==================== INIT ====================#
 
-    def on_tear_down(self):
-        docs = self.vector_store.get()
-        self.log_info(f"Deleting {len(docs['ids'])} documents")
-        with self.vector_store._conn.begin():
-            for id in docs["ids"]:
-                self.vector_store._conn.execute(
-                    text("delete from vector where id = :id"), {"id": id}
+    def retrieve_pool_stats(self, request: PoolStatsRetrievalRequest):
+        return PoolStatsRetrievalResponse(stats=self.database.stats())
+
+    def _iter_rows(self, *columns):
+        """
+        yields the (id, *columns) rows of the whole table, a few batches at a time
+        """
+        with self.database.connect() as connection:
+            result = connection.execute(select(self.table.c.id, *columns))
+            yield from iter(lambda: result.fetchmany(self.batch_size * 16), [])
+
+    def _fetch_docs(self, ids: list) -> dict:
+        if not ids:
+            return {}
+        with self.database.connect() as connection:
+            rows = connection.execute(self.statements["fetch"], {"ids": ids}).fetchall()
+        return {
+            row.id: Document(
+                page_content=row.document, metadata=json.loads(row.metadata or "{}")
+            )
+            for row in rows
+        }
+
+    def _existing_ids(self, ids: list) -> set:
+        if not ids:
+            return set()
+        with self.database.connect() as connection:
+            rows = connection.execute(
+                self.statements["existing"], {"ids": ids}
+            ).fetchall()
+        return {row.id for row in rows}
+
+    def _search(self, embedding: list, k: int) -> list:
+        if self.ann_index is not None:
+            # Distances come from the index, only the k winning rows are read back from IRIS
+            hits = self.ann_index.search(embedding, k)
+            docs = self._fetch_docs([id for id, _ in hits])
+            # cosine distance, as IRISVector reports it, so its relevance score function still applies
+            return [(docs[id], distance) for id, distance in hits if id in docs]
+
+        #* Same query IRISVector runs, but on a pooled connection; the vector is a bound
+        #* parameter, so every search reuses one compiled statement
+        embedding = [float(value) for value in embedding]
+        if self.vector_store.native_vector:
+            distance = self.vector_store.distance_strategy(embedding)
+        else:
+            distance = self.table.c.embedding.func(
+                self.vector_store.distance_strategy, embedding
+            )
+        statement = (
+            select(
+                self.table.c.document, self.table.c.metadata, distance.label("distance")
+            )
+            .order_by(asc("distance"))
+            .limit(k)
+        )
+        with self.database.connect() as connection:
+            rows = connection.execute(statement).fetchall()
+        return [
+            (
+                Document(
+                    page_content=row.document, metadata=json.loads(row.metadata or "{}")
+                ),
+                round(float(row.distance), 15),
+            )
+            for row in rows
+        ]
+
+    def _write_chunks(self, ids: list, chunks: list, embeddings: list):
+        rows = [
+            {
+                "id": id,
+                "embedding": [float(value) for value in embedding],
+                "document": chunk.page_content,
+                "metadata": json.dumps(chunk.metadata),
+            }
+            for id, chunk, embedding in zip(ids, chunks, embeddings)
+        ]
+        #* Every row in a single transaction
+        with self.database.begin() as connection:
+            connection.execute(self.statements["insert"], rows)
+        if self.ann_index is not None:
+            self.ann_index.add(ids, embeddings)
+
+    def _delete_all(self):
+        # One set-based DELETE instead of a round-trip per row
+        with self.database.begin() as connection:
+            result = connection.execute(self.statements["delete_all"])
+        if self.ann_index is not None:
+            self.ann_index.clear()
+        self.log_info(f"Deleted {result.rowcount} documents")
+
+    def _delete_ids(self, ids: list):
+        with self.database.begin() as connection:
+            connection.execute(self.statements["delete"], {"ids": ids})
+        if self.ann_index is not None:
+            self.ann_index.remove(ids)
+
+
+class HybridVectorOperation(IrisVectorOperation):
+    """
+    IRIS vector search fused with a BM25 index over the same chunks, optionally reranked
+    by a cross-encoder; to use it, add it to the production in place of IrisVectorOperation
+    and point ChatProcess.target_vector at it
+    """
+
+    #* Own table, so its in-process indexes never miss writes made through IrisVectorOperation
+    #* (each operation ingests the corpus on start, so only one of the two runs in a production)
+    COLLECTION_NAME = "hybrid_vector"
+
+    #*==================== INIT ====================#
+    def init_indexes(self):
+        super().init_indexes()
+        if not hasattr(self, "hybrid_candidates"):
+            self.hybrid_candidates = HYBRID_CANDIDATES
+        self.hybrid_candidates = int(self.hybrid_candidates)
+
+        self.lexical_index = BM25Index()
+        for rows in self._iter_rows(self.table.c.document):
+            self.lexical_index.add(
+                [row.id for row in rows], [row.document for row in rows]
+            )
+        self.log_info(f"Loaded BM25 index: {len(self.lexical_index)} chunks")
+        self.init_reranker()
+
+    #*INFO: Reranking is off unless a cross-encoder model is set, e.g. rerank_model=Xenova/ms-marco-MiniLM-L-6-v2
+    def init_reranker(self):
+        if not hasattr(self, "rerank_model"):
+            self.rerank_model = ""
+        if not hasattr(self, "rerank_top_n"):
+            self.rerank_top_n = RERANK_TOP_N
+        self.rerank_top_n = int(self.rerank_top_n)
+
+        self.reranker = None
+        if self.rerank_model:
+            from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+            self.reranker = TextCrossEncoder(model_name=self.rerank_model)
+
+    #*==================== INIT ====================#
+
+    def _rank(
+        self, query: str, embedding: list, k: int, score_threshold: float
+    ) -> list:
+        candidates = max(k, self.hybrid_candidates)
+
+        # The relevance threshold only applies to the dense side, lexical hits matched query terms
+        relevance_score_fn = self.vector_store._select_relevance_score_fn()
+        docs = {}
+        dense_ids = []
+        for doc, distance in self._search(embedding, candidates):
+            if relevance_score_fn(distance) >= score_threshold:
+                id = self._chunk_id(doc)
+                docs[id] = doc
+                dense_ids.append(id)
+        lexical_ids = [id for id, _ in self.lexical_index.search(query, candidates)]
+        docs.update(self._fetch_docs([id for id in lexical_ids if id not in docs]))
+
+        ranked = [
+            id
+            for id in reciprocal_rank_fusion(dense_ids, lexical_ids, k=RRF_K)
+            if id in docs
+        ]
+        if self.reranker is not None:
+            top = ranked[: self.rerank_top_n]
+            scores = list(
+                self.reranker.rerank(query, [docs[id].page_content for id in top])
+            )
+            reranked = [
+                id
+                for _, id in sorted(
+                    zip(scores, top), key=lambda pair: pair[0], reverse=True
                 )
+            ]
+            ranked = reranked + ranked[self.rerank_top_n :]
+        return [docs[id] for id in ranked[:k]]
+
+    def _write_chunks(self, ids: list, chunks: list, embeddings: list):
+        super()._write_chunks(ids, chunks, embeddings)
+        self.lexical_index.add(ids, [chunk.page_content for chunk in chunks])
+
+    def _delete_all(self):
+        super()._delete_all()
+        self.lexical_index.clear()
+
+    def _delete_ids(self, ids: list):
+        super()._delete_ids(ids)
+        self.lexical_index.remove(ids)
 
-        self.on_init()
 
 class ChromaVectorOperation(VectorBaseOperation):
+    #*==================== INIT ====================#
     def on_init(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1024, chunk_overlap=100
-        )
+        self.init_batch_size()
+        self.text_splitter = create_text_splitter(CHUNK_SIZE, CHUNK_OVERLAP)
+        self.embeddings = self.init_embeddings()
+        self.init_response_cache()
+        #*INFO: With persist_directory set (off by default) the collection and its manifest live on disk,
+        #* a restart reopens it as is and only an empty collection is seeded with the base knowledge
+        if not hasattr(self, "persist_directory"):
+            self.persist_directory = ""
         self.vector_store = Chroma(
-            collection_name="vector", embedding_function=FastEmbedEmbeddings()
+            collection_name="vector",
+            embedding_function=self.embeddings,
+            persist_directory=self.persist_directory or None,
+        )
+        if self.persist_directory:
+            self.manifest = DocumentManifest(f"{self.persist_directory}/manifest.json")
+            if not self.vector_store._collection.count():
+                self.init_data()
+        else:
+            # the collection lives in memory, so does its manifest
+            self.manifest = DocumentManifest()
+
+    #*==================== INIT ====================#
+
+    #*==================== SNAPSHOTS ====================#
+    #*INFO: A snapshot holds the stored vectors themselves, so restoring one never calls the model
+    def snapshot(self, request: IndexSnapshotRequest):
+        path = (
+            request.path
+            or f"{CACHE_PATH}/snapshots/chroma-{time.strftime('%Y%m%d-%H%M%S')}"
         )
+        os.makedirs(path, exist_ok=True)
+
+        ids, documents, metadatas, embeddings = [], [], [], []
+        for offset in range(
+            0, self.vector_store._collection.count(), SNAPSHOT_BATCH_SIZE
+        ):
+            batch = self.vector_store._collection.get(
+                limit=SNAPSHOT_BATCH_SIZE,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            ids.extend(batch["ids"])
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+            embeddings.extend(batch["embeddings"])
+
+        np.save(f"{path}/embeddings.npy", np.asarray(embeddings, dtype=np.float32))
+        with open(f"{path}/records.json", "w") as file:
+            json.dump(
+                {"ids": ids, "documents": documents, "metadatas": metadatas}, file
+            )
+        with open(f"{path}/manifest.json", "w") as file:
+            json.dump(self.manifest.documents, file)
+
+        self.log_info(f"Snapshot of {len(ids)} chunks written to {path}")
+        return IndexSnapshotResponse(path=path, count=len(ids))
+
+    def restore(self, request: IndexRestoreRequest):
+        embeddings = np.load(f"{request.path}/embeddings.npy", mmap_mode="r")
+        with open(f"{request.path}/records.json", "r") as file:
+            records = json.load(file)
+
+        self._delete_all()
+        ids = records["ids"]
+        for start in range(0, len(ids), SNAPSHOT_BATCH_SIZE):
+            end = start + SNAPSHOT_BATCH_SIZE
+            self.vector_store._collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end].tolist(),
+                metadatas=records["metadatas"][start:end],
+                documents=records["documents"][start:end],
+            )
+
+        # The manifest has to describe the restored collection, not the one it replaced
+        self.manifest.clear()
+        manifest_path = f"{request.path}/manifest.json"
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as file:
+                for source, document in json.load(file).items():
+                    self.manifest.set(
+                        source, document["file_hash"], document["chunk_ids"]
+                    )
+        self.response_cache.clear()
+
+        self.log_info(f"Restored {len(ids)} chunks from {request.path}")
+        return IndexSnapshotResponse(path=request.path, count=len(ids))
+
+    #*==================== SNAPSHOTS ====================#
+
+    def _delete_all(self):
+        ids = self.vector_store.get(include=[])["ids"]
+        if ids:
+            self.vector_store._collection.delete(ids=ids)
+        self.log_info(f"Deleted {len(ids)} documents")
+
+    def _delete_ids(self, ids: list):
+        self.vector_store._collection.delete(ids=ids)
+
+    def _existing_ids(self, ids: list) -> set:
+        if not ids:
+            return set()
+        return set(self.vector_store.get(ids=ids, include=[])["ids"])
+
+    def _search(self, embedding: list, k: int) -> list:
+        return self.vector_store.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=k
+        )
+
+    def _write_chunks(self, ids: list, chunks: list, embeddings: list):
+        self.vector_store._collection.add(
+            ids=ids,
+            embeddings=embeddings,
+            metadatas=[chunk.metadata for chunk in chunks],
+            documents=[chunk.page_content for chunk in chunks],
+        )
+
+
 #*==================== VECTORS ====================#
 
-class ChatOperation(BusinessOperation):
+
+#*==================== CONVERSATIONS ====================#
+class ConversationBaseOperation(DatabaseMixin, BusinessOperation):
     def __init__(self):
         self.model = None
+        self.sessions = None
+
+    #*INFO: Conversation state is kept per session id, bounded and evicted once idle for session_ttl seconds
+    #*INFO: History beyond context_budget tokens slides out of the window (and into the summary, if any)
+    #*INFO: session_store=iris keeps sessions in IRIS, so any job of the pool serves any session;
+    #* memory keeps them in this job, only for an operation running in a single job (PoolSize=1)
+    def init_sessions(
+        self, pinned: list, summarize=None, score_categories: dict = None
+    ):
+        if not hasattr(self, "session_store"):
+            self.session_store = SESSION_STORE
+        if not hasattr(self, "session_ttl"):
+            self.session_ttl = SESSION_TTL
+        if not hasattr(self, "max_sessions"):
+            self.max_sessions = MAX_SESSIONS
+        if not hasattr(self, "max_history"):
+            self.max_history = MAX_HISTORY
+        if not hasattr(self, "context_budget"):
+            self.context_budget = CONTEXT_BUDGET
+
+        store_args = dict(
+            pinned=pinned,
+            ttl=int(self.session_ttl),
+            max_sessions=int(self.max_sessions),
+            max_messages=int(self.max_history),
+            budget=int(self.context_budget),
+            summarize=summarize,
+            score_categories=score_categories,
+        )
+        if self.session_store == "iris":
+            self.init_database()
+            self.sessions = SharedSessionStore(
+                self.database, self.__class__.__name__, **store_args
+            )
+        elif self.session_store == "memory":
+            self.sessions = SessionStore(**store_args)
+        else:
+            raise ValueError(f"Unknown session_store: {self.session_store}")
+
+    #*INFO: One gateway per job: llm_timeout bounds each call, llm_max_retries the backoff on
+    #* rate limits and upstream errors, llm_max_concurrency the calls in flight at once across every job
+    #* of the instance; identical completions in flight in any job are coalesced
+    #*INFO: llm_backend=mock swaps in a local stub (latency drawn from mock_latency) for offline load tests
+    def init_model(self):
+        if not hasattr(self, "llm_backend"):
+            self.llm_backend = "openai"
+        if self.llm_backend == "mock":
+            if not hasattr(self, "mock_latency"):
+                self.mock_latency = MOCK_LATENCY
+            self.model = MockLLM(latency=self.mock_latency)
+            return
+        if self.llm_backend != "openai":
+            raise ValueError(f"Unknown llm_backend: {self.llm_backend}")
+
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "API Key not found. Please set OPENAI_API_KEY in your .env file."
+            )
+
+        if not hasattr(self, "llm_timeout"):
+            self.llm_timeout = LLM_TIMEOUT
+        if not hasattr(self, "llm_max_retries"):
+            self.llm_max_retries = LLM_MAX_RETRIES
+        if not hasattr(self, "llm_max_concurrency"):
+            self.llm_max_concurrency = LLM_MAX_CONCURRENCY
+
+        self.model = LLMGateway.shared(
+            api_key,
+            timeout=float(self.llm_timeout),
+            max_retries=int(self.llm_max_retries),
+            max_concurrency=int(self.llm_max_concurrency),
+            shared_semaphore=SharedSemaphore("openai", int(self.llm_max_concurrency)),
+            shared_calls=SharedCalls(),
+        )
+
+    def clear(self, request: ChatClearRequest):
+        self.sessions.reset(request.session_id)
+
+
+class ChatOperation(ConversationBaseOperation):
+    def __init__(self):
+        super().__init__()
         self.messages = []
 
     #*==================== INIT ====================#
@@ -183,7 +1007,7 @@ class ChatOperation(BusinessOperation):
         try:
             with open(file_path, "r") as file:
                 prompt_content = file.read()
-                #* Appends prompt to ChatOperation.messages
+                #* Appends prompt to ChatOperation.messages, pinned to every session
                 self.messages.append({"role": "system", "content": prompt_content})
         except FileNotFoundError:
             print(f"Error: {file_path} not found.")
@@ -194,183 +1018,253 @@ class ChatOperation(BusinessOperation):
         try:
             with open(file_path, "r") as file:
                 prompt_content = file.read()
-                #* Appends prompt to ChatOperation.messages
+                #* Appends prompt to ChatOperation.messages, pinned to every session
                 self.messages.append({"role": "assistant", "content": prompt_content})
 
         except FileNotFoundError:
             print(f"Error: {file_path} not found.")
 
     def on_init(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError(
-                "API Key not found. Please set OPENAI_API_KEY in your .env file."
-            )
-
-        self.model = OpenAI(api_key=api_key)
+        self.init_model()
         self.messages = []
 
         self.init_system_prompt()
         self.init_initial_prompt()
-    #*==================== INIT ====================#
-    def clear(self, request: ChatClearRequest):
-        self.on_init()
+        self.init_sessions(pinned=self.messages, summarize=self._summarize)
 
-    def ask(self, request: ChatRequest):
-        assistant_response = request.messages[-1]["content"]
-
-        # self.messages.append({"role": "assistant", "content": assistant_response})
-        self.messages.append({"role": "system", "content": assistant_response})
+    #*==================== INIT ====================#
 
-        return ChatResponse(
-            response=self.model.chat.completions.create(
-                model=MODEL_NAME,
-                messages=self.messages,
+    #*INFO: Folds the turns sliding out of the context window into the rolling summary
+    def _summarize(self, summary: str, messages: list) -> str:
+        turns = "\n".join(
+            f"[{message['role'].upper()}]: {message['content']}" for message in messages
+        )
+        return (
+            self.model.complete(
+                model=SUMMARY_MODEL_NAME,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Update the summary of a conversation between a [USER] and an [ASSISTANT] with the "
+                        "new turns. Keep the [USER]'s concerns, beliefs and personal details, be concise.",
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Summary: {summary or 'NIL'}\n\nNew turns:\n{turns}",
+                    },
+                ],
+                max_tokens=SUMMARY_MAX_TOKENS,
             )
             .choices[0]
             .message.content
         )
 
+    def ask(self, request: ChatRequest):
+        with self.sessions.session(request.session_id) as session:
+            assistant_response = request.messages[-1]["content"]
+
+            # session.add_message({"role": "assistant", "content": assistant_response})
+            session.add_message({"role": "system", "content": assistant_response})
+
+            if request.stream_id:
+                response = self._stream(session.messages, request.stream_id)
+            else:
+                response = (
+                    self.model.complete(
+                        model=MODEL_NAME,
+                        messages=session.messages,
+                    )
+                    .choices[0]
+                    .message.content
+                )
+
+            # The reply is part of the context of the next turn, whether it was generated or cached
+            session.add_message({"role": "assistant", "content": response})
+        return ChatResponse(response=response)
+
+    #*INFO: A turn answered from the response cache, recorded as if this operation had answered it
+    def append_history(self, request: ChatHistoryAppendRequest):
+        with self.sessions.session(request.session_id) as session:
+            user_message, reply = request.messages
+            session.add_message({"role": "system", "content": user_message["content"]})
+            session.add_message(reply)
+
+    #*INFO: Forwards tokens to the caller's stream channel as they are generated
+    def _stream(self, messages: list, stream_id: str) -> str:
+        channel = StreamChannel(stream_id)
+        chunks = []
+        try:
+            for chunk in self.model.stream(
+                model=MODEL_NAME,
+                messages=messages,
+            ):
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    channel.write(content)
+                    chunks.append(content)
+        finally:
+            channel.close()
+
+        return "".join(chunks)
+
     def retrieve_messages(self, request: ChatRetrievalRequest):
         return ChatRetrievalResponse(
-            messages=self.messages
+            messages=self.sessions.get(request.session_id).messages
         )
 
-class ScoreOperation(BusinessOperation):
+
+class ScoreOperation(ConversationBaseOperation):
     def __init__(self):
-        self.model = None
+        super().__init__()
+        self.messages = []
 
     #*==================== INIT ====================#
-    #*INFO: Serves as a belief system
-    def init_belief_tools(self):
-        belief_tools = []
-        file_path = f"{SRC_PATH}/tools/belief_tools.json"
-        try:
-            with open(file_path, "r") as file:
-                belief_tools = json.load(file)
-                #* Appends prompt to ChatOperation.messages
-                belief_tools = belief_tools
-
-        except FileNotFoundError:
-            print(f"Error: {file_path} not found.")
+    #*INFO: Serves as a belief system: tools, map and system prompt, compiled once per process
+    #* and reloaded when one of the files changes
+    def init_beliefs(self):
+        self.belief_config = BeliefConfig.shared(SRC_PATH)
+        self.beliefs = None
+        self._load_beliefs(self.belief_config.current(self.log_warning))
 
-        return belief_tools
-
-    #*INFO: Initialize round_data with keys and values from last_scores to ensure all keys are present
-    def init_belief_map(self):
-        belief_map = {}
-        file_path = f"{SRC_PATH}/tools/belief_map.json"
-        try:
-            with open(file_path, "r") as file:
-                belief_map = json.load(file)
-                #* Appends prompt to ChatOperation.messages
-                belief_map = belief_map
+    #*INFO: Sessions (and the score store) are only rebuilt when the belief keys themselves change
+    def _load_beliefs(self, beliefs: CompiledBeliefs):
+        categories_changed = (
+            self.beliefs is None or beliefs.categories != self.beliefs.categories
+        )
+        self.beliefs = beliefs
+        self.belief_tools = beliefs.tools
+        self.belief_map = beliefs.belief_map
+        #* Pinned to every new session, updated in place so the session store sees it
+        self.messages[:] = (
+            [{"role": "system", "content": beliefs.prompt}] if beliefs.prompt else []
+        )
 
-        except FileNotFoundError:
-            print(f"Error: {file_path} not found.")
+        if categories_changed:
+            self.init_sessions(
+                pinned=self.messages, score_categories=beliefs.categories
+            )
+            self.init_score_store(beliefs.categories)
 
-        return belief_map
+    #*INFO: score_store=iris keeps every scored round in IRIS, with rollups across sessions, none keeps them in memory only
+    def init_score_store(self, categories: dict):
+        if not hasattr(self, "score_store"):
+            self.score_store = SCORE_STORE
+        if self.score_store == "none":
+            self.belief_store = None
+            return
+        if self.score_store != "iris":
+            raise ValueError(f"Unknown score_store: {self.score_store}")
 
-    # Provides context to the model
-    def init_system_prompt(self):
-        file_path = f"{SRC_PATH}/prompts/belief_prompt.txt"
-        try:
-            with open(file_path, "r") as file:
-                prompt_content = file.read()
-                #* Appends prompt to ScoreOperation.messages
-                self.messages.append({"role": "system", "content": prompt_content})
-        except FileNotFoundError:
-            print(f"Error: {file_path} not found.")
+        #* Same pool settings as the vector operations, whichever starts first in the job sizes the pool
+        self.init_database()
+        self.belief_store = BeliefStore(self.database, categories)
 
     def on_init(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError(
-                "API Key not found. Please set OPENAI_API_KEY in your .env file."
-            )
+        self.init_model()
+
+        # generate: a second completion turns the belief prompt into advice for the chat agent
+        # template: the templated belief prompt is returned as is, saving one model call per turn
+        if not hasattr(self, "score_mode"):
+            self.score_mode = "generate"
+        # model used for the tool-call (scoring) step, a smaller model is usually enough
+        if not hasattr(self, "score_model"):
+            self.score_model = MODEL_NAME
 
-        self.model = OpenAI(api_key=api_key)
-        self.belief_tools = self.init_belief_tools()
-        self.belief_map = self.init_belief_map()
         self.belief_prompt = ""
-        self.scores = []
         self.messages = []
+        self.init_beliefs()
 
-        self.init_system_prompt()
     #*==================== INIT ====================#
 
-    def clear(self, request: ChatClearRequest):
-        self.on_init()
+    #*INFO: A turn answered from the response cache: its messages join the transcript, the scores carry over
+    def append_history(self, request: ChatHistoryAppendRequest):
+        with self.sessions.session(request.session_id) as session:
+            session.transcript.extend(request.messages)
 
     def retrieve_scores(self, request: ScoreRetrievalRequest):
         return ScoreRetrievalResponse(
-            scores=self.scores
+            scores=self.sessions.get(request.session_id).scores.rounds()
         )
 
-    def retrieve_beliefs(self, request: BeliefRetrievalRequest):
-        return BeliefRetrievalResponse(
-            beliefs=self.belief_map
+    #*INFO: Only the rounds after the caller's cursor, so polling costs the same however long the session
+    def retrieve_score_delta(self, request: ScoreDeltaRetrievalRequest):
+        return ScoreDeltaRetrievalResponse(
+            **self.sessions.get(request.session_id).scores.since(request.cursor)
         )
 
-    def create_belief_prompt(self, round_data) -> str:
-        self.belief_prompt = "The [SCORING AGENT] evaluated the [USER]'s beliefs and recommend the following: \n"
-
-        for key, value in round_data.items():
-            belief = self.belief_map[key]
-            if value == -1:
-                self.belief_prompt += (
-                    "[ASSISTANT] can help [USER] understand that {}. \n".format(belief)
-                )
-            if value == 1:
-                self.belief_prompt += (
-                    "[ASSISTANT] can affirm [USER]'s belief that {}. \n".format(belief)
-                )
-            if value == 0:
-                self.belief_prompt += "[ASSISTANT] can ask [USER] whether they believe that {}. \n".format(
-                    belief
-                )
+    #*INFO: Read from the rollups, so the cost does not grow with the number of sessions
+    def retrieve_population_scores(self, request: PopulationScoreRetrievalRequest):
+        return PopulationScoreRetrievalResponse(
+            population=self.belief_store.population() if self.belief_store else {}
+        )
 
-        return self.belief_prompt
+    def retrieve_beliefs(self, request: BeliefRetrievalRequest):
+        return BeliefRetrievalResponse(beliefs=self.belief_map)
 
     #*INFO: Derive the scores, belief prompt from the user's messages
     def ask(self, request: ChatRequest):
-        response_message = self.model.chat.completions.create(
-                        model=MODEL_NAME,
-                        messages=request.messages,
-                        tools=self.belief_tools,
-                        tool_choice="auto",
-                    ).choices[0].message
-
-        tool_calls = response_message.tool_calls
-
-        # Initialize round_data with keys and values from last_scores to ensure all keys are present
-        round_data = {key: 0 for key in self.belief_map.keys()}
-
-        # Update round_data with values from tool_calls
-        if tool_calls:
-            for tool_call in tool_calls:
-                function_args = json.loads(tool_call.function.arguments)
-                round_data.update(function_args)
-
-        # Fill in zeros in round_data with values from last_scores
-        if self.scores:
-            last_scores = self.scores[-1]
-            for key, value in round_data.items():
-                if value == 0 and key in last_scores:
-                    round_data[key] = last_scores[key]
-
-        # Add the updated round_data to self.scores
-        self.scores.append(round_data)
-        # Convert round_data to text recommendations to the Cancer Assistant
-        self.belief_prompt = self.create_belief_prompt(round_data)
-        # self.messages.append({"role": "assistant", "content": self.belief_prompt})
-        self.messages.append({"role": "system", "content": self.belief_prompt})
-
-        return ChatResponse(
-            response=self.model.chat.completions.create(
+        beliefs = self.belief_config.current(self.log_warning)
+        if beliefs is not self.beliefs:
+            self._load_beliefs(beliefs)
+        with self.sessions.session(request.session_id) as session:
+            return self._score(beliefs, session, request)
+
+    def _score(
+        self, beliefs: CompiledBeliefs, session: Session, request: ChatRequest
+    ) -> ScoreResponse:
+        session.transcript.extend(request.messages)
+        # Scores carry over between rounds, so only the most recent turns need scoring,
+        # after the pinned belief system prompt (the window's budget already leaves room for it)
+        response_message = (
+            self.model.complete(
+                model=self.score_model,
+                messages=session.pinned
+                + trim_to_budget(list(session.transcript), session.history.budget),
+                tools=beliefs.tools,
+                tool_choice="auto",
+            )
+            .choices[0]
+            .message
+        )
+
+        tool_calls = response_message.tool_calls or []
+
+        # Scores of this round as a state vector, one slot per belief key
+        state = beliefs.state(
+            [json.loads(tool_call.function.arguments) for tool_call in tool_calls]
+        )
+
+        # Beliefs left undetermined (0) this round keep their last score
+        last_state = session.scores.last_state()
+        if last_state is not None:
+            state = np.where(state == 0, last_state, state)
+
+        session.scores.append_state(state)
+        round_data = beliefs.as_dict(state)
+        if self.belief_store:
+            try:
+                self.belief_store.record(request.session_id, round_data)
+            except Exception as e:
+                #* Analytics only, a failed write does not fail the turn
+                self.log_warning(f"Failed to store belief scores: {e}")
+        # Convert the scores to text recommendations to the Cancer Assistant, from prebuilt sentences
+        self.belief_prompt = beliefs.render(state)
+
+        if self.score_mode == "template":
+            return ScoreResponse(response=self.belief_prompt, scores=round_data)
+
+        # session.add_message({"role": "assistant", "content": self.belief_prompt})
+        session.add_message({"role": "system", "content": self.belief_prompt})
+
+        return ScoreResponse(
+            response=self.model.complete(
                 model=MODEL_NAME,
-                messages=self.messages,
+                messages=session.messages,
             )
             .choices[0]
-            .message.content
+            .message.content,
+            scores=round_data,
         )
+
+
+#*==================== CONVERSATIONS ====================#
@@ -1,13 +1,30 @@
+import iris
 from grongier.pex import BusinessProcess
+
 from rag.msg import (
     BeliefRetrievalRequest,
+    BulkIngestionRequest,
+    CacheStatsRetrievalRequest,
     ChatClearRequest,
+    ChatHistoryAppendRequest,
+    ChatPipelineState,
     ChatRequest,
+    ChatResponse,
     ChatRetrievalRequest,
     FileIngestionRequest,
+    IndexRebuildRequest,
+    IndexRestoreRequest,
+    IndexSnapshotRequest,
+    PoolStatsRetrievalRequest,
+    PopulationScoreRetrievalRequest,
+    ResponseCacheStoreRequest,
+    ScoreDeltaRetrievalRequest,
+    ScoreResponse,
     ScoreRetrievalRequest,
     VectorSearchRequest,
+    VectorSearchResponse,
 )
+from rag.stream import StreamChannel
 
 
 class ChatProcess(BusinessProcess):
@@ -21,54 +38,218 @@ class ChatProcess(BusinessProcess):
         self.score_agent = None
         self.chat_agent = None
         self.target_vector = None
+        self.snapshot_target = None
 
     def on_init(self):
         if not hasattr(self, "target_vector"):
             self.target_vector = "IrisVectorOperation"
+        # snapshots are taken of a local (Chroma) collection, held by this operation
+        if not hasattr(self, "snapshot_target"):
+            self.snapshot_target = "ChromaVectorOperation"
         if not hasattr(self, "chat_agent"):
             self.chat_agent = "ChatOperation"
         if not hasattr(self, "score_agent"):
             self.score_agent = "ScoreOperation"
+        # sequential: score, then retrieve with the belief prompt, then chat
+        # concurrent: score and retrieve (raw user query) in parallel, then chat
+        if not hasattr(self, "pipeline"):
+            self.pipeline = "sequential"
+        # answers to repeated questions are served from the response cache held by target_vector
+        if not hasattr(self, "response_cache"):
+            self.response_cache = "true"
+        self.use_response_cache = str(self.response_cache).lower() in (
+            "1",
+            "true",
+            "yes",
+        )
 
-        # prompt template for retrieving relevant snippets
-        self.rag_query_template = "The following is the USER's last message. Please identify the relevant snippets if " \
-                                  "any. If there are no relevant snippets, only reply NIL\n {query}"
+        # retrieval knobs, forwarded with every VectorSearchRequest
+        if not hasattr(self, "rag_k"):
+            self.rag_k = 4
+        if not hasattr(self, "rag_score_threshold"):
+            self.rag_score_threshold = 0.0
+        if not hasattr(self, "rag_max_tokens"):
+            self.rag_max_tokens = 1500
 
         # prompt template for retrieval augmented query
-        self.rag_response_template = "The following is the USER's last message: {query}.Only use information from the " \
-                                     "following snippets to provide an answer. If there are no relevant snippets, " \
-                                     "do not assume any context about the user. \n {context}"
+        self.rag_response_template = (
+            "The following is the USER's last message: {query}.Only use information from the "
+            "following snippets to provide an answer. If there are no relevant snippets, "
+            "do not assume any context about the user. \n {context}"
+        )
 
     def ask(self, request: ChatRequest):
-        #*INFO: (1) send user query to score agent
+        if self.pipeline == "concurrent":
+            return self._ask_concurrent(request)
+
+        #*INFO: (1) retrieve the snippets relevant to the user's own words,
+        #* or the answer if the question was already asked in the same conversation
         user_query = request.messages[-1]["content"]
-        chat_request = ChatRequest(messages=request.messages)
+        raw_query = user_query
+        rag_request = self._rag_request(request, raw_query)
+        rag_response = self.send_request_sync(self.target_vector, rag_request)
+        if rag_response.cached_response:
+            # the score agent is skipped too, it only gets the turn added to its session
+            self.send_request_async(
+                self.score_agent,
+                ChatHistoryAppendRequest(
+                    messages=request.messages, session_id=request.session_id
+                ),
+            )
+            return self._cached_response(request, rag_response.cached_response)
+
+        #*INFO: (2) send user query to score agent
+        chat_request = ChatRequest(
+            messages=request.messages, session_id=request.session_id
+        )
         belief_prompt = self.send_request_sync(self.score_agent, chat_request)
         if belief_prompt:
             user_query += "\n" + belief_prompt.response
 
-        #*INFO: (2) form retrieval (belief) response
-        rag_query = self.rag_query_template.format(query=user_query)
-        rag_request = VectorSearchRequest(query=rag_query)
-        rag_response = self.send_request_sync(self.target_vector, rag_request)
-        if rag_response.docs:
-            context = "\n".join([doc["page_content"] for doc in rag_response.docs])
-            prompt = self.rag_response_template.format(context=context, query=user_query)
+        #*INFO: (3) send full response to chat agent
+        chat_response = self._chat(request, user_query, rag_response.docs)
+        self._cache_response(request, chat_response)
+        return chat_response
+
+    #*INFO: Only the user's text is embedded, instructions and belief prompts would just dilute the search
+    def _rag_request(self, request: ChatRequest, query: str) -> VectorSearchRequest:
+        return VectorSearchRequest(
+            query=query,
+            session_id=request.session_id,
+            k=int(self.rag_k),
+            score_threshold=float(self.rag_score_threshold),
+            max_tokens=int(self.rag_max_tokens),
+            history_hash=request.history_hash if self.use_response_cache else "",
+        )
+
+    def _chat(self, request: ChatRequest, user_query: str, docs: list):
+        if docs:
+            context = "\n".join([doc["page_content"] for doc in docs])
+            prompt = self.rag_response_template.format(
+                context=context, query=user_query
+            )
         else:
             prompt = user_query
 
-        #*INFO: (3) send full response to chat agent
-        # request.messages.append({"role": "assistant", "content": prompt})
-        request.messages[-1]["content"] = prompt
-        chat_request = ChatRequest(messages=request.messages)
+        # ChatOperation holds the history, it only needs the prompt for this turn
+        chat_request = ChatRequest(
+            messages=[{"role": request.messages[-1]["role"], "content": prompt}],
+            session_id=request.session_id,
+            stream_id=request.stream_id,
+        )
         # send message to invoke ChatOperation.ask
-        chat_response = self.send_request_sync(self.chat_agent, chat_request)
+        return self.send_request_sync(self.chat_agent, chat_request)
+
+    #*==================== RESPONSE CACHE ====================#
+    #*INFO: Answers are keyed by the conversation the question is asked in (ChatRequest.history_hash),
+    #* looked up by target_vector together with the similarity search
+    def _cached_response(self, request: ChatRequest, response: str):
+        # The chat agent did not see this turn, add it to its session so follow-up questions keep the context
+        # (fire and forget, the answer does not wait on it)
+        self.send_request_async(
+            self.chat_agent,
+            ChatHistoryAppendRequest(
+                messages=[
+                    {
+                        "role": request.messages[-1]["role"],
+                        "content": request.messages[-1]["content"],
+                    },
+                    {"role": "assistant", "content": response},
+                ],
+                session_id=request.session_id,
+            ),
+        )
+
+        # The caller is waiting on the stream channel, so hand it the whole answer at once
+        if request.stream_id:
+            channel = StreamChannel(request.stream_id)
+            channel.write(response)
+            channel.close()
+        return ChatResponse(response=response)
+
+    def _cache_response(self, request: ChatRequest, chat_response: ChatResponse):
+        if (
+            not self.use_response_cache
+            or not request.history_hash
+            or not chat_response
+            or not chat_response.response
+        ):
+            return
+
+        store_request = ResponseCacheStoreRequest(
+            query=request.messages[-1]["content"],
+            history_hash=request.history_hash,
+            response=chat_response.response,
+        )
+        # fire and forget, nothing waits on the cache being written
+        self.send_request_async(self.target_vector, store_request)
+
+    #*==================== RESPONSE CACHE ====================#
+
+    #*==================== CONCURRENT PIPELINE ====================#
+    #*INFO: Scoring and retrieval are sent asynchronously, their responses are collected in on_response
+    #* and the chat agent is called from on_complete once both have arrived
+    #* Messages are serialized by the same decorator as BusinessProcess.send_request_async's
+    @BusinessProcess.input_serialzer
+    def _send_request_async(self, target: str, request, completion_key: str):
+        # BusinessProcess.send_request_async does not ask for a response, so go through Ens.BusinessProcess
+        status = self.iris_handle.SendRequestAsync(target, request, 1, completion_key)
+        # raised like a failed send_request_sync, rather than leaving on_complete waiting on a response
+        if iris.cls("%SYSTEM.Status").IsError(status):
+            raise RuntimeError(
+                f"Failed to send {completion_key} request to {target}: "
+                f"{iris.cls('%SYSTEM.Status').GetErrorText(status)}"
+            )
+
+    def _ask_concurrent(self, request: ChatRequest):
+        user_query = request.messages[-1]["content"]
+
+        chat_request = ChatRequest(
+            messages=request.messages, session_id=request.session_id
+        )
+        self._send_request_async(self.score_agent, chat_request, "score")
+
+        rag_request = self._rag_request(request, user_query)
+        self._send_request_async(self.target_vector, rag_request, "rag")
 
+        return ChatPipelineState()
+
+    def on_response(
+        self, request, response, call_request, call_response, completion_key
+    ):
+        state = (
+            response if isinstance(response, ChatPipelineState) else ChatPipelineState()
+        )
+        if completion_key == "score" and isinstance(call_response, ChatResponse):
+            state.belief_prompt = call_response.response
+            if isinstance(call_response, ScoreResponse):
+                state.scores = call_response.scores
+        elif completion_key == "rag" and isinstance(
+            call_response, VectorSearchResponse
+        ):
+            state.docs = call_response.docs
+            state.cached_response = call_response.cached_response
+        return state
+
+    def on_complete(self, request, response):
+        if not isinstance(response, ChatPipelineState):
+            return response
+
+        # the score agent was sent the turn alongside the lookup, only the chat agent missed it
+        if response.cached_response:
+            return self._cached_response(request, response.cached_response)
+
+        user_query = request.messages[-1]["content"]
+        if response.belief_prompt:
+            user_query += "\n" + response.belief_prompt
+        chat_response = self._chat(request, user_query, response.docs)
+        self._cache_response(request, chat_response)
         return chat_response
 
+    #*==================== CONCURRENT PIPELINE ====================#
+
+    #*INFO: Only resets conversation state, the knowledge base is left untouched
     def clear(self, request: ChatClearRequest):
-        # send message to invoke IrisVectorOperation.clear
-        self.send_request_sync(self.target_vector, request)
         # send message to invoke ScoreOperation.clear
         self.send_request_sync(self.score_agent, request)
         # send message to invoke ChatOperation.clear
@@ -78,6 +259,29 @@ class ChatProcess(BusinessProcess):
         # send message to invoke IrisVectorOperation.ingest
         self.send_request_sync(self.target_vector, request)
 
+    def ingest_bulk(self, request: BulkIngestionRequest):
+        # send message to invoke IrisVectorOperation.ingest_bulk
+        return self.send_request_sync(self.target_vector, request)
+
+    def rebuild_index(self, request: IndexRebuildRequest):
+        # send message to invoke IrisVectorOperation.rebuild
+        self.send_request_sync(self.target_vector, request)
+
+    def snapshot_index(self, request: IndexSnapshotRequest):
+        # send message to invoke ChromaVectorOperation.snapshot
+        return self.send_request_sync(self._snapshot_target(), request)
+
+    def restore_index(self, request: IndexRestoreRequest):
+        # send message to invoke ChromaVectorOperation.restore
+        return self.send_request_sync(self._snapshot_target(), request)
+
+    def _snapshot_target(self) -> str:
+        if not iris.cls("Ens.Director").IsItemEnabled(self.snapshot_target):
+            raise ValueError(
+                f"snapshot_target {self.snapshot_target!r} is not an enabled item of the production"
+            )
+        return self.snapshot_target
+
     def retrieve_messages(self, request: ChatRetrievalRequest):
         # send message to invoke ChatOperation.retrieve_messages
         return self.send_request_sync(self.chat_agent, request)
@@ -86,6 +290,22 @@ class ChatProcess(BusinessProcess):
         # send message to invoke ScoreOperation.retrieve_scores
         return self.send_request_sync(self.score_agent, request)
 
+    def retrieve_score_delta(self, request: ScoreDeltaRetrievalRequest):
+        # send message to invoke ScoreOperation.retrieve_score_delta
+        return self.send_request_sync(self.score_agent, request)
+
+    def retrieve_population_scores(self, request: PopulationScoreRetrievalRequest):
+        # send message to invoke ScoreOperation.retrieve_population_scores
+        return self.send_request_sync(self.score_agent, request)
+
     def retrieve_beliefs(self, request: BeliefRetrievalRequest):
         # send message to invoke ScoreOperation.retrieve_beliefs
         return self.send_request_sync(self.score_agent, request)
+
+    def retrieve_cache_stats(self, request: CacheStatsRetrievalRequest):
+        # send message to invoke IrisVectorOperation.retrieve_cache_stats
+        return self.send_request_sync(self.target_vector, request)
+
+    def retrieve_pool_stats(self, request: PoolStatsRetrievalRequest):
+        # send message to invoke IrisVectorOperation.retrieve_pool_stats
+        return self.send_request_sync(self.target_vector, request)
@@ -1,5 +1,27 @@
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 from grongier.pex import BusinessService
-from rag.msg import BeliefRetrievalRequest, ChatClearRequest, ChatRequest, ChatRetrievalRequest, FileIngestionRequest, ScoreRetrievalRequest
+
+from rag.cache import history_hash
+from rag.msg import (
+    BeliefRetrievalRequest,
+    BulkIngestionRequest,
+    CacheStatsRetrievalRequest,
+    ChatClearRequest,
+    ChatRequest,
+    ChatRetrievalRequest,
+    FileIngestionRequest,
+    IndexRebuildRequest,
+    IndexRestoreRequest,
+    IndexSnapshotRequest,
+    PoolStatsRetrievalRequest,
+    PopulationScoreRetrievalRequest,
+    ScoreDeltaRetrievalRequest,
+    ScoreRetrievalRequest,
+)
+from rag.stream import StreamChannel
 
 
 class ChatService(BusinessService):
@@ -7,46 +29,143 @@ class ChatService(BusinessService):
         if not hasattr(self, "target"):
             self.target = "ChatProcess"
 
-    def ingest(self, file_path: str):
-        # build message
-        msg = FileIngestionRequest(file_path=file_path)
-        # send message
-        self.send_request_sync(self.target, msg)
+    def ingest(self, file_path: str, on_progress=None, source: str = ""):
+        if on_progress is None:
+            # build message
+            msg = FileIngestionRequest(file_path=file_path, source=source)
+            # send message
+            self.send_request_sync(self.target, msg)
+            return
 
-    def ask(self, messages: list, rag: bool = False):
+        # build message, progress events are read from the channel while the request runs
+        msg = FileIngestionRequest(
+            file_path=file_path, source=source, progress_id=str(uuid.uuid4())
+        )
+        channel = StreamChannel(msg.progress_id)
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(self.send_request_sync, self.target, msg)
+                for event in channel.read(until=future.done):
+                    on_progress(json.loads(event))
+                future.result()
+        finally:
+            # the request is over here (the executor waited for it), even if it or on_progress failed
+            channel.discard()
+
+    def ingest_bulk(self, file_paths: list = None, directory: str = ""):
         # build message
-        msg = ChatRequest(messages=messages)
+        msg = BulkIngestionRequest(file_paths=file_paths, directory=directory)
+        # send message to invoke ChatProcess.ingest_bulk
+        response = self.send_request_sync(self.target, msg)
+        # return per-file reports
+        return response.files
+
+    def ask(
+        self,
+        messages: list,
+        rag: bool = False,
+        session_id: str = "",
+        stream_id: str = "",
+    ):
+        # build message, only the newest turn crosses the message layer (its size no longer grows with the chat)
+        msg = ChatRequest(
+            messages=messages[-2:],
+            session_id=session_id,
+            stream_id=stream_id,
+            # the response cache key, from the history only this side holds in full
+            history_hash=history_hash(messages[:-1]),
+        )
         # send message to invoke ChatProcess.ask
         response = self.send_request_sync(self.target, msg)
         # return response
         return response.response
 
-    def clear(self):
+    def clear(self, session_id: str = ""):
         # build message
-        msg = ChatClearRequest()
+        msg = ChatClearRequest(session_id=session_id)
         # send message to invoke ChatProcess.clear
         self.send_request_sync(self.target, msg)
 
-    def retrieve_messages(self):
+    def rebuild_index(self):
+        # build message
+        msg = IndexRebuildRequest()
+        # send message to invoke ChatProcess.rebuild_index
+        self.send_request_sync(self.target, msg)
+
+    def snapshot_index(self, path: str = ""):
+        # build message
+        msg = IndexSnapshotRequest(path=path)
+        # send message to invoke ChatProcess.snapshot_index
+        response = self.send_request_sync(self.target, msg)
+        # return where the snapshot was written
+        return response.path
+
+    def restore_index(self, path: str):
         # build message
-        msg = ChatRetrievalRequest()
+        msg = IndexRestoreRequest(path=path)
+        # send message to invoke ChatProcess.restore_index
+        response = self.send_request_sync(self.target, msg)
+        # return the number of restored chunks
+        return response.count
+
+    def retrieve_messages(self, session_id: str = ""):
+        # build message
+        msg = ChatRetrievalRequest(session_id=session_id)
         # send message
         response = self.send_request_sync(self.target, msg)
         # return response
         return response.messages
 
-    def retrieve_scores(self):
+    def retrieve_scores(self, session_id: str = ""):
         # build message
-        msg = ScoreRetrievalRequest()
+        msg = ScoreRetrievalRequest(session_id=session_id)
         # send message
         response = self.send_request_sync(self.target, msg)
         # return response
         return response.scores
 
+    def retrieve_population_scores(self):
+        # build message
+        msg = PopulationScoreRetrievalRequest()
+        # send message
+        response = self.send_request_sync(self.target, msg)
+        # return response
+        return response.population
+
+    def retrieve_score_delta(self, session_id: str = "", cursor: int = 0):
+        # build message
+        msg = ScoreDeltaRetrievalRequest(session_id=session_id, cursor=cursor)
+        # send message
+        response = self.send_request_sync(self.target, msg)
+        # return the rounds from cursor on, column-wise
+        return {
+            "start": response.start,
+            "cursor": response.cursor,
+            "scores": response.scores,
+            "category_scores": response.category_scores,
+            "running_means": response.running_means,
+        }
+
     def retrieve_beliefs(self):
         # build message
         msg = BeliefRetrievalRequest()
         # send message
         response = self.send_request_sync(self.target, msg)
         # return response
-        return response.beliefs
\ No newline at end of file
+        return response.beliefs
+
+    def retrieve_cache_stats(self):
+        # build message
+        msg = CacheStatsRetrievalRequest()
+        # send message
+        response = self.send_request_sync(self.target, msg)
+        # return response
+        return response.stats
+
+    def retrieve_pool_stats(self):
+        # build message
+        msg = PoolStatsRetrievalRequest()
+        # send message
+        response = self.send_request_sync(self.target, msg)
+        # return response
+        return response.stats
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().strip("?!. ").lower()
+
+
+#*INFO: Hashes the conversation a question is asked in, computed by the caller from the messages it already holds
+def history_hash(messages: list) -> str:
+    turns = [(message["role"], message["content"]) for message in messages or []]
+    return hashlib.sha1(json.dumps(turns).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    cache of answered questions, keyed by the normalised query and the conversation it was asked in
+    exact matches are looked up by key, near matches by cosine similarity of the query embeddings
+    entries expire after `ttl` seconds and the least recently used are evicted past `capacity`
+    """
+
+    def __init__(
+        self, embeddings, capacity: int = 256, ttl: int = 3600, threshold: float = 0.92
+    ):
+        self.embeddings = embeddings
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        # (history_hash, normalised query) -> entry, least recently used first
+        self.entries = OrderedDict()
+        # normalised query -> embedding of the latest lookups, so storing the answer does not embed again
+        self.embedded = OrderedDict()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [
+            key
+            for key, entry in self.entries.items()
+            if now - entry["created"] > self.ttl
+        ]:
+            del self.entries[key]
+
+    def _embed(self, query: str, embedding: list = None) -> np.ndarray:
+        if embedding is None:
+            with self._lock:
+                embedding = self.embedded.get(query)
+            if embedding is not None:
+                return embedding
+            embedding = self.embeddings.embed_query(query)
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self._lock:
+            self.embedded[query] = embedding
+            while len(self.embedded) > self.capacity:
+                self.embedded.popitem(last=False)
+        return embedding
+
+    def get(self, query: str, history_hash: str, embedding: list = None):
+        """
+        `embedding` is the query's, when the caller already has it (e.g. for the similarity search)
+        """
+        key = (history_hash, normalize_query(query))
+        with self._lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["response"]
+
+            candidates = [
+                (key, entry)
+                for key, entry in self.entries.items()
+                if key[0] == history_hash
+            ]
+
+        # embedded on every miss, put() for this query reuses it
+        embedding = self._embed(key[1], embedding)
+        if candidates:
+            similarities = (
+                np.stack([entry["embedding"] for _, entry in candidates]) @ embedding
+            )
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                with self._lock:
+                    match_key, entry = candidates[best]
+                    if match_key in self.entries:
+                        self.entries.move_to_end(match_key)
+                        self.near_hits += 1
+                        return entry["response"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, history_hash: str, response: str):
+        key = (history_hash, normalize_query(query))
+        embedding = self._embed(key[1])
+        with self._lock:
+            self.entries[key] = {
+                "response": response,
+                "embedding": embedding,
+                "created": time.monotonic(),
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "entries": len(self.entries),
+            "capacity": self.capacity,
+            "hits": hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
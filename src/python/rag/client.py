@@ -0,0 +1,84 @@
+import asyncio
+import functools
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from grongier.pex import Director
+
+HEALTH_CHECK_TTL = 30
+CLIENT_WORKERS = 8
+
+
+class ChatServiceClient:
+    """
+    process-wide client of the ChatService business service, shared by every Streamlit session and rerun
+    each call borrows a Director proxy from a pool, so concurrent sessions never share one,
+    and a proxy whose call fails is dropped in favour of a fresh one
+    """
+
+    def __init__(self, name: str = "ChatService", workers: int = CLIENT_WORKERS):
+        self.name = name
+        # idle proxies, created on demand
+        self.proxies = queue.SimpleQueue()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="chat-service"
+        )
+        self.checked_at = 0.0
+        self.is_healthy = False
+
+    def _connect(self):
+        return Director.create_python_business_service(self.name)
+
+    def _borrow(self):
+        try:
+            return self.proxies.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def call(self, method: str, *args, **kwargs):
+        proxy = self._borrow()
+        # A proxy whose call raised is not put back, the next call reconnects with a fresh one
+        # (calls are not retried here: asking or ingesting twice is worse than one error)
+        result = getattr(proxy, method)(*args, **kwargs)
+        self.proxies.put(proxy)
+        return result
+
+    def __getattr__(self, method: str):
+        # client.ask(...) is client.call("ask", ...), so pages use it like the service itself
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return functools.partial(self.call, method)
+
+    #*==================== ASYNC ====================#
+    def submit(self, method: str, *args, **kwargs):
+        """
+        runs the call on the client's own threads, returns a concurrent.futures.Future
+        """
+        return self.executor.submit(self.call, method, *args, **kwargs)
+
+    async def acall(self, method: str, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
+    #*==================== ASYNC ====================#
+
+    def healthy(self, max_age: float = HEALTH_CHECK_TTL) -> bool:
+        """
+        round-trips a cheap request through the production, at most once every `max_age` seconds
+        """
+        if time.monotonic() - self.checked_at < max_age:
+            return self.is_healthy
+        try:
+            self.call("retrieve_beliefs")
+            self.is_healthy = True
+        except Exception:
+            self.is_healthy = False
+        self.checked_at = time.monotonic()
+        return self.is_healthy
+
+
+@st.cache_resource
+def get_chat_service() -> ChatServiceClient:
+    #* Cached for the whole Streamlit process, reruns and pages reuse the same client
+    return ChatServiceClient("ChatService")
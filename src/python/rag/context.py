@@ -0,0 +1,98 @@
+from collections import deque
+from functools import lru_cache
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    #* tiktoken missing, or its encoding cannot be downloaded (e.g. offline), fall back to an estimate
+    _encoding = None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    if _encoding is None:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+
+def count_message_tokens(message: dict) -> int:
+    # ~4 tokens of per-message overhead for the role and separators
+    return count_tokens(message.get("content") or "") + 4
+
+
+def trim_to_budget(messages: list, budget: int) -> list:
+    """
+    returns the most recent messages that fit within the token budget (at least the last one)
+    """
+    trimmed = []
+    tokens = 0
+    for message in reversed(messages):
+        tokens += count_message_tokens(message)
+        if trimmed and tokens > budget:
+            break
+        trimmed.append(message)
+    return trimmed[::-1]
+
+
+class ContextWindow:
+    """
+    keeps the most recent messages within a token budget and a maximum number of messages
+    messages sliding out of the window are folded into a rolling summary, if a summarizer is given
+    token counts are kept per message, so appending never recounts the whole window
+    """
+
+    def __init__(self, budget: int = 6000, max_messages: int = 50, summarize=None):
+        self.budget = budget
+        self.max_messages = max_messages
+        self.summarize = summarize
+        # (message, tokens), oldest first
+        self.window = deque()
+        self.tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    @property
+    def messages(self) -> list:
+        messages = [message for message, _ in self.window]
+        if self.summary:
+            summary = {
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {self.summary}",
+            }
+            messages.insert(0, summary)
+        return messages
+
+    def restore(self, messages: list, summary: str = ""):
+        """
+        replaces the window with `messages` (oldest first) and the summary they follow, as they were saved
+        """
+        self.window = deque(
+            (message, count_message_tokens(message)) for message in messages
+        )
+        self.tokens = sum(tokens for _, tokens in self.window)
+        self.summary = summary
+        self.summary_tokens = count_tokens(summary) if summary else 0
+
+    def append(self, message: dict):
+        tokens = count_message_tokens(message)
+        self.window.append((message, tokens))
+        self.tokens += tokens
+
+        evicted = []
+        while len(self.window) > 1 and (
+            self.tokens + self.summary_tokens > self.budget
+            or len(self.window) > self.max_messages
+        ):
+            message, tokens = self.window.popleft()
+            self.tokens -= tokens
+            evicted.append(message)
+
+        #* The summary is only recomputed when the window slides
+        if evicted and self.summarize is not None:
+            self.summary = self.summarize(self.summary, evicted)
+            self.summary_tokens = count_tokens(self.summary)
@@ -0,0 +1,143 @@
+import contextlib
+import threading
+import time
+
+from langchain_iris import IRISVector
+from sqlalchemy import MetaData, create_engine
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+IRIS_URL = "iris+emb:///"
+
+
+class Database:
+    """
+    process-wide SQLAlchemy engine with a tuned connection pool, shared by every IRIS-backed
+    operation in the job; statements built once and executed with bound parameters hit the
+    engine's compiled statement cache
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        url: str = IRIS_URL,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 1800,
+    ):
+        self.url = url
+        self.max_overflow = max_overflow
+        self.engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=True,
+        )
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, url: str = IRIS_URL, **pool_args) -> "Database":
+        """
+        returns the engine for `url`, created on first use (later pool arguments are ignored)
+        """
+        with cls._instances_lock:
+            database = cls._instances.get(url)
+            if database is None:
+                database = cls._instances[url] = cls(url, **pool_args)
+            return database
+
+    @contextlib.contextmanager
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = self.engine.connect()
+        except PoolTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextlib.contextmanager
+    def begin(self):
+        with self.connect() as connection, connection.begin():
+            yield connection
+
+    def create_all(self, metadata: MetaData):
+        """
+        creates the tables of `metadata` that do not exist yet, on a pooled connection
+        """
+        try:
+            with self.begin() as connection:
+                metadata.create_all(connection, checkfirst=True)
+        except DatabaseError:
+            # another job created them between the check and the CREATE
+            with self.begin() as connection:
+                metadata.create_all(connection, checkfirst=True)
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": self.max_overflow,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.wait_seconds / self.checkouts * 1000
+            if self.checkouts
+            else 0.0,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+        }
+
+
+class PooledIRISVector(IRISVector):
+    """
+    IRISVector that borrows a pooled connection only to create its table,
+    reads and writes go through the operation's own statements on the shared pool,
+    each borrowing a connection of its own
+    """
+
+    def __init__(self, database: Database, **kwargs):
+        self.database = database
+        with database.connect() as connection:
+            super().__init__(
+                connection_string=database.url, connection=connection, **kwargs
+            )
+        #* The connection is back in the pool (possibly lent to another thread), it must not be used from here on
+        self._conn = None
+
+    @contextlib.contextmanager
+    def _make_session(self):
+        with self.database.connect() as connection:
+            yield Session(connection)
+
+    def __post_init__(self):
+        #* connect() is skipped when a connection is passed in, so vector support is detected here
+        self.native_vector = getattr(self._conn.dialect, "supports_vectors", False)
+        self.native_vector_cosine_similarity = getattr(
+            self._conn.dialect, "vector_cosine_similarity", False
+        )
+        super().__post_init__()
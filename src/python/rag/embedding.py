@@ -0,0 +1,312 @@
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    on-disk cache of embeddings keyed by (embedding model name, chunk text hash)
+    vectors are kept in a memory-mapped float32 matrix, the index maps each key to its row (slot)
+    once the cache holds `capacity` entries, the least recently used entry is evicted
+    a cache directory has a single writer: an instance that cannot take its lock (another job holds it)
+    keeps its entries in memory only and never touches the files
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, capacity: int = 20000):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.cache_dir = os.path.join(
+            cache_dir, hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:12]
+        )
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.lock_file = None
+
+        self.dimension = None
+        self.vectors = None
+        # key -> slot, least recently used first
+        self.slots = OrderedDict()
+        self.free_slots = []
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.persistent = self._acquire()
+        if self.persistent:
+            self._load()
+
+    def _acquire(self) -> bool:
+        # held for the life of the instance, released by the OS if the job dies
+        os.makedirs(self.cache_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.cache_dir, "lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = None
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.model_name}\x00{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vectors_path)):
+            return
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        #* A cache written for another model or capacity is rebuilt on the next write
+        if (
+            index.get("model") != self.model_name
+            or index.get("capacity") != self.capacity
+        ):
+            return
+
+        self.dimension = index["dimension"]
+        self.vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(self.capacity, self.dimension),
+        )
+        self.slots = OrderedDict((key, slot) for key, slot in index["slots"])
+        used_slots = set(self.slots.values())
+        self.free_slots = [
+            slot for slot in reversed(range(self.capacity)) if slot not in used_slots
+        ]
+
+    def _allocate(self, dimension: int):
+        self.dimension = dimension
+        self.slots = OrderedDict()
+        if not self.persistent:
+            self.vectors = np.zeros((self.capacity, dimension), dtype=np.float32)
+            self.free_slots = list(reversed(range(self.capacity)))
+            return
+
+        size = self.capacity * dimension * np.dtype(np.float32).itemsize
+        if (
+            not os.path.exists(self.vectors_path)
+            or os.path.getsize(self.vectors_path) != size
+        ):
+            # only ever a file this instance owns (it holds the lock), sized for the new shape
+            with open(self.vectors_path, "wb") as file:
+                file.truncate(size)
+        self.vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(self.capacity, dimension),
+        )
+        self.free_slots = list(reversed(range(self.capacity)))
+
+    def get(self, text: str):
+        key = self.key(text)
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+
+            self.slots.move_to_end(key)
+            self.hits += 1
+            return self.vectors[slot].tolist()
+
+    def put(self, text: str, embedding: List[float]):
+        key = self.key(text)
+        with self._lock:
+            if self.vectors is None or len(embedding) != self.dimension:
+                self._allocate(len(embedding))
+
+            slot = self.slots.get(key)
+            if slot is None:
+                if not self.free_slots:
+                    _, evicted_slot = self.slots.popitem(last=False)
+                    self.free_slots.append(evicted_slot)
+                    self.evictions += 1
+                slot = self.free_slots.pop()
+
+            self.vectors[slot] = np.asarray(embedding, dtype=np.float32)
+            self.slots[key] = slot
+            self.slots.move_to_end(key)
+
+    def flush(self):
+        with self._lock:
+            if self.vectors is None or not self.persistent:
+                return
+
+            self.vectors.flush()
+            index = {
+                "model": self.model_name,
+                "capacity": self.capacity,
+                "dimension": self.dimension,
+                "slots": list(self.slots.items()),
+            }
+            # Write-then-rename so a crash never leaves a truncated index behind
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(index, file)
+            os.replace(tmp_path, self.index_path)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self.slots),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self.persistent,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    wraps an embedding model so that documents already in the cache never reach the model
+    queries are passed through as they are rarely repeated verbatim
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = [self.cache.get(text) for text in texts]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embedding = [float(value) for value in embedding]
+                self.cache.put(texts[i], embedding)
+                results[i] = embedding
+            self.cache.flush()
+
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class EmbeddingService(Embeddings):
+    """
+    one embedding model per process, behind a micro-batching queue
+    concurrent embed_documents calls are coalesced into a single model call (waiting at most
+    `max_wait` seconds for company), identical texts in a batch are embedded once
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, model: Embeddings, max_batch: int = 64, max_wait: float = 0.002):
+        self.model = model
+        self.model_name = getattr(model, "model_name", type(model).__name__)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(
+            target=self._run, name="embedding-service", daemon=True
+        )
+        self.worker.start()
+
+    @classmethod
+    def shared(
+        cls, key: str, model_factory: Callable[[], Embeddings], **kwargs
+    ) -> "EmbeddingService":
+        """
+        returns the process-wide service for `key`, loading (and warming up) the model on first use
+        survives on_tear_down -> on_init, so a restarted operation reuses the loaded model
+        """
+        with cls._instances_lock:
+            service = cls._instances.get(key)
+            if service is None:
+                service = cls(model_factory(), **kwargs)
+                service.warm_up()
+                cls._instances[key] = service
+            return service
+
+    def warm_up(self):
+        #* The first call initialises the inference session, pay for it before the first user does
+        self.embed_documents(["warm up"])
+        self.embed_query("warm up")
+
+    def _submit(self, kind: str, texts: List[str]) -> list:
+        future = Future()
+        self.requests.put((kind, texts, future))
+        return future.result()
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        if kind == "query":
+            return [self.model.embed_query(text) for text in texts]
+        return self.model.embed_documents(texts)
+
+    def _run(self):
+        while True:
+            pending = [self.requests.get()]
+            size = len(pending[0][1])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    request = self.requests.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except queue.Empty:
+                    break
+                pending.append(request)
+                size += len(request[1])
+
+            for kind in ("documents", "query"):
+                batch = [
+                    (texts, future)
+                    for request_kind, texts, future in pending
+                    if request_kind == kind
+                ]
+                if not batch:
+                    continue
+                unique_texts = list(
+                    dict.fromkeys(text for texts, _ in batch for text in texts)
+                )
+                try:
+                    embeddings = dict(
+                        zip(unique_texts, self._embed(kind, unique_texts))
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                for texts, future in batch:
+                    future.set_result([embeddings[text] for text in texts])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._submit("documents", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit("query", [text])[0]
@@ -0,0 +1,182 @@
+import threading
+
+import numpy as np
+
+
+class IVFIndex:
+    """
+    in-process approximate nearest neighbour index (inverted file) over cosine distance
+    vectors are clustered around `nlist` k-means centroids, a search only scans the `nprobe`
+    clusters closest to the query; more probes trade latency for recall
+    below `min_train_size` vectors (or until trained) every search is an exact scan
+    """
+
+    def __init__(
+        self, nlist: int = 0, nprobe: int = 8, min_train_size: int = 1024, seed: int = 0
+    ):
+        # 0 picks sqrt(n) clusters when the index is (re)trained
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.seed = seed
+
+        self.ids = []
+        self.rows = {}
+        self.vectors = None
+        self.size = 0
+        # cluster centroids, None until trained, and the centroid each row belongs to
+        self.centroids = None
+        self.assignments = None
+        self.trained_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _grow(self, rows: int):
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if self.size + rows <= capacity:
+            return
+        vectors = np.empty(
+            (max(self.size + rows, capacity * 2, 64), self.dimension), dtype=np.float32
+        )
+        assignments = np.empty(vectors.shape[0], dtype=np.int32)
+        if self.vectors is not None:
+            vectors[: self.size] = self.vectors[: self.size]
+            assignments[: self.size] = self.assignments[: self.size]
+        self.vectors = vectors
+        self.assignments = assignments
+
+    @property
+    def dimension(self):
+        return None if self.vectors is None else self.vectors.shape[1]
+
+    #*==================== WRITER ====================#
+    def add(self, ids: list, embeddings: list):
+        if not ids:
+            return
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            if self.vectors is None:
+                self.vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+                self.assignments = np.empty(0, dtype=np.int32)
+            rows = []
+            for id in ids:
+                row = self.rows.get(id)
+                if row is None:
+                    row = self.rows[id] = len(self.ids)
+                    self.ids.append(id)
+                rows.append(row)
+            self._grow(len(self.ids) - self.size)
+            self.size = len(self.ids)
+
+            self.vectors[rows] = vectors
+            if self.centroids is not None:
+                self.assignments[rows] = self._assign(vectors)
+
+            # Retrain once the index has doubled since the clusters were computed
+            if self.size >= self.min_train_size and self.size >= 2 * self.trained_size:
+                self._train()
+
+    def remove(self, ids: list):
+        with self._lock:
+            for id in ids:
+                row = self.rows.pop(id, None)
+                if row is None:
+                    continue
+                # swap the last row into the hole, so the matrix stays dense
+                last = self.size - 1
+                if row != last:
+                    last_id = self.ids[last]
+                    self.vectors[row] = self.vectors[last]
+                    self.assignments[row] = self.assignments[last]
+                    self.ids[row] = last_id
+                    self.rows[last_id] = row
+                self.ids.pop()
+                self.size -= 1
+
+    def clear(self):
+        with self._lock:
+            self.ids = []
+            self.rows = {}
+            self.vectors = None
+            self.size = 0
+            self.centroids = None
+            self.assignments = None
+            self.trained_size = 0
+
+    #*==================== WRITER ====================#
+
+    #*==================== CLUSTERS ====================#
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _train(self, iterations: int = 10):
+        #*INFO: Spherical k-means, centroids stay unit length so the dot product is the cosine
+        vectors = self.vectors[: self.size]
+        nlist = min(self.nlist or int(np.sqrt(self.size)), self.size)
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(self.size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            self.centroids = centroids
+            assignments = self._assign(vectors)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = self._normalize(sums)
+
+        self.centroids = centroids
+        self.assignments[: self.size] = self._assign(vectors)
+        self.trained_size = self.size
+
+    def train(self):
+        with self._lock:
+            if self.size:
+                self._train()
+
+    #*==================== CLUSTERS ====================#
+
+    #*==================== READER ====================#
+    def search(self, embedding: list, k: int, nprobe: int = None) -> list:
+        """
+        returns up to k (id, cosine distance) pairs, closest first
+        """
+        query = self._normalize(embedding)[0]
+        with self._lock:
+            if not self.size:
+                return []
+            if self.centroids is None:
+                rows = np.arange(self.size)
+                similarities = self.vectors[: self.size] @ query
+            else:
+                probes = min(nprobe or self.nprobe, len(self.centroids))
+                closest = np.argpartition(-(self.centroids @ query), probes - 1)[
+                    :probes
+                ]
+                rows = np.flatnonzero(np.isin(self.assignments[: self.size], closest))
+                similarities = self.vectors[rows] @ query
+
+            top = min(k, len(rows))
+            if not top:
+                return []
+            best = np.argpartition(-similarities, top - 1)[:top]
+            best = best[np.argsort(-similarities[best])]
+            return [(self.ids[rows[i]], float(1.0 - similarities[i])) for i in best]
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+            "trained": self.centroids is not None,
+        }
+
+    #*==================== READER ====================#
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+import sys
+import time
+
+from langchain.document_loaders import PyPDFLoader, TextLoader
+from langchain.text_splitter import (
+    MarkdownHeaderTextSplitter,
+    RecursiveCharacterTextSplitter,
+)
+from langchain.vectorstores.utils import filter_complex_metadata
+from pypdf import PdfReader
+
+#*INFO: Kept free of IRIS imports, so the parsing stage can run in worker processes
+
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 100
+FILE_TYPES = {
+    ".pdf": "pdf",
+    ".md": "markdown",
+    ".txt": "text",
+}
+
+
+def python_executable(preferred: str = "") -> str:
+    """
+    a Python interpreter to start worker processes with, "" if there is none
+    inside an IRIS job sys.executable is the IRIS binary, not Python, so irispython is looked for instead
+    """
+    if preferred:
+        return preferred if os.access(preferred, os.X_OK) else ""
+
+    candidates = (
+        sys.executable,
+        os.path.join(
+            os.environ.get("ISC_PACKAGE_INSTALLDIR", "/usr/irissys"),
+            "bin",
+            "irispython",
+        ),
+        shutil.which("python3"),
+    )
+    for candidate in candidates:
+        if (
+            candidate
+            and os.path.basename(candidate).startswith(("python", "irispython"))
+            and os.access(candidate, os.X_OK)
+        ):
+            return candidate
+    return ""
+
+
+def get_file_type(file_path: str) -> str:
+    return FILE_TYPES.get(os.path.splitext(file_path.lower())[1], "unknown")
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_files(directory: str) -> list:
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if get_file_type(name) != "unknown"
+    )
+
+
+def create_text_splitter(
+    chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+#*==================== LOADERS ====================#
+#*INFO: Loaders yield documents one page (or section) at a time, nothing holds the whole file
+def load_text(file_path: str):
+    # a text file is a single document
+    yield from TextLoader(file_path).load()
+
+
+def load_pdf(file_path: str):
+    yield from PyPDFLoader(file_path=file_path).lazy_load()
+
+
+def load_markdown(file_path: str):
+    # Document loader
+    docs = TextLoader(file_path).load()
+
+    # MD splits
+    headers_to_split_on = [
+        ("#", "Header 1"),
+        ("##", "Header 2"),
+    ]
+
+    markdown_splitter = MarkdownHeaderTextSplitter(
+        headers_to_split_on=headers_to_split_on
+    )
+    yield from markdown_splitter.split_text(docs[0].page_content)
+
+
+def load_pages(file_path: str, file_type: str):
+    if file_type == "pdf":
+        return load_pdf(file_path)
+    elif file_type == "markdown":
+        return load_markdown(file_path)
+    elif file_type == "text":
+        return load_text(file_path)
+    else:
+        raise Exception(f"Unknown file type: {file_type}")
+
+
+def count_pages(file_path: str, file_type: str) -> int:
+    # only PDFs know their length up front
+    if file_type == "pdf":
+        return len(PdfReader(file_path).pages)
+    return 0
+
+
+#*==================== LOADERS ====================#
+
+
+def split_pages(pages, text_splitter):
+    """
+    yields the chunks of each page as soon as the page is loaded
+    """
+    for page in pages:
+        yield filter_complex_metadata(text_splitter.split_documents([page]))
+
+
+def parse_file(
+    file_path: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+):
+    """
+    loads and splits a whole file, returns (chunks, seconds taken)
+    entry point of the process pool used for bulk ingestion
+    """
+    start = time.perf_counter()
+    text_splitter = create_text_splitter(chunk_size, chunk_overlap)
+    pages = load_pages(file_path, get_file_type(file_path))
+    chunks = [
+        chunk
+        for page_chunks in split_pages(pages, text_splitter)
+        for chunk in page_chunks
+    ]
+    return chunks, time.perf_counter() - start
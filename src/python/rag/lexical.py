@@ -0,0 +1,117 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it my of on or "
+    "should that the this to was what when where which who why will with you your".split()
+)
+
+
+def _stem(token: str) -> str:
+    # plural folding only ("costs" -> "cost"), drug and procedure names are left intact
+    if (
+        len(token) > 3
+        and token.endswith("s")
+        and not token.endswith(("ss", "us", "is"))
+    ):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list:
+    return [
+        _stem(token)
+        for token in re.findall(r"\w+", text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def reciprocal_rank_fusion(*rankings, k: int = 60) -> list:
+    """
+    merges ranked id lists, each id scores sum(1 / (k + rank)) over the lists it appears in
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """
+    incrementally maintained Okapi BM25 inverted index over chunk texts
+    exact term matches (drug names, costs, procedure terms) that dense embeddings tend to blur
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {id: term frequency}
+        self.postings = defaultdict(dict)
+        # id -> (document length, distinct terms)
+        self.documents = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _remove(self, id: str):
+        length, terms = self.documents.pop(id)
+        self.total_length -= length
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(id, None)
+            if not postings:
+                del self.postings[term]
+
+    def add(self, ids: list, texts: list):
+        with self._lock:
+            for id, text in zip(ids, texts):
+                if id in self.documents:
+                    self._remove(id)
+                counts = Counter(tokenize(text))
+                length = sum(counts.values())
+                for term, count in counts.items():
+                    self.postings[term][id] = count
+                self.documents[id] = (length, tuple(counts))
+                self.total_length += length
+
+    def remove(self, ids: list):
+        with self._lock:
+            for id in ids:
+                if id in self.documents:
+                    self._remove(id)
+
+    def clear(self):
+        with self._lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.total_length = 0
+
+    def search(self, query: str, k: int) -> list:
+        """
+        returns up to k (id, score) pairs, best first
+        """
+        with self._lock:
+            if not self.documents:
+                return []
+            count = len(self.documents)
+            average_length = self.total_length / count or 1.0
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for id, frequency in postings.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self.documents[id][0] / average_length
+                    )
+                    scores[id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
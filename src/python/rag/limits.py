@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import iris
+
+LIMITS_GLOBAL = "^ChatIRIS.LLM"
+# how long a result is kept for the calls that were waiting on it
+RESULT_RETENTION = 60.0
+POLL_INTERVAL = 0.05
+
+
+def _lock_name(*subscripts) -> str:
+    return (
+        LIMITS_GLOBAL
+        + "("
+        + ",".join(f'"{subscript}"' for subscript in subscripts)
+        + ")"
+    )
+
+
+class SharedSemaphore:
+    """
+    counting semaphore over every job of the instance, one IRIS lock per slot
+    IRIS releases the locks of a job that dies, so a crashed job never leaks its slots
+    """
+
+    def __init__(self, name: str, slots: int, poll_interval: float = POLL_INTERVAL):
+        self.lock_names = [_lock_name("slot", name, slot) for slot in range(slots)]
+        self.poll_interval = poll_interval
+        # IRIS locks are per job and re-entrant, so the slots this job holds are tracked here
+        self.held = set()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        returns a free slot, now held by this job, or None if every slot is taken
+        """
+        with self._lock:
+            for slot, lock_name in enumerate(self.lock_names):
+                if slot not in self.held and iris.lock([lock_name], 0):
+                    self.held.add(slot)
+                    return slot
+        return None
+
+    async def acquire(self) -> int:
+        while True:
+            slot = self.try_acquire()
+            if slot is not None:
+                return slot
+            await asyncio.sleep(self.poll_interval)
+
+    def release(self, slot: int):
+        with self._lock:
+            iris.unlock([self.lock_names[slot]])
+            self.held.discard(slot)
+
+
+class SharedCalls:
+    """
+    calls in flight in any job of the instance, so an identical call made meanwhile (in this job or
+    another) waits for it and gets its result instead of calling upstream again
+    a call holds the IRIS lock of its key while in flight and leaves its result in a global for the
+    calls that were waiting on the lock
+    """
+
+    def __init__(
+        self, retention: float = RESULT_RETENTION, poll_interval: float = POLL_INTERVAL
+    ):
+        self.ref = iris.gref(LIMITS_GLOBAL)
+        self.retention = retention
+        self.poll_interval = poll_interval
+
+    async def claim(self, key: str) -> float:
+        """
+        waits until no other call of `key` is in flight and takes its lock
+        returns when the wait started if the call was in flight, None if it was not
+        """
+        lock_name = _lock_name("call", key)
+        waited_since = None
+        while not iris.lock([lock_name], 0):
+            waited_since = waited_since or time.time()
+            await asyncio.sleep(self.poll_interval)
+        return waited_since
+
+    def release(self, key: str):
+        iris.unlock([_lock_name("call", key)])
+
+    def result(self, key: str, since: float):
+        """
+        the result of `key` stored after `since`, or None
+        """
+        stored_at = self.ref.get(["at", key], None)
+        if stored_at is None or stored_at < since:
+            return None
+        return self.ref.get(["result", key], None)
+
+    def store(self, key: str, result: str):
+        now = time.time()
+        # results only matter to the calls that were waiting when they were stored
+        stale_key = self.ref.order(["at", ""])
+        while stale_key:
+            next_key = self.ref.order(["at", stale_key])
+            if self.ref.get(["at", stale_key], now) < now - self.retention:
+                self.ref.kill(["at", stale_key])
+                self.ref.kill(["result", stale_key])
+            stale_key = next_key
+        self.ref.set(["result", key], result)
+        self.ref.set(["at", key], now)
@@ -0,0 +1,387 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import queue
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from openai.types.chat import ChatCompletion
+
+#* Transient upstream failures, everything else (bad request, auth, ...) is raised straight away
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    APITimeoutError,
+    APIConnectionError,
+    InternalServerError,
+)
+_STREAM_END = object()
+
+
+class LLMGateway:
+    """
+    process-wide gateway to the OpenAI API, shared by every conversation operation in the job
+    calls run on one asyncio loop (in a background thread) with an async client, and are bounded by
+    a per-call timeout, a concurrency semaphore and jittered exponential backoff on transient errors
+    identical in-flight completions are coalesced into a single upstream call
+    with a `shared_semaphore` and `shared_calls` (see rag.limits) the concurrency bound and the
+    coalescing hold across every job of the instance, not only within this one
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        api_key: str,
+        timeout: float = 60,
+        max_retries: int = 4,
+        max_concurrency: int = 8,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        shared_semaphore=None,
+        shared_calls=None,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="llm-gateway", daemon=True
+        )
+        self.thread.start()
+        # Retries are ours, so the client's own are turned off
+        self.client = AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+        self.semaphore = self._run(self._create_semaphore(max_concurrency))
+        self.shared_semaphore = shared_semaphore
+        self.shared_calls = shared_calls
+        # request key -> future of the in-flight completion
+        self.in_flight = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failures = 0
+
+    @classmethod
+    def shared(cls, api_key: str, **kwargs) -> "LLMGateway":
+        """
+        returns the gateway for `api_key`, created on first use (later arguments are ignored)
+        """
+        with cls._instances_lock:
+            gateway = cls._instances.get(api_key)
+            if gateway is None:
+                gateway = cls._instances[api_key] = cls(api_key, **kwargs)
+            return gateway
+
+    @staticmethod
+    async def _create_semaphore(max_concurrency: int) -> asyncio.Semaphore:
+        # created on the gateway's loop, so it is bound to it
+        return asyncio.Semaphore(max_concurrency)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _backoff_bound(self, attempt: int) -> float:
+        return min(self.backoff_cap, self.backoff_base * 2**attempt)
+
+    def _backoff(self, attempt: int) -> float:
+        # "full jitter": a random delay up to the exponential bound, so retries do not stampede
+        return random.uniform(0, self._backoff_bound(attempt))
+
+    def _retry_budget(self, timeout: float) -> float:
+        # longest _with_retries can take: every attempt timing out, every backoff at its bound
+        return (self.max_retries + 1) * timeout + sum(
+            self._backoff_bound(attempt) for attempt in range(self.max_retries)
+        )
+
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        async with self.semaphore:
+            if self.shared_semaphore is None:
+                yield
+                return
+            slot = await self.shared_semaphore.acquire()
+            try:
+                yield
+            finally:
+                self.shared_semaphore.release(slot)
+
+    async def _with_retries(self, call, timeout: float, consume=None):
+        """
+        awaits call(), then consume(its result) if given, on a single concurrency slot
+        only call() is retried (e.g. opening a stream, not reading it), the slot is free during the backoff
+        """
+        attempt = 0
+        while True:
+            async with self._slot():
+                try:
+                    result = await asyncio.wait_for(call(), timeout)
+                except (asyncio.TimeoutError, *RETRYABLE_ERRORS):
+                    if attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                else:
+                    return result if consume is None else await consume(result)
+            self.retries += 1
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def _call_shared(self, key: str, kwargs: dict, timeout: float):
+        """
+        completion coalesced with the identical ones in flight in other jobs
+        """
+        waited_since = await self.shared_calls.claim(key)
+        try:
+            if waited_since is not None:
+                result = self.shared_calls.result(key, since=waited_since)
+                if result is not None:
+                    self.coalesced += 1
+                    return ChatCompletion.model_validate_json(result)
+            self.calls += 1
+            result = await self._with_retries(
+                lambda: self.client.chat.completions.create(**kwargs), timeout
+            )
+            self.shared_calls.store(key, result.model_dump_json())
+            return result
+        finally:
+            self.shared_calls.release(key)
+
+    #*==================== COMPLETIONS ====================#
+    async def acomplete(self, timeout: float = None, **kwargs):
+        """
+        chat completion, awaitable on the gateway's loop; takes the arguments of chat.completions.create
+        """
+        key = hashlib.sha256(
+            json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = self.loop.create_future()
+        self.in_flight[key] = future
+        try:
+            if self.shared_calls is not None:
+                result = await self._call_shared(key, kwargs, timeout or self.timeout)
+            else:
+                self.calls += 1
+                result = await self._with_retries(
+                    lambda: self.client.chat.completions.create(**kwargs),
+                    timeout or self.timeout,
+                )
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # the exception is delivered to the coalesced callers, no need to log it as unretrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self.in_flight[key]
+
+    def complete(self, timeout: float = None, **kwargs):
+        """
+        blocking chat completion, for the (synchronous) message handlers
+        """
+        return self._run(self.acomplete(timeout=timeout, **kwargs))
+
+    def stream(self, timeout: float = None, **kwargs):
+        """
+        yields the chunks of a streamed chat completion
+        only opening the stream is retried, so the first chunk may take the whole retry budget;
+        after that `timeout` bounds the wait for each chunk
+        the stream holds its concurrency slot from opening it until its last chunk
+        a consumer that stops early (or times out) cancels the upstream stream
+        """
+        chunks = queue.Queue()
+        timeout = timeout or self.timeout
+
+        async def forward(response):
+            try:
+                async for chunk in response:
+                    chunks.put(chunk)
+            finally:
+                await response.close()
+
+        async def produce():
+            try:
+                self.calls += 1
+                await self._with_retries(
+                    lambda: self.client.chat.completions.create(stream=True, **kwargs),
+                    timeout,
+                    consume=forward,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(_STREAM_END)
+
+        producer = asyncio.run_coroutine_threadsafe(produce(), self.loop)
+        wait = self._retry_budget(timeout)
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=wait)
+                except queue.Empty:
+                    raise TimeoutError(f"No chunk received in {wait:.0f}s") from None
+                if chunk is _STREAM_END:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                wait = timeout
+                yield chunk
+        finally:
+            # no-op once the stream has ended
+            producer.cancel()
+
+    #*==================== COMPLETIONS ====================#
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failures": self.failures,
+            "in_flight": len(self.in_flight),
+        }
+
+
+#*==================== MOCK ====================#
+CANNED_RESPONSES = (
+    "Screening can find colorectal cancer early, when it is most treatable. "
+    "Would you like to know which test suits you best?",
+    "The FIT kit is a simple stool test you can do at home, and it is free for eligible residents. "
+    "Is there anything holding you back from trying it?",
+    "It is completely normal to feel worried about a colonoscopy. "
+    "Most people find the preparation is the hardest part, and the procedure itself is done under sedation.",
+    "Many people with colorectal cancer have no symptoms at first, which is why regular screening matters. "
+    "When did you last get screened?",
+)
+
+
+def parse_latency(spec: str):
+    """
+    returns a sampler of latencies in seconds from a spec such as
+    "fixed:0.5", "uniform:0.2,1.5", "normal:0.8,0.2" or "lognormal:0.8,0.5" (median, sigma)
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(rng.gauss(values[0], values[1]), 0.0)
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockLLM:
+    """
+    offline stand-in for LLMGateway, for load testing the production without network access
+    answers are deterministic for a given request: canned completions, or tool calls with
+    plausible arguments for every tool offered; latency is drawn from `latency`
+    """
+
+    def __init__(self, latency: str = "fixed:0", seed: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _latency(self) -> float:
+        # drawn (and counted) once per request, however many chunks a streamed answer is spread over
+        with self._lock:
+            self.calls += 1
+            return self.sample_latency(self.rng)
+
+    @staticmethod
+    def _request_rng(kwargs: dict) -> random.Random:
+        return random.Random(json.dumps(kwargs, sort_keys=True, default=str))
+
+    @staticmethod
+    def _arguments(parameters: dict, rng: random.Random) -> dict:
+        arguments = {}
+        for name, schema in parameters.get("properties", {}).items():
+            if "enum" in schema:
+                arguments[name] = rng.choice(schema["enum"])
+            elif schema.get("type") in ("number", "integer"):
+                values = list(
+                    range(
+                        int(schema.get("minimum", 0)), int(schema.get("maximum", 1)) + 1
+                    )
+                )
+                # most turns say nothing about most beliefs, so 0 (undetermined) is the likeliest score
+                arguments[name] = rng.choices(
+                    values, weights=[2 if value == 0 else 1 for value in values]
+                )[0]
+            elif schema.get("type") == "boolean":
+                arguments[name] = rng.random() < 0.5
+            else:
+                arguments[name] = ""
+        return arguments
+
+    def complete(self, timeout: float = None, **kwargs):
+        rng = self._request_rng(kwargs)
+        time.sleep(self._latency())
+
+        content, tool_calls = None, None
+        if kwargs.get("tools"):
+            tool_calls = [
+                SimpleNamespace(
+                    id=f"call_{i}",
+                    type="function",
+                    function=SimpleNamespace(
+                        name=tool["function"]["name"],
+                        arguments=json.dumps(
+                            self._arguments(tool["function"].get("parameters", {}), rng)
+                        ),
+                    ),
+                )
+                for i, tool in enumerate(kwargs["tools"])
+            ]
+        else:
+            content = rng.choice(CANNED_RESPONSES)
+
+        message = SimpleNamespace(
+            role="assistant", content=content, tool_calls=tool_calls
+        )
+        return SimpleNamespace(
+            model=kwargs.get("model"),
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        )
+
+    def stream(self, timeout: float = None, **kwargs):
+        words = self._request_rng(kwargs).choice(CANNED_RESPONSES).split(" ")
+        # time to first token, then the rest of the latency spread evenly over the words
+        latency = self._latency()
+        time.sleep(latency * 0.3)
+        for i, word in enumerate(words):
+            time.sleep(latency * 0.7 / len(words))
+            delta = SimpleNamespace(content=word if i == 0 else f" {word}")
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta)])
+
+    def stats(self) -> dict:
+        return {"calls": self.calls}
+
+
+#*==================== MOCK ====================#
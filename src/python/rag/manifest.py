@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+
+class DocumentManifest:
+    """
+    records, for each ingested source, the hash of the file and the ids of its chunks
+    lets re-ingestion skip unchanged files and remove the chunks an edited file no longer has
+    kept in memory only when no path is given
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        # source -> {"file_hash": str, "chunk_ids": [str]}
+        self.documents = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as file:
+                self.documents = json.load(file)
+        except (OSError, ValueError):
+            self.documents = {}
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write-then-rename so a crash never leaves a truncated manifest behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.documents, file)
+        os.replace(tmp_path, self.path)
+
+    def get(self, source: str):
+        return self.documents.get(source)
+
+    def is_unchanged(self, source: str, file_hash: str, existing_ids=None) -> bool:
+        """
+        whether `source` was ingested with this hash; with `existing_ids` (ids -> the ones the store still has)
+        its chunks must also still be in the store, which may have been wiped while the manifest survived
+        """
+        document = self.documents.get(source)
+        if document is None or document["file_hash"] != file_hash:
+            return False
+        if existing_ids is None or not document["chunk_ids"]:
+            return True
+        return len(existing_ids(document["chunk_ids"])) == len(
+            set(document["chunk_ids"])
+        )
+
+    def set(self, source: str, file_hash: str, chunk_ids: list):
+        with self._lock:
+            self.documents[source] = {
+                "file_hash": file_hash,
+                "chunk_ids": list(chunk_ids),
+            }
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self.documents = {}
+            self._save()
+
+    def stale_ids(self, source: str, chunk_ids: set) -> set:
+        """
+        ids the previous version of `source` had but the new one does not,
+        ignoring ids other sources still reference (identical chunks share an id)
+        """
+        document = self.documents.get(source)
+        if document is None:
+            return set()
+
+        stale = set(document["chunk_ids"]) - set(chunk_ids)
+        for other_source, other in self.documents.items():
+            if stale and other_source != source:
+                stale -= set(other["chunk_ids"])
+        return stale
@@ -6,11 +6,34 @@ from grongier.pex import Message
 @dataclass
 class FileIngestionRequest(Message):
     file_path: str
+    # identifies the document across re-ingestions (e.g. the uploaded file name), defaults to file_path
+    source: str = ""
+    # when set, progress events are written to this StreamChannel
+    progress_id: str = ""
+
+
+@dataclass
+class BulkIngestionRequest(Message):
+    file_paths: list = None
+    directory: str = ""
+
+
+@dataclass
+class BulkIngestionResponse(Message):
+    # one report per file: file_path, chunks, stored, skipped, parse_seconds, store_seconds (or error)
+    files: list = None
 
 
 @dataclass
 class ChatRequest(Message):
+    # only the newest turn (the user's message and the reply it answers),
+    # the operations keep the rest of the conversation per session_id
     messages: list = None
+    session_id: str = ""
+    # when set, ChatOperation streams the response into this StreamChannel
+    stream_id: str = ""
+    # hash of the conversation before the newest message, the response cache key
+    history_hash: str = ""
 
 
 @dataclass
@@ -18,40 +41,158 @@ class ChatResponse(Message):
     response: str = ""
 
 
+@dataclass
+class ScoreResponse(ChatResponse):
+    scores: dict = None
+
+
+@dataclass
+class ChatPipelineState(Message):
+    belief_prompt: str = ""
+    scores: dict = None
+    docs: list = None
+    # answer found in the response cache by the retrieval, the turn is not sent to the chat agent
+    cached_response: str = ""
+
+
+@dataclass
+class ChatHistoryAppendRequest(Message):
+    # a turn answered without the operation (e.g. from the response cache), added to its session as is
+    messages: list = None
+    session_id: str = ""
+
+
 @dataclass
 class ChatClearRequest(Message):
+    session_id: str = ""
+
+
+@dataclass
+class IndexRebuildRequest(Message):
     pass
 
 
+@dataclass
+class IndexSnapshotRequest(Message):
+    # defaults to a timestamped directory under the operation's cache
+    path: str = ""
+
+
+@dataclass
+class IndexRestoreRequest(Message):
+    path: str = ""
+
+
+@dataclass
+class IndexSnapshotResponse(Message):
+    path: str = ""
+    count: int = 0
+
+
 @dataclass
 class VectorSearchRequest(Message):
     query: str = ""
+    session_id: str = ""
+    # number of chunks to retrieve, minimum relevance (0-1) and token budget of the returned chunks
+    k: int = 4
+    score_threshold: float = 0.0
+    max_tokens: int = 0
+    # when set, the response cache is looked up first with the same query embedding
+    history_hash: str = ""
 
 
 @dataclass
 class VectorSearchResponse(Message):
+    # {"id", "page_content"} per retrieved chunk, metadata stays with the vector store
     docs: list = None
+    # answer from the response cache, no chunks are retrieved when there is one
+    cached_response: str = ""
+
+
+@dataclass
+class ResponseCacheStoreRequest(Message):
+    query: str = ""
+    history_hash: str = ""
+    response: str = ""
+
 
 @dataclass
 class ChatRetrievalRequest(Message):
-    pass
+    session_id: str = ""
+
 
 @dataclass
 class ChatRetrievalResponse(Message):
     messages: list = None
 
+
 @dataclass
 class ScoreRetrievalRequest(Message):
-    pass
+    session_id: str = ""
+
 
 @dataclass
 class ScoreRetrievalResponse(Message):
     scores: list = None
 
+
+@dataclass
+class ScoreDeltaRetrievalRequest(Message):
+    session_id: str = ""
+    # number of the first round wanted, i.e. the cursor of the previous delta
+    cursor: int = 0
+
+
+@dataclass
+class ScoreDeltaRetrievalResponse(Message):
+    # first round returned (later than the requested cursor if older rounds were dropped) and the next cursor
+    start: int = 0
+    cursor: int = 0
+    # belief key -> scores, category -> mean score, one value per round
+    scores: dict = None
+    category_scores: dict = None
+    # category -> mean over every round of the session
+    running_means: dict = None
+
+
+@dataclass
+class PopulationScoreRetrievalRequest(Message):
+    pass
+
+
+@dataclass
+class PopulationScoreRetrievalResponse(Message):
+    # sessions, beliefs: {key: rollup}, categories: {category: rollup}
+    # rollup: sessions, mean_score, transitions, positive_rate, mean_rounds_to_positive
+    population: dict = None
+
+
 @dataclass
 class BeliefRetrievalRequest(Message):
     pass
 
+
 @dataclass
 class BeliefRetrievalResponse(Message):
     beliefs: list = None
+
+
+@dataclass
+class CacheStatsRetrievalRequest(Message):
+    pass
+
+
+@dataclass
+class CacheStatsRetrievalResponse(Message):
+    stats: dict = None
+
+
+@dataclass
+class PoolStatsRetrievalRequest(Message):
+    pass
+
+
+@dataclass
+class PoolStatsRetrievalResponse(Message):
+    # size, checked_out, checked_in, overflow, max_overflow, checkouts, timeouts, avg_wait_ms, max_wait_ms
+    stats: dict = None
@@ -1,19 +1,24 @@
 import os
+import sys
 import tempfile
+from os.path import abspath
+from os.path import dirname as d
 
-import numpy as np
 import plotly.graph_objects as go
 import streamlit as st
-from grongier.pex import Director
 
-# Director setup for chat service
-st.session_state.chat_service = Director.create_python_business_service("ChatService")
+# Make the rag package importable from the Streamlit pages
+sys.path.append(d(d(d(abspath(__file__)))))
+from rag.client import get_chat_service
+
+# Chat service client, shared by every session, rerun and page of this Streamlit process
+st.session_state.chat_service = get_chat_service()
 
 st.set_page_config(
     page_title="ChatIRIS - Admin",
     page_icon="📊",
     layout="wide",
-    initial_sidebar_state="collapsed"
+    initial_sidebar_state="collapsed",
 )
 
 categories = {
@@ -24,7 +29,7 @@ categories = {
             "gain_reassurance",
             "gain_control",
         ],
-        "description": "the user's motivating factors and perceived benefits associated with cancer screening."
+        "description": "the user's motivating factors and perceived benefits associated with cancer screening.",
     },
     "vulnerability": {
         "keys": [
@@ -33,7 +38,7 @@ categories = {
             "risk_factor_exposure",
             "observed_symptoms",
         ],
-        "description": "the user's perception of their susceptibility to developing colorectal cancer."
+        "description": "the user's perception of their susceptibility to developing colorectal cancer.",
     },
     "barriers": {
         "keys": [
@@ -44,40 +49,59 @@ categories = {
             "tendency_to_deny",
             "difficult_preparation",
         ],
-        "description": "how convenient cancer screening is for the user, based on their perceived obstacles and challenges."
-    }
+        "description": "how convenient cancer screening is for the user, based on their perceived obstacles and challenges.",
+    },
 }
 category_types = list(categories.keys())
 
+
+def reset_scores(start: int = 0):
+    st.session_state["score_cursor"] = start
+    st.session_state["score_start"] = start
+    st.session_state["scores"] = {
+        key: [] for details in categories.values() for key in details["keys"]
+    }
+    st.session_state["category_scores"] = {
+        category: [] for category in categories.keys()
+    }
+    st.session_state["running_means"] = {
+        category: 0.0 for category in categories.keys()
+    }
+
+
 def init_session():
-    #* Load score agent's scores
-    if "scores" not in st.session_state:
-        scores = st.session_state.chat_service.retrieve_scores()
-        st.session_state["scores"] = scores
+    #* Load only the rounds scored since the last render, the held series are extended in place
+    if "score_cursor" not in st.session_state:
+        reset_scores()
 
-        # Initialize scores
-        category_scores = {category: {key: [] for key in details["keys"]} for category, details in categories.items()}
+    delta = st.session_state.chat_service.retrieve_score_delta(
+        st.session_state.get("session_id", ""), st.session_state["score_cursor"]
+    )
+    # The session restarted or held rounds fell off its history, start over from what the agent still has
+    if delta["start"] != st.session_state["score_cursor"]:
+        reset_scores(delta["start"])
 
-        # Extract the scores
-        for round in scores:
-            for category, details in categories.items():
-                for key in details["keys"]:
-                    category_scores[category][key].append(round[key])
-        st.session_state["category_scores"] = category_scores
+    for key, series in delta["scores"].items():
+        st.session_state["scores"].setdefault(key, []).extend(series)
+    for category, series in delta["category_scores"].items():
+        st.session_state["category_scores"].setdefault(category, []).extend(series)
+    st.session_state["running_means"] = delta["running_means"]
+    st.session_state["score_cursor"] = delta["cursor"]
 
     #* Load score agent's beliefs
     if "beliefs" not in st.session_state:
         st.session_state["beliefs"] = st.session_state.chat_service.retrieve_beliefs()
 
+
 # Define plot_scores function using Plotly
-def plot_scores(scores, labels):
+def plot_scores(scores, labels, start=0):
     # Create a Plotly figure
     fig = go.Figure()
 
     for i, series in enumerate(scores):
         fig.add_trace(
             go.Scatter(
-                x=list(range(len(series))),
+                x=list(range(start, start + len(series))),
                 y=series,
                 mode="lines",
                 name=f"{labels[i]}",
@@ -96,20 +120,23 @@ def plot_scores(scores, labels):
 
     return fig
 
-def display_scores():
-    data = st.session_state["scores"]
-    placeholder = st.empty()
 
-    category_scores = {category: [] for category in categories.keys()}
+def display_scores():
+    #* Category means are computed by the score agent as each round is scored, nothing to aggregate here
+    category_scores = st.session_state["category_scores"]
+    start = st.session_state["score_start"]
 
-    for round in data:
-        for category, details in categories.items():
-            scores = [round[key] for key in details["keys"]]
-            category_scores[category].append(np.average(scores))
+    for column, category in zip(st.columns(len(category_types)), category_types):
+        column.metric(
+            f"{category.capitalize()} (mean)",
+            f"{st.session_state['running_means'].get(category, 0.0):.2f}",
+        )
 
+    placeholder = st.empty()
     fig = plot_scores(
         [category_scores[category] for category in category_types],
         labels=[category.capitalize() for category in category_types],
+        start=start,
     )
     placeholder.plotly_chart(fig, use_container_width=True)
 
@@ -117,22 +144,129 @@ def display_scores():
         with st.expander(f"{category.capitalize()} Scores"):
             st.info(f"{category.capitalize()} measures {details['description']}")
 
-            individual_scores = {key: [] for key in details["keys"]}
-            for round in data:
-                for key in details["keys"]:
-                    individual_scores[key].append(round[key])
-
             fig = plot_scores(
-                [individual_scores[key] for key in details["keys"]],
+                [st.session_state["scores"][key] for key in details["keys"]],
                 labels=[st.session_state["beliefs"][key] for key in details["keys"]],
+                start=start,
             )
             st.plotly_chart(fig, use_container_width=True)
 
+
+def display_population_scores():
+    #* Read from the score agent's rollups, one row per belief however many sessions were scored
+    population = st.session_state.chat_service.retrieve_population_scores() or {}
+    if not population:
+        return
+
+    st.subheader(f"All Sessions ({population['sessions']})")
+    for column, category in zip(st.columns(len(category_types)), category_types):
+        rollup = population["categories"][category]
+        rounds_to_positive = rollup["mean_rounds_to_positive"]
+        column.metric(
+            category.capitalize(),
+            f"{rollup['mean_score']:.2f}",
+            help=f"{rollup['positive_rate']:.0%} of sessions turned positive"
+            + (
+                f" after {rounds_to_positive:.1f} rounds on average"
+                if rounds_to_positive is not None
+                else ""
+            )
+            + f", {rollup['transitions']} changes from -1 to 1",
+        )
+
+    with st.expander("Beliefs Across Sessions"):
+        keys = [
+            key
+            for details in categories.values()
+            for key in details["keys"]
+            if key in population["beliefs"]
+        ]
+        fig = go.Figure(
+            go.Bar(
+                x=[population["beliefs"][key]["mean_score"] for key in keys],
+                y=[st.session_state["beliefs"].get(key, key) for key in keys],
+                orientation="h",
+                customdata=[
+                    [
+                        population["beliefs"][key]["positive_rate"],
+                        population["beliefs"][key]["transitions"],
+                    ]
+                    for key in keys
+                ],
+                hovertemplate="%{x:.2f}<br>%{customdata[0]:.0%} positive, %{customdata[1]} changes from -1 to 1<extra></extra>",
+            )
+        )
+        fig.update_layout(
+            xaxis_title="Mean Score",
+            template="plotly_white",
+            margin=dict(t=0, b=50),
+            height=40 * len(keys) + 100,
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def display_cache_stats():
+    #* Fetched on every render so the counters stay live
+    stats = st.session_state.chat_service.retrieve_cache_stats() or {}
+
+    with st.expander("Cache Statistics"):
+        for name, details in stats.items():
+            model = f" ({details['model']})" if details.get("model") else ""
+            st.caption(f"{name.capitalize()} cache{model}")
+            entries, hits, misses, hit_rate = st.columns(4)
+            entries.metric("Entries", f"{details['entries']} / {details['capacity']}")
+            hits.metric("Hits", details["hits"])
+            misses.metric("Misses", details["misses"])
+            hit_rate.metric("Hit Rate", f"{details['hit_rate']:.0%}")
+
+
+def display_pool_stats():
+    stats = st.session_state.chat_service.retrieve_pool_stats() or {}
+    if not stats:
+        return
+
+    with st.expander("Connection Pool"):
+        checked_out, overflow, wait, timeouts = st.columns(4)
+        checked_out.metric("Checked Out", f"{stats['checked_out']} / {stats['size']}")
+        overflow.metric("Overflow", f"{stats['overflow']} / {stats['max_overflow']}")
+        wait.metric(
+            "Checkout Wait",
+            f"{stats['avg_wait_ms']:.1f} ms",
+            help=f"max {stats['max_wait_ms']:.1f} ms",
+        )
+        timeouts.metric("Timeouts", stats["timeouts"])
+
+
+def rebuild_index():
+    with st.spinner("Rebuilding knowledge base..."):
+        st.session_state.chat_service.rebuild_index()
+
+
+def show_rebuild_index():
+    #* Drops and re-ingests the whole knowledge base for every session, so it is kept behind a confirmation
+    with st.sidebar:
+        st.subheader("Knowledge Base")
+        confirmed = st.checkbox(
+            "I understand this affects all sessions", key="confirm_rebuild"
+        )
+        st.button(
+            "🗂️ Rebuild Index",
+            on_click=rebuild_index,
+            disabled=not confirmed,
+            use_container_width=True,
+        )
+
+
 def main():
     init_session()
     st.title("📊 ChatIRIS - Health Belief Monitoring")
 
+    show_rebuild_index()
     display_scores()
+    display_population_scores()
+    display_cache_stats()
+    display_pool_stats()
+
 
 if __name__ == "__main__":
     main()
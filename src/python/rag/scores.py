@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class ScoreHistory:
+    """
+    belief scores of a session, kept column-wise: a (rounds x belief keys) float32 matrix
+    per-category means are computed once per round, when the round is appended, along with a running
+    mean over every round so far; only the last `capacity` rounds are kept, older ones fall off
+    rounds are numbered from 0 for the life of the session, the number of the next round is the cursor
+    """
+
+    def __init__(self, categories: dict = None, capacity: int = 500):
+        # category -> belief keys
+        self.categories = categories or {}
+        self.keys = [key for keys in self.categories.values() for key in keys]
+        self.capacity = capacity
+
+        self.values = np.zeros((capacity, len(self.keys)), dtype=np.float32)
+        self.category_values = np.zeros(
+            (capacity, len(self.categories)), dtype=np.float32
+        )
+        # key x category weights, so one product turns a round of scores into its category means
+        self.weights = np.zeros(
+            (len(self.keys), len(self.categories)), dtype=np.float32
+        )
+        offset = 0
+        for column, keys in enumerate(self.categories.values()):
+            self.weights[offset : offset + len(keys), column] = 1.0 / max(len(keys), 1)
+            offset += len(keys)
+
+        self.cursor = 0
+        self.category_totals = np.zeros(len(self.categories), dtype=np.float64)
+
+    def __len__(self):
+        return min(self.cursor, self.capacity)
+
+    def __bool__(self):
+        return self.cursor > 0
+
+    @property
+    def start(self) -> int:
+        # number of the oldest round still kept
+        return max(self.cursor - self.capacity, 0)
+
+    def _rows(self, start: int) -> np.ndarray:
+        return np.arange(start, self.cursor) % self.capacity
+
+    def append(self, round_data: dict):
+        self.append_state(
+            np.array([round_data.get(key, 0) for key in self.keys], dtype=np.float32)
+        )
+
+    def append_state(self, row: np.ndarray):
+        """
+        appends a round given as a vector of scores, in the order of `keys`
+        """
+        slot = self.cursor % self.capacity
+        self.values[slot] = row
+        self.category_values[slot] = row @ self.weights
+        self.category_totals += self.category_values[slot]
+        self.cursor += 1
+
+    def to_state(self) -> dict:
+        """
+        the kept rounds and running totals, as plain lists (e.g. to be saved as JSON)
+        """
+        return {
+            "keys": self.keys,
+            "cursor": self.cursor,
+            "rounds": self.values[self._rows(self.start)].tolist(),
+            "category_totals": self.category_totals.tolist(),
+        }
+
+    def restore(self, state: dict):
+        """
+        replaces the history with one saved by to_state, unless it was kept for other belief keys
+        """
+        if state.get("keys") != self.keys:
+            return
+        self.cursor = state["cursor"]
+        rounds = np.array(state["rounds"], dtype=np.float32).reshape(
+            len(state["rounds"]), len(self.keys)
+        )
+        rounds = rounds[-self.capacity :]
+        rows = self._rows(self.cursor - len(rounds))
+        self.values[rows] = rounds
+        self.category_values[rows] = rounds @ self.weights
+        self.category_totals = np.array(state["category_totals"], dtype=np.float64)
+
+    def last_state(self) -> np.ndarray:
+        if not self.cursor:
+            return None
+        return self.values[(self.cursor - 1) % self.capacity].astype(np.int8)
+
+    def last(self) -> dict:
+        if not self.cursor:
+            return None
+        row = self.values[(self.cursor - 1) % self.capacity]
+        return {key: int(value) for key, value in zip(self.keys, row)}
+
+    def rounds(self) -> list:
+        """
+        the kept rounds as {key: score} dicts, oldest first
+        """
+        return [
+            {key: int(value) for key, value in zip(self.keys, row)}
+            for row in self.values[self._rows(self.start)]
+        ]
+
+    def since(self, cursor: int) -> dict:
+        """
+        the rounds numbered `cursor` and up, column-wise; `start` is where they actually begin
+        (later than `cursor` if those rounds fell off, 0 if the cursor is from an earlier session)
+        """
+        start = cursor if self.start <= cursor <= self.cursor else self.start
+        rows = self._rows(start)
+        running = (
+            self.category_totals / self.cursor if self.cursor else self.category_totals
+        )
+        return {
+            "start": start,
+            "cursor": self.cursor,
+            "scores": {
+                key: self.values[rows, i].astype(int).tolist()
+                for i, key in enumerate(self.keys)
+            },
+            "category_scores": {
+                category: self.category_values[rows, i].tolist()
+                for i, category in enumerate(self.categories)
+            },
+            "running_means": {
+                category: float(running[i])
+                for i, category in enumerate(self.categories)
+            },
+        }
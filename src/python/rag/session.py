@@ -0,0 +1,294 @@
+import contextlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import (
+    Column,
+    Float,
+    MetaData,
+    String,
+    Table,
+    Text,
+    and_,
+    bindparam,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+
+from rag.context import ContextWindow, count_message_tokens
+from rag.scores import ScoreHistory
+
+
+class Session:
+    """
+    conversation state of a single user session
+    pinned messages (e.g. the system prompt) are always kept, the rest of the history
+    is windowed to what is left of the token budget
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        pinned: list,
+        max_messages: int,
+        max_rounds: int,
+        budget: int,
+        summarize=None,
+        score_categories: dict = None,
+    ):
+        self.session_id = session_id
+        self.pinned = [dict(message) for message in pinned]
+        pinned_tokens = sum(count_message_tokens(message) for message in self.pinned)
+        self.history = ContextWindow(
+            budget=max(budget - pinned_tokens, 0),
+            max_messages=max_messages,
+            summarize=summarize,
+        )
+        self.scores = ScoreHistory(score_categories, capacity=max_rounds)
+        # the conversation as the user sees it, built up from the turns each request carries
+        self.transcript = deque(maxlen=max_messages)
+        self.last_seen = time.monotonic()
+
+    @property
+    def messages(self) -> list:
+        return self.pinned + self.history.messages
+
+    def add_message(self, message: dict):
+        self.history.append(message)
+
+    def to_state(self) -> dict:
+        """
+        everything but the pinned messages, as plain values (e.g. to be saved as JSON)
+        """
+        return {
+            "history": [message for message, _ in self.history.window],
+            "summary": self.history.summary,
+            "transcript": list(self.transcript),
+            "scores": self.scores.to_state(),
+        }
+
+    def restore(self, state: dict):
+        self.history.restore(state["history"], state["summary"])
+        self.transcript.extend(state["transcript"])
+        self.scores.restore(state["scores"])
+
+
+class SessionStore:
+    """
+    session-keyed conversation store with idle-TTL and LRU eviction
+    keeps memory per operation flat no matter how many sessions come and go
+    held in the memory of the job, so only a single job may serve the sessions (see SharedSessionStore)
+    """
+
+    def __init__(
+        self,
+        pinned: list = None,
+        ttl: int = 3600,
+        max_sessions: int = 1000,
+        max_messages: int = 50,
+        max_rounds: int = 500,
+        budget: int = 6000,
+        summarize=None,
+        score_categories: dict = None,
+    ):
+        self.pinned = pinned or []
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_rounds = max_rounds
+        self.budget = budget
+        self.summarize = summarize
+        self.score_categories = score_categories
+        # session_id -> Session, least recently used first
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if (
+                now - session.last_seen < self.ttl
+                and len(self.sessions) < self.max_sessions
+            ):
+                break
+            self.sessions.popitem(last=False)
+
+    def _new(self, session_id: str) -> Session:
+        return Session(
+            session_id,
+            self.pinned,
+            self.max_messages,
+            self.max_rounds,
+            self.budget,
+            self.summarize,
+            self.score_categories,
+        )
+
+    def get(self, session_id: str) -> Session:
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                self._evict()
+                session = self.sessions[session_id] = self._new(session_id)
+
+            session.last_seen = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            return session
+
+    @contextlib.contextmanager
+    def session(self, session_id: str):
+        """
+        the session, for a request that changes it (kept once the request is done)
+        """
+        yield self.get(session_id)
+
+    def reset(self, session_id: str) -> Session:
+        with self._lock:
+            self.sessions.pop(session_id, None)
+        return self.get(session_id)
+
+
+class SharedSessionStore(SessionStore):
+    """
+    session store kept in IRIS, one row per session, so every job of an operation serves every session
+    a session is read when a request starts and written back once it is done; a client sends the turns
+    of a session one at a time, so no two jobs change the same session at once
+    sessions idle for `ttl` seconds are deleted, and the least recently used ones beyond `max_sessions`
+    """
+
+    def __init__(self, database, name: str, **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+        # sessions of different operations (and their different state) share the table
+        self.name = name
+
+        self.metadata = MetaData()
+        self.table = Table(
+            "conversation_sessions",
+            self.metadata,
+            Column("store", String(64), primary_key=True),
+            Column("session_id", String(64), primary_key=True),
+            Column("state", Text, nullable=False),
+            # wall clock, comparable between jobs
+            Column("last_seen", Float, nullable=False),
+        )
+        self.database.create_all(self.metadata)
+        self.init_statements()
+
+    #*INFO: Built once, executed with bound parameters
+    def init_statements(self):
+        table = self.table
+        this_session = and_(
+            table.c.store == bindparam("b_store"),
+            table.c.session_id == bindparam("b_session_id"),
+        )
+        self.statements = {
+            "get": select(table.c.state, table.c.last_seen).where(this_session),
+            "insert": insert(table),
+            "update": update(table).where(this_session),
+            "delete": delete(table).where(this_session),
+            "count": select(func.count())
+            .select_from(table)
+            .where(table.c.store == bindparam("b_store")),
+            "expire": delete(table).where(
+                and_(
+                    table.c.store == bindparam("b_store"),
+                    table.c.last_seen < bindparam("b_before"),
+                )
+            ),
+            # least recently used first
+            "oldest": select(table.c.session_id)
+            .where(table.c.store == bindparam("b_store"))
+            .order_by(table.c.last_seen),
+            "delete_ids": delete(table).where(
+                and_(
+                    table.c.store == bindparam("b_store"),
+                    table.c.session_id.in_(bindparam("ids", expanding=True)),
+                )
+            ),
+        }
+
+    def __len__(self):
+        with self.database.connect() as connection:
+            return connection.execute(
+                self.statements["count"], {"b_store": self.name}
+            ).scalar()
+
+    def get(self, session_id: str) -> Session:
+        with self.database.connect() as connection:
+            row = connection.execute(
+                self.statements["get"],
+                {"b_store": self.name, "b_session_id": session_id},
+            ).first()
+        session = self._new(session_id)
+        if row is not None and time.time() - row.last_seen < self.ttl:
+            session.restore(json.loads(row.state))
+        return session
+
+    @contextlib.contextmanager
+    def session(self, session_id: str):
+        session = self.get(session_id)
+        yield session
+        # a request that failed leaves the session as it was
+        self._save(session)
+
+    def _save(self, session: Session):
+        values = {"state": json.dumps(session.to_state()), "last_seen": time.time()}
+        key = {"b_store": self.name, "b_session_id": session.session_id}
+        with self.database.begin() as connection:
+            if connection.execute(
+                self.statements["update"], {**key, **values}
+            ).rowcount:
+                return
+        try:
+            with self.database.begin() as connection:
+                connection.execute(
+                    self.statements["insert"],
+                    {"store": self.name, "session_id": session.session_id, **values},
+                )
+        except IntegrityError:
+            # created by another job since
+            with self.database.begin() as connection:
+                connection.execute(self.statements["update"], {**key, **values})
+            return
+        self._evict()
+
+    #*INFO: Only when a session is created, the one time the store can grow
+    def _evict(self):
+        with self.database.begin() as connection:
+            connection.execute(
+                self.statements["expire"],
+                {"b_store": self.name, "b_before": time.time() - self.ttl},
+            )
+            excess = (
+                connection.execute(
+                    self.statements["count"], {"b_store": self.name}
+                ).scalar()
+                - self.max_sessions
+            )
+            if excess > 0:
+                ids = connection.execute(
+                    self.statements["oldest"].limit(excess), {"b_store": self.name}
+                ).scalars()
+                connection.execute(
+                    self.statements["delete_ids"],
+                    {"b_store": self.name, "ids": list(ids)},
+                )
+
+    def reset(self, session_id: str) -> Session:
+        with self.database.begin() as connection:
+            connection.execute(
+                self.statements["delete"],
+                {"b_store": self.name, "b_session_id": session_id},
+            )
+        return self._new(session_id)
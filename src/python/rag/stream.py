@@ -0,0 +1,64 @@
+import time
+
+import iris
+
+STREAM_GLOBAL = "^ChatIRIS.Stream"
+
+
+class StreamChannel:
+    """
+    chunked response channel for a single chat turn, kept in an IRIS global
+    ChatOperation (in its production job) appends chunks as the model generates them,
+    the Chat page (in the Streamlit process) reads them as they arrive
+    """
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self.ref = iris.gref(STREAM_GLOBAL)
+
+    #*==================== WRITER ====================#
+    def write(self, chunk: str):
+        count = self.ref.get([self.stream_id, "count"], 0) + 1
+        self.ref.set([self.stream_id, count], chunk)
+        # the count is bumped last, so readers never see a missing chunk
+        self.ref.set([self.stream_id, "count"], count)
+
+    def close(self):
+        self.ref.set([self.stream_id, "done"], 1)
+
+    #*==================== WRITER ====================#
+
+    #*INFO: Called by whoever made the request once it is over, however it ended (failed part-way,
+    #* or the reader stopped early); a writer still running would only add its chunks back
+    def discard(self, after=None):
+        """
+        removes the channel from the global, once `after` (the future of the writing request) is done
+        """
+        if after is not None and not after.done():
+            after.add_done_callback(lambda _: self.ref.kill([self.stream_id]))
+            return
+        self.ref.kill([self.stream_id])
+
+    #*==================== READER ====================#
+    def read(self, until=None, poll_interval: float = 0.02):
+        """
+        yields chunks until the writer closes the channel, or `until()` is true and nothing is left
+        """
+        seq = 0
+        try:
+            while True:
+                done = self.ref.get([self.stream_id, "done"], 0)
+                count = self.ref.get([self.stream_id, "count"], 0)
+                while seq < count:
+                    seq += 1
+                    yield self.ref.get([self.stream_id, seq], "")
+
+                if done or (until is not None and until()):
+                    if seq == self.ref.get([self.stream_id, "count"], 0):
+                        break
+                    continue
+                time.sleep(poll_interval)
+        finally:
+            self.ref.kill([self.stream_id])
+
+    #*==================== READER ====================#
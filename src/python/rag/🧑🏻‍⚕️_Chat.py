@@ -1,24 +1,36 @@
+import sys
 import time
+import uuid
+from os.path import abspath
+from os.path import dirname as d
+
 import numpy as np
 import pandas as pd
 import streamlit as st
-from grongier.pex import Director
-import asyncio
 
-# Director setup for chat service
-st.session_state.chat_service = Director.create_python_business_service("ChatService")
+# Make the rag package importable from the Streamlit entrypoint
+sys.path.append(d(d(abspath(__file__))))
+from rag.client import get_chat_service
+from rag.stream import StreamChannel
+
+# Chat service client, shared by every session and rerun of this Streamlit process
+st.session_state.chat_service = get_chat_service()
 
 st.set_page_config(
     page_title="ChatIRIS",
     page_icon="🧑🏻‍⚕️",
     layout="wide",
-    initial_sidebar_state="collapsed"
+    initial_sidebar_state="collapsed",
 )
 
-def stream_message(text: str, speed: int):
-    for word in text.split(" "):
-        yield word + " "
-        time.sleep(1 / speed)
+
+def stream_message(channel: StreamChannel, until, placeholder):
+    for i, chunk in enumerate(channel.read(until=until)):
+        #* Hide the status as soon as the first token arrives
+        if i == 0:
+            placeholder.empty()
+        yield chunk
+
 
 def show_messages():
     for message in st.session_state.messages:
@@ -29,13 +41,22 @@ def show_messages():
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
+
 def init_session():
+    #* Identifies this browser session's conversation state in the production
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = str(uuid.uuid4())
+
     #* Load initial messages
     if "messages" not in st.session_state:
         with st.spinner("Initialising chat session..."):
-            st.session_state.chat_service.clear()
-            st.session_state["messages"] = st.session_state.chat_service.retrieve_messages()
-            time.sleep(1) # help the spinner to show up
+            st.session_state.chat_service.clear(st.session_state.session_id)
+            st.session_state[
+                "messages"
+            ] = st.session_state.chat_service.retrieve_messages(
+                st.session_state.session_id
+            )
+            time.sleep(1)  # help the spinner to show up
 
 
 def clear_session():
@@ -43,13 +64,14 @@ def clear_session():
         for key in st.session_state.keys():
             del st.session_state[key]
 
-        time.sleep(1) # help the spinner to show up
+        time.sleep(1)  # help the spinner to show up
+
 
 def show_faq():
     FAQ_QUESTIONS = {
         "How much does colorectal cancer screening cost?": "faq_cost",
         "How is colorectal cancer screening performed?": "faq_procedure",
-        "What are the benefits of colorectal cancer screening?": "faq_benefits"
+        "What are the benefits of colorectal cancer screening?": "faq_benefits",
     }
 
     selected_faq = None
@@ -64,36 +86,48 @@ def show_faq():
     if selected_faq is not None:
         handle_user_input(user_input=selected_faq)
 
+
 def show_reset_chat():
     with st.sidebar:
-        st.button('🔄 Reset', on_click=clear_session, use_container_width=True)
+        st.button("🔄 Reset", on_click=clear_session, use_container_width=True)
 
-async def handle_asst_output():
-    placeholder = st.empty()
-    with placeholder.status(label="Thinking...", expanded=True) as status:
-        st.write("Retrieving relevant information...")
-        # Call the chat service asynchronously to generate the response
-        rag_enabled = True
-        # response = st.session_state.chat_service.ask(st.session_state.messages, rag_enabled)
-        response = await asyncio.to_thread(st.session_state.chat_service.ask, st.session_state.messages, rag_enabled)
-
-        st.write("Generating response...")
-        await asyncio.sleep(0.5) # help the spinner to show up
 
-        status.update(label="Done", state="complete", expanded=False)
+def handle_asst_output():
+    placeholder = st.empty()
+    placeholder.status(label="Thinking...", expanded=False)
+
+    # Tokens are streamed through the channel while the request runs in the background
+    stream_id = str(uuid.uuid4())
+    rag_enabled = True
+    future = st.session_state.chat_service.submit(
+        "ask",
+        st.session_state.messages,
+        rag_enabled,
+        st.session_state.session_id,
+        stream_id,
+    )
+
+    #* Output the assistant's message
+    channel = StreamChannel(stream_id)
+    try:
+        asst_chat = st.chat_message("assistant")
+        asst_chat.write_stream(
+            stream_message(channel, until=future.done, placeholder=placeholder)
+        )
+        response = future.result()
+    finally:
+        #* Whatever happened to the request or the page, its chunks are dropped once it is over
+        channel.discard(after=future)
 
     placeholder.empty()
 
     if response:
-        # Once the response is ready, append it to session state
+        # Once the response is complete, append it to session state
         asst_msg = {"role": "assistant", "content": response}
         st.session_state.messages.append(asst_msg)
 
-        #* Output the user's message
-        asst_chat = st.chat_message(asst_msg["role"])
-        asst_chat.write_stream(stream_message(text=asst_msg["content"], speed=10))
 
-def handle_user_input(user_input:str):
+def handle_user_input(user_input: str):
     user_msg = {"role": "user", "content": user_input}
     #* Add the user's message to session
     st.session_state.messages.append(user_msg)
@@ -101,9 +135,18 @@ def handle_user_input(user_input:str):
     user_chat = st.chat_message(user_msg["role"])
     user_chat.markdown(user_msg["content"])
 
-    asyncio.run(handle_asst_output())
+    handle_asst_output()
+
+
+def show_health():
+    if not st.session_state.chat_service.healthy():
+        st.warning(
+            "The chat service is not responding, replies may fail until it is back."
+        )
+
 
 def main():
+    show_health()
     init_session()
     st.title("🧑🏻‍⚕️ ChatIRIS - CancerScreen")
 
@@ -115,5 +158,6 @@ def main():
     if prompt is not None and (user_input := prompt.strip()):
         handle_user_input(user_input=user_input)
 
+
 if __name__ == "__main__":
     main()
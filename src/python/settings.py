@@ -1,8 +1,9 @@
 from rag.business_operation import (
     ChatOperation,
-    ScoreOperation,
     ChromaVectorOperation,
+    HybridVectorOperation,
     IrisVectorOperation,
+    ScoreOperation,
 )
 from rag.business_process import ChatProcess
 from rag.business_service import ChatService
@@ -13,6 +14,7 @@ CLASSES = {
     "Python.ScoreOperation": ScoreOperation,
     "Python.ChatProcess": ChatProcess,
     "Python.IrisVectorOperation": IrisVectorOperation,
+    "Python.HybridVectorOperation": HybridVectorOperation,
     "Python.ChromaVectorOperation": ChromaVectorOperation,
 }
 
@@ -41,11 +43,27 @@ PRODUCTIONS = [
                     "@Name": "ChatOperation",
                     "@ClassName": "Python.ChatOperation",
                     "@Enabled": "true",
+                    "@PoolSize": "2",
+                    "Setting": [
+                        {
+                            "@Target": "Host",
+                            "@Name": "%settings",
+                            "#text": "llm_backend=openai",
+                        }
+                    ],
                 },
                 {
                     "@Name": "ScoreOperation",
                     "@ClassName": "Python.ScoreOperation",
                     "@Enabled": "true",
+                    "@PoolSize": "2",
+                    "Setting": [
+                        {
+                            "@Target": "Host",
+                            "@Name": "%settings",
+                            "#text": "llm_backend=openai\nscore_store=iris",
+                        }
+                    ],
                 },
                 {
                     "@Name": "ChatProcess",
@@ -55,7 +73,7 @@ PRODUCTIONS = [
                         {
                             "@Target": "Host",
                             "@Name": "%settings",
-                            "#text": "target_vector=IrisVectorOperation\ntarget_chat=ChatOperation\score_agent=ScoreOperation",
+                            "#text": "target_vector=IrisVectorOperation\nchat_agent=ChatOperation\nscore_agent=ScoreOperation\npipeline=sequential",
                         }
                     ],
                 },
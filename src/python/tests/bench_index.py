@@ -0,0 +1,65 @@
+"""
+recall and latency of the IVF index against an exact scan, over synthetic clustered embeddings
+    PYTHONPATH=. python tests/bench_index.py --size 100000 --nprobe 1 4 8 16 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rag.index import IVFIndex
+
+
+def make_vectors(size: int, dimension: int, clusters: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    vectors = centers[rng.integers(0, clusters, size)] + rng.normal(
+        scale=0.6, size=(size, dimension)
+    )
+    queries = vectors[rng.integers(0, size, 200)] + rng.normal(
+        scale=0.3, size=(200, dimension)
+    )
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def run(index: IVFIndex, queries, k: int, nprobe: int = None):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append({id for id, _ in index.search(query, k, nprobe=nprobe)})
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    vectors, queries = make_vectors(args.size, args.dimension, args.clusters)
+    ids = [str(i) for i in range(args.size)]
+
+    exact = IVFIndex(min_train_size=args.size + 1)
+    exact.add(ids, vectors)
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist, min_train_size=0)
+    ivf.add(ids, vectors)
+    print(
+        f"{args.size} vectors, {ivf.stats()['nlist']} clusters, built in {time.perf_counter() - start:.1f}s"
+    )
+
+    truth, exact_ms = run(exact, queries, args.k)
+    print(f"{'mode':<12}{'recall@' + str(args.k):>10}{'ms/query':>12}")
+    print(f"{'exact':<12}{1.0:>10.3f}{exact_ms:>12.2f}")
+    for nprobe in args.nprobe:
+        found, ms = run(ivf, queries, args.k, nprobe)
+        recall = np.mean([len(a & b) / args.k for a, b in zip(found, truth)])
+        print(f"{'nprobe=' + str(nprobe):<12}{recall:>10.3f}{ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
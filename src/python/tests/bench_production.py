@@ -0,0 +1,81 @@
+"""
+throughput of the ChatService -> ChatProcess -> operations chain, run inside the IRIS container
+set llm_backend=mock on ChatOperation and ScoreOperation first, so only the production's own overhead is measured,
+and response_cache=false on ChatProcess, so every request runs the whole chain
+    python tests/bench_production.py --requests 200 --concurrency 8
+"""
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from grongier.pex import Director
+
+QUESTIONS = (
+    "How much does colorectal cancer screening cost?",
+    "Is the FIT kit painful?",
+    "I have no symptoms, why should I get screened?",
+    "I'm scared of a colonoscopy.",
+)
+PEOPLE = (
+    "I'm {age} and work night shifts.",
+    "My {relative} had polyps removed at {age}.",
+    "I turned {age} last month.",
+)
+RELATIVES = ("father", "mother", "brother", "sister", "uncle", "aunt")
+
+
+def question(i: int) -> str:
+    # a different question for every request, so none is answered from the response cache
+    person = PEOPLE[i % len(PEOPLE)].format(
+        age=40 + i % 37, relative=RELATIVES[i % len(RELATIVES)]
+    )
+    return f"{person} {QUESTIONS[(i // len(PEOPLE)) % len(QUESTIONS)]} (request {i})"
+
+
+def response_cache_hits(service) -> int:
+    stats = (service.retrieve_cache_stats() or {}).get("response") or {}
+    return stats.get("hits", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    # one service handle and one session per worker, as separate users would have
+    workers = [
+        (Director.create_python_business_service("ChatService"), str(uuid.uuid4()))
+        for _ in range(args.concurrency)
+    ]
+
+    def ask(i: int) -> float:
+        service, session_id = workers[i % args.concurrency]
+        start = time.perf_counter()
+        service.ask([{"role": "user", "content": question(i)}], session_id=session_id)
+        return time.perf_counter() - start
+
+    hits = response_cache_hits(workers[0][0])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = np.array(list(executor.map(ask, range(args.requests)))) * 1000
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}: {args.requests / elapsed:.1f} req/s"
+    )
+    print(
+        f"p50 {np.percentile(latencies, 50):.0f} ms, p95 {np.percentile(latencies, 95):.0f} ms, "
+        f"p99 {np.percentile(latencies, 99):.0f} ms"
+    )
+    hits = response_cache_hits(workers[0][0]) - hits
+    if hits:
+        print(
+            f"warning: {hits} requests were answered from the response cache, set response_cache=false on ChatProcess"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import tempfile
+import unittest
+
+import pytest
+
+pytest.importorskip("langchain_iris")
+from rag.belief_store import BeliefStore, roll_up
+from rag.database import Database
+
+CATEGORIES = {
+    "incentive": ["increase_cure", "gain_control"],
+    "barriers": ["financial_concerns"],
+}
+
+
+class TestRollUp(unittest.TestCase):
+    def test_transition_and_time_to_positive(self):
+        rollup, increments = roll_up(None, -1, 0)
+        self.assertEqual(increments["sessions"], 1)
+        self.assertIsNone(rollup["first_positive_round"])
+
+        rollup, increments = roll_up(rollup, 1, 1)
+
+        self.assertEqual(rollup["transitions"], 1)
+        self.assertEqual(rollup["first_positive_round"], 1)
+        self.assertEqual(
+            increments,
+            {
+                "sessions": 0,
+                "rounds": 1,
+                "score_sum": 1,
+                "transitions": 1,
+                "positive_sessions": 1,
+                "rounds_to_positive": 1,
+            },
+        )
+        # only the first time a belief turns positive counts
+        _, increments = roll_up(rollup, 1, 2)
+        self.assertEqual(increments["positive_sessions"], 0)
+
+
+class TestBeliefStore(unittest.TestCase):
+    #* The store only uses portable SQL, so it is exercised against SQLite here
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = BeliefStore(
+            Database(f"sqlite:///{self.directory.name}/beliefs.db"), CATEGORIES
+        )
+
+    def tearDown(self):
+        self.store.database.engine.dispose()
+        self.directory.cleanup()
+
+    def test_record(self):
+        self.assertEqual(self.store.record("a", {"increase_cure": -1}), 0)
+        self.assertEqual(
+            self.store.record("a", {"increase_cure": 1, "financial_concerns": -1}), 1
+        )
+        self.assertEqual(self.store.record("b", {"increase_cure": 1}), 0)
+
+        population = self.store.population()
+
+        self.assertEqual(population["sessions"], 2)
+        cure = population["beliefs"]["increase_cure"]
+        self.assertAlmostEqual(cure["mean_score"], 1 / 3)
+        self.assertEqual(cure["transitions"], 1)
+        self.assertEqual(cure["positive_rate"], 1.0)
+        self.assertEqual(cure["mean_rounds_to_positive"], 0.5)
+        self.assertEqual(population["categories"]["barriers"]["mean_score"], -1 / 3)
+        self.assertIsNone(
+            population["categories"]["barriers"]["mean_rounds_to_positive"]
+        )
+
+    def test_reopen(self):
+        self.store.record("a", {"gain_control": 1})
+
+        reopened = BeliefStore(self.store.database, CATEGORIES)
+
+        self.assertEqual(reopened.record("a", {"gain_control": 1}), 1)
+        self.assertEqual(
+            reopened.population()["beliefs"]["gain_control"]["sessions"], 1
+        )
+
+    def test_pooled_connections(self):
+        database = Database(
+            f"sqlite:///{self.directory.name}/pooled.db", pool_size=1, max_overflow=0
+        )
+        store = BeliefStore(database, CATEGORIES)
+        store.record("a", {"gain_control": 1})
+
+        # creating the tables, seeding the population and recording all borrowed from the pool
+        self.assertEqual(database.stats()["checkouts"], 3)
+        self.assertEqual(database.stats()["checked_out"], 0)
+        database.engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
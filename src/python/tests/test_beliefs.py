@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from rag.beliefs import BeliefConfig, CompiledBeliefs
+
+SRC_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag"
+)
+
+
+def create_belief_prompt(belief_map: dict, arguments: list) -> str:
+    """
+    the belief prompt as ScoreOperation built it before the configuration was compiled
+    """
+    round_data = {key: 0 for key in belief_map.keys()}
+    for function_args in arguments:
+        round_data.update(function_args)
+
+    belief_prompt = "The [SCORING AGENT] evaluated the [USER]'s beliefs and recommend the following: \n"
+    for key, value in round_data.items():
+        belief = belief_map[key]
+        if value == -1:
+            belief_prompt += (
+                "[ASSISTANT] can help [USER] understand that {}. \n".format(belief)
+            )
+        if value == 1:
+            belief_prompt += (
+                "[ASSISTANT] can affirm [USER]'s belief that {}. \n".format(belief)
+            )
+        if value == 0:
+            belief_prompt += (
+                "[ASSISTANT] can ask [USER] whether they believe that {}. \n".format(
+                    belief
+                )
+            )
+    return belief_prompt
+
+
+class TestBeliefConfig(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for folder in ("tools", "prompts"):
+            shutil.copytree(
+                os.path.join(SRC_PATH, folder),
+                os.path.join(self.directory.name, folder),
+            )
+        self.config = BeliefConfig(self.directory.name, reload_interval=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_render(self):
+        beliefs = self.config.current()
+        state = beliefs.state(
+            [{"increase_cure": 1, "financial_concerns": -1.0, "unknown": 1}]
+        )
+
+        prompt = beliefs.render(state)
+
+        self.assertEqual(state.dtype, np.int8)
+        self.assertEqual(beliefs.as_dict(state)["financial_concerns"], -1)
+        lines = prompt.splitlines()
+        self.assertEqual(len(lines), len(beliefs.keys) + 1)
+        self.assertIn(
+            "affirm [USER]'s belief that " + beliefs.belief_map["increase_cure"],
+            lines[1],
+        )
+        self.assertIn(
+            "understand that " + beliefs.belief_map["financial_concerns"],
+            lines[1 + beliefs.index["financial_concerns"]],
+        )
+
+    def test_render_as_before(self):
+        beliefs = self.config.current()
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            scores = rng.choice([-1, 0, 1, -1.0, 1.0], size=len(beliefs.keys)).tolist()
+            arguments = [dict(zip(beliefs.keys, scores))]
+
+            self.assertEqual(
+                beliefs.render(beliefs.state(arguments)),
+                create_belief_prompt(beliefs.belief_map, arguments),
+            )
+
+    def test_render_in_belief_map_order(self):
+        def tool(name, keys):
+            return {
+                "function": {
+                    "name": name,
+                    "parameters": {"properties": {key: {} for key in keys}},
+                }
+            }
+
+        belief_map = {"a": "A", "b": "B", "c": "C"}
+        # tools list the beliefs in another order, and leave one out
+        beliefs = CompiledBeliefs(
+            [tool("calculate_x_belief_policy", ["c", "a"])], belief_map, ""
+        )
+        arguments = [{"a": 1, "c": -1}]
+
+        self.assertEqual(
+            beliefs.render(beliefs.state(arguments)),
+            create_belief_prompt(belief_map, arguments),
+        )
+
+    def test_reload_on_change(self):
+        beliefs = self.config.current()
+        self.assertIs(self.config.current(), beliefs)
+
+        map_path = os.path.join(self.directory.name, "tools", "belief_map.json")
+        belief_map = dict(beliefs.belief_map, increase_cure="screening saves lives")
+        with open(map_path, "w") as file:
+            json.dump(belief_map, file)
+        os.utime(map_path, ns=(0, 0))
+
+        reloaded = self.config.current()
+
+        self.assertEqual(reloaded.version, beliefs.version + 1)
+        self.assertIn(
+            "screening saves lives",
+            reloaded.render(np.ones(len(reloaded.keys), dtype=np.int8)),
+        )
+
+    def test_bad_reload_keeps_previous(self):
+        beliefs = self.config.current()
+
+        map_path = os.path.join(self.directory.name, "tools", "belief_map.json")
+        with open(map_path, "w") as file:
+            file.write("{")
+        os.utime(map_path, ns=(0, 0))
+        log_warning = mock.Mock()
+
+        self.assertIs(self.config.current(log_warning), beliefs)
+        self.assertIn("not reloaded", log_warning.call_args.args[0])
+
+    def test_missing_file_reported(self):
+        os.remove(os.path.join(self.directory.name, "prompts", "belief_prompt.txt"))
+        log_warning = mock.Mock()
+
+        beliefs = self.config.current(log_warning)
+
+        self.assertEqual(beliefs.prompt, "")
+        self.assertIn("belief_prompt.txt not found", log_warning.call_args.args[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
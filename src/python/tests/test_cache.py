@@ -0,0 +1,112 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from rag.cache import ResponseCache, history_hash
+
+HISTORY = history_hash(
+    [
+        {
+            "role": "assistant",
+            "content": "Hi, what would you like to know about screening?",
+        }
+    ]
+)
+
+
+class FakeEmbeddings:
+    """
+    embeds a query as the counts of a few words, so rephrasings that share them are near each other
+    """
+
+    WORDS = ("cost", "screening", "colonoscopy", "free", "much")
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, query: str) -> list:
+        self.calls += 1
+        words = query.lower().split()
+        return [float(words.count(word)) for word in self.WORDS] + [0.1]
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.embeddings = FakeEmbeddings()
+        self.cache = ResponseCache(self.embeddings, capacity=2, ttl=60, threshold=0.95)
+
+    def test_exact_hit(self):
+        self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+
+        # same question once normalised, found by key without embedding it
+        calls = self.embeddings.calls
+        self.assertEqual(
+            self.cache.get("  how much does SCREENING cost ", HISTORY), "It is free."
+        )
+        self.assertEqual(self.embeddings.calls, calls)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_near_hit(self):
+        self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+
+        self.assertEqual(
+            self.cache.get("How much does the screening cost", HISTORY), "It is free."
+        )
+        self.assertIsNone(self.cache.get("What is a colonoscopy?", HISTORY))
+        self.assertEqual((self.cache.near_hits, self.cache.misses), (1, 1))
+
+    def test_keyed_by_history(self):
+        self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+
+        other = history_hash([{"role": "user", "content": "I have no insurance."}])
+        self.assertIsNone(self.cache.get("How much does screening cost?", other))
+
+    def test_given_embedding_reused_by_put(self):
+        embedding = self.embeddings.embed_query("what does a colonoscopy cost")
+        calls = self.embeddings.calls
+
+        self.assertIsNone(
+            self.cache.get("What does a colonoscopy cost?", HISTORY, embedding)
+        )
+        self.cache.put(
+            "What does a colonoscopy cost?", HISTORY, "It depends on your plan."
+        )
+
+        self.assertEqual(self.embeddings.calls, calls)
+        np.testing.assert_allclose(
+            np.linalg.norm(self.cache.embedded["what does a colonoscopy cost"]), 1.0
+        )
+
+    def test_entries_expire(self):
+        with mock.patch("rag.cache.time.monotonic", return_value=1000.0):
+            self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+
+        with mock.patch("rag.cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(self.cache.get("How much does screening cost?", HISTORY))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_least_recently_used_evicted(self):
+        self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+        self.cache.put("What is a colonoscopy?", HISTORY, "An exam of the colon.")
+        # used again, so the colonoscopy answer is now the least recently used
+        self.cache.get("How much does screening cost?", HISTORY)
+
+        self.cache.put("Is it free?", HISTORY, "Yes.")
+
+        self.assertEqual(
+            [query for _, query in self.cache.entries],
+            ["how much does screening cost", "is it free"],
+        )
+
+    def test_clear(self):
+        self.cache.put("How much does screening cost?", HISTORY, "It is free.")
+
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get("How much does screening cost?", HISTORY))
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("grongier.pex")
+pytest.importorskip("iris")
+from rag import business_process
+from rag.business_process import ChatProcess
+from rag.msg import (
+    ChatHistoryAppendRequest,
+    ChatPipelineState,
+    ChatRequest,
+    ChatResponse,
+    ScoreResponse,
+    VectorSearchRequest,
+    VectorSearchResponse,
+)
+
+QUERY = "How much does screening cost?"
+DOCS = [{"id": "1", "page_content": "The FIT kit is free."}]
+
+
+class TestConcurrentPipeline(unittest.TestCase):
+    def setUp(self):
+        # created the way PEX creates components, settings first, then on_init
+        self.process = ChatProcess.__new__(ChatProcess)
+        self.process.pipeline = "concurrent"
+        self.process.response_cache = "false"
+        self.process.on_init()
+
+        self.process.iris_handle = mock.Mock()
+        self.process.iris_handle.SendRequestAsync.return_value = 1
+        self.process.send_request_sync = mock.Mock(
+            return_value=ChatResponse(response="It is free.")
+        )
+        self.status = mock.patch.object(business_process, "iris")
+        self.iris = self.status.start()
+        self.iris.cls.return_value.IsError.return_value = 0
+
+        self.request = ChatRequest(
+            messages=[{"role": "user", "content": QUERY}], session_id="a"
+        )
+
+    def tearDown(self):
+        self.status.stop()
+
+    def sent(self) -> dict:
+        return {
+            call.args[3]: call.args[:2]
+            for call in self.process.iris_handle.SendRequestAsync.call_args_list
+        }
+
+    def test_fan_out(self):
+        state = self.process.ask(self.request)
+
+        self.assertIsInstance(state, ChatPipelineState)
+        sent = self.sent()
+        self.assertEqual(set(sent), {"score", "rag"})
+        self.assertEqual(sent["score"][0], "ScoreOperation")
+        self.assertEqual(sent["score"][1].messages, self.request.messages)
+        self.assertEqual(sent["rag"][0], "IrisVectorOperation")
+        self.assertIsInstance(sent["rag"][1], VectorSearchRequest)
+        self.assertEqual(sent["rag"][1].query, QUERY)
+        self.process.send_request_sync.assert_not_called()
+
+    def test_join(self):
+        state = self.process.ask(self.request)
+        score = ScoreResponse(
+            response="The user worries about cost.", scores={"financial_concerns": -1}
+        )
+
+        # responses arrive in either order, each one is folded into the state
+        state = self.process.on_response(
+            self.request, state, None, VectorSearchResponse(docs=DOCS), "rag"
+        )
+        state = self.process.on_response(self.request, state, None, score, "score")
+        response = self.process.on_complete(self.request, state)
+
+        self.assertEqual(state.scores, {"financial_concerns": -1})
+        self.assertEqual(response.response, "It is free.")
+        target, chat_request = self.process.send_request_sync.call_args.args
+        self.assertEqual(target, "ChatOperation")
+        prompt = chat_request.messages[0]["content"]
+        self.assertIn(QUERY + "\nThe user worries about cost.", prompt)
+        self.assertIn(DOCS[0]["page_content"], prompt)
+        self.assertEqual(chat_request.session_id, "a")
+
+    def test_join_without_responses(self):
+        # e.g. both agents failed, the chat agent still answers the user's own words
+        response = self.process.on_complete(self.request, ChatPipelineState())
+
+        self.assertEqual(response.response, "It is free.")
+        self.assertEqual(
+            self.process.send_request_sync.call_args.args[1].messages[0]["content"],
+            QUERY,
+        )
+
+    def test_failed_dispatch_raises(self):
+        self.iris.cls.return_value.IsError.return_value = 1
+        self.iris.cls.return_value.GetErrorText.return_value = (
+            "ERROR #5001: target not found"
+        )
+
+        with self.assertRaises(RuntimeError) as raised:
+            self.process.ask(self.request)
+
+        self.assertIn("target not found", str(raised.exception))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.process = ChatProcess.__new__(ChatProcess)
+        self.process.on_init()
+        self.process.send_request_async = mock.Mock()
+        self.request = ChatRequest(
+            messages=[{"role": "user", "content": QUERY}],
+            session_id="a",
+            history_hash="0123abcd",
+        )
+
+    def appended(self) -> dict:
+        return {
+            call.args[0]: call.args[1].messages
+            for call in self.process.send_request_async.call_args_list
+            if isinstance(call.args[1], ChatHistoryAppendRequest)
+        }
+
+    def test_hit_skips_scoring_and_generation(self):
+        self.process.send_request_sync = mock.Mock(
+            return_value=VectorSearchResponse(cached_response="It is free.")
+        )
+
+        response = self.process.ask(self.request)
+
+        self.assertEqual(response.response, "It is free.")
+        # one lookup, made by the retrieval itself
+        target, rag_request = self.process.send_request_sync.call_args.args
+        self.assertEqual(self.process.send_request_sync.call_count, 1)
+        self.assertEqual(
+            (target, rag_request.history_hash), ("IrisVectorOperation", "0123abcd")
+        )
+        # the agents get the turn without anyone waiting on them
+        appended = self.appended()
+        self.assertEqual(appended["ScoreOperation"], self.request.messages)
+        self.assertEqual(
+            appended["ChatOperation"][-1],
+            {"role": "assistant", "content": "It is free."},
+        )
+
+    def test_miss_is_stored(self):
+        self.process.send_request_sync = mock.Mock(
+            side_effect=[
+                VectorSearchResponse(docs=DOCS),
+                ScoreResponse(response="The user worries about cost."),
+                ChatResponse(response="It is free."),
+            ]
+        )
+
+        self.process.ask(self.request)
+
+        store_request = self.process.send_request_async.call_args.args[1]
+        self.assertEqual(
+            (store_request.query, store_request.history_hash, store_request.response),
+            (QUERY, "0123abcd", "It is free."),
+        )
+        self.assertFalse(self.appended())
+
+    def test_hit_in_concurrent_pipeline(self):
+        self.process.send_request_sync = mock.Mock()
+        state = ChatPipelineState()
+        state = self.process.on_response(
+            self.request,
+            state,
+            None,
+            VectorSearchResponse(docs=[], cached_response="It is free."),
+            "rag",
+        )
+
+        response = self.process.on_complete(self.request, state)
+
+        self.assertEqual(response.response, "It is free.")
+        self.process.send_request_sync.assert_not_called()
+        # the score agent was already sent the turn
+        self.assertEqual(list(self.appended()), ["ChatOperation"])
+
+    def test_disabled(self):
+        self.process.response_cache = "false"
+        self.process.on_init()
+
+        self.assertEqual(
+            self.process._rag_request(self.request, QUERY).history_hash, ""
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
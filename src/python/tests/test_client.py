@@ -0,0 +1,141 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("grongier.pex")
+from rag import client
+from rag.client import ChatServiceClient
+
+
+class FakeProxy:
+    """
+    business service proxy returned by the Director, fails if two threads use it at once
+    """
+
+    def __init__(self, director):
+        self.director = director
+        self.in_use = threading.Lock()
+
+    def __getattr__(self, method: str):
+        def call(*args, **kwargs):
+            if not self.in_use.acquire(blocking=False):
+                raise AssertionError("proxy shared between concurrent calls")
+            try:
+                self.director.calls.append((self, method, args))
+                if self.director.failures:
+                    self.director.failures -= 1
+                    raise ConnectionError("production stopped")
+                time.sleep(self.director.latency)
+                return f"{method}{args}"
+            finally:
+                self.in_use.release()
+
+        return call
+
+
+class FakeDirector:
+    def __init__(self, latency: float = 0.0, failures: int = 0):
+        self.latency = latency
+        self.failures = failures
+        self.calls = []
+        self.proxies = []
+
+    def create_python_business_service(self, name: str):
+        proxy = FakeProxy(self)
+        self.proxies.append(proxy)
+        return proxy
+
+
+class ClientTestCase(unittest.TestCase):
+    def director(self, **kwargs) -> FakeDirector:
+        director = FakeDirector(**kwargs)
+        patcher = mock.patch.object(client, "Director", director)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return director
+
+
+class TestProxyPool(ClientTestCase):
+    def test_proxy_reused(self):
+        director = self.director()
+        chat_service = ChatServiceClient(workers=2)
+
+        self.assertEqual(chat_service.ask([], True, "a"), "ask([], True, 'a')")
+        self.assertEqual(chat_service.call("clear", "a"), "clear('a',)")
+
+        self.assertEqual(len(director.proxies), 1)
+        with self.assertRaises(AttributeError):
+            chat_service._private
+
+    def test_concurrent_calls_never_share_a_proxy(self):
+        director = self.director(latency=0.05)
+        chat_service = ChatServiceClient(workers=4)
+        self.addCleanup(chat_service.executor.shutdown)
+
+        futures = [chat_service.submit("ask", [], True, str(i)) for i in range(12)]
+
+        self.assertEqual(
+            sorted(future.result() for future in futures),
+            sorted(f"ask([], True, '{i}')" for i in range(12)),
+        )
+        # at most one proxy per worker thread, all of them back in the pool
+        self.assertLessEqual(len(director.proxies), 4)
+        self.assertEqual(chat_service.proxies.qsize(), len(director.proxies))
+
+    def test_failed_proxy_dropped(self):
+        director = self.director(failures=1)
+        chat_service = ChatServiceClient()
+
+        with self.assertRaises(ConnectionError):
+            chat_service.ask([], True, "a")
+        # not retried, the next call reconnects
+        self.assertEqual(chat_service.ask([], True, "a"), "ask([], True, 'a')")
+
+        self.assertEqual(len(director.calls), 2)
+        self.assertEqual(len(director.proxies), 2)
+        self.assertEqual(chat_service.proxies.qsize(), 1)
+
+    def test_acall(self):
+        self.director()
+        chat_service = ChatServiceClient()
+        self.addCleanup(chat_service.executor.shutdown)
+
+        async def ask_both():
+            return await asyncio.gather(
+                chat_service.acall("ask", [], True, "a"),
+                chat_service.acall("ask", [], True, "b"),
+            )
+
+        self.assertEqual(
+            asyncio.run(ask_both()), ["ask([], True, 'a')", "ask([], True, 'b')"]
+        )
+
+
+class TestHealth(ClientTestCase):
+    def test_checked_at_most_once_per_max_age(self):
+        director = self.director()
+        chat_service = ChatServiceClient()
+
+        self.assertTrue(chat_service.healthy())
+        self.assertTrue(chat_service.healthy())
+
+        self.assertEqual(
+            [method for _, method, _ in director.calls], ["retrieve_beliefs"]
+        )
+
+    def test_unhealthy_until_the_production_answers(self):
+        director = self.director(failures=1)
+        chat_service = ChatServiceClient()
+
+        self.assertFalse(chat_service.healthy(max_age=0))
+        self.assertTrue(chat_service.healthy(max_age=0))
+        self.assertEqual(len(director.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from unittest import mock
+
+from rag import context
+from rag.context import (
+    ContextWindow,
+    count_message_tokens,
+    count_tokens,
+    trim_to_budget,
+)
+
+
+def message(content: str, role: str = "user") -> dict:
+    return {"role": role, "content": content}
+
+
+class TestTrimToBudget(unittest.TestCase):
+    def setUp(self):
+        self.messages = [message(f"message {i} " * 10) for i in range(5)]
+        self.tokens = [count_message_tokens(message) for message in self.messages]
+
+    def test_budget_boundary(self):
+        # exactly the last two fit, one token less and only the last one does
+        budget = sum(self.tokens[-2:])
+
+        self.assertEqual(trim_to_budget(self.messages, budget), self.messages[-2:])
+        self.assertEqual(trim_to_budget(self.messages, budget - 1), self.messages[-1:])
+        self.assertEqual(trim_to_budget(self.messages, sum(self.tokens)), self.messages)
+
+    def test_keeps_the_last_message(self):
+        self.assertEqual(trim_to_budget(self.messages, 0), self.messages[-1:])
+        self.assertEqual(trim_to_budget([], 100), [])
+
+
+class TestContextWindow(unittest.TestCase):
+    def test_budget_boundary(self):
+        messages = [message(f"message {i} " * 10) for i in range(3)]
+        tokens = [count_message_tokens(message) for message in messages]
+        window = ContextWindow(budget=sum(tokens[1:]), max_messages=10)
+
+        for message_ in messages:
+            window.append(message_)
+
+        self.assertEqual(window.messages, messages[1:])
+        self.assertEqual(window.tokens, sum(tokens[1:]))
+
+    def test_max_messages(self):
+        window = ContextWindow(budget=10000, max_messages=2)
+
+        for i in range(4):
+            window.append(message(str(i)))
+
+        self.assertEqual(
+            [message["content"] for message in window.messages], ["2", "3"]
+        )
+
+    def test_summary_rollover(self):
+        summarize = mock.Mock(
+            side_effect=lambda summary, evicted: summary
+            + "".join(m["content"][0] for m in evicted)
+        )
+        window = ContextWindow(budget=10000, max_messages=2, summarize=summarize)
+
+        for content in ("alpha", "bravo", "charlie", "delta"):
+            window.append(message(content))
+
+        # each slide folds what left the window into the previous summary
+        self.assertEqual(
+            summarize.call_args_list,
+            [
+                mock.call("", [message("alpha")]),
+                mock.call("a", [message("bravo")]),
+            ],
+        )
+        self.assertEqual(window.summary, "ab")
+        self.assertEqual(
+            window.messages[0],
+            {"role": "system", "content": "Summary of the earlier conversation: ab"},
+        )
+        self.assertEqual(window.messages[1:], [message("charlie"), message("delta")])
+
+    def test_summary_counts_toward_the_budget(self):
+        # 11 tokens per message and for the summary
+        messages = [message(str(i) * 24) for i in range(4)]
+        window = ContextWindow(budget=30, summarize=lambda summary, evicted: "s" * 40)
+        with mock.patch.object(context, "_encoding", None):
+            count_tokens.cache_clear()
+            for message_ in messages:
+                window.append(message_)
+        count_tokens.cache_clear()
+
+        # without the summary the last two messages would still fit
+        self.assertEqual(window.summary_tokens, 11)
+        self.assertEqual(window.messages[1:], messages[-1:])
+        self.assertLessEqual(window.tokens + window.summary_tokens, window.budget)
+
+    def test_restore(self):
+        window = ContextWindow(budget=10000)
+        window.restore([message("alpha"), message("bravo")], summary="earlier")
+
+        self.assertEqual(
+            window.tokens,
+            count_message_tokens(message("alpha"))
+            + count_message_tokens(message("bravo")),
+        )
+        self.assertEqual(window.summary_tokens, count_tokens("earlier"))
+        self.assertEqual(len(window), 2)
+
+
+class TestTokenCount(unittest.TestCase):
+    def setUp(self):
+        count_tokens.cache_clear()
+
+    def tearDown(self):
+        count_tokens.cache_clear()
+
+    def test_estimate_without_tiktoken(self):
+        with mock.patch.object(context, "_encoding", None):
+            self.assertEqual(count_tokens(""), 1)
+            self.assertEqual(count_tokens("a" * 40), 11)
+            self.assertEqual(count_message_tokens(message("a" * 40)), 15)
+            self.assertEqual(
+                count_message_tokens({"role": "assistant", "content": None}), 5
+            )
+
+    def test_encoding(self):
+        encoding = mock.Mock()
+        encoding.encode.side_effect = str.split
+        with mock.patch.object(context, "_encoding", encoding):
+            self.assertEqual(count_tokens("screening is free"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("langchain_core")
+from rag.embedding import CachedEmbeddings, EmbeddingCache, EmbeddingService
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.model = MagicMock()
+        self.model.embed_documents.side_effect = lambda texts: [
+            [float(len(text)), 1.0] for text in texts
+        ]
+
+    def test_hit_skips_model(self):
+        embeddings = CachedEmbeddings(
+            self.model, EmbeddingCache(self.cache_dir, "model")
+        )
+
+        embeddings.embed_documents(["a", "bb"])
+        embeddings.embed_documents(["a", "bb"])
+
+        self.model.embed_documents.assert_called_once_with(["a", "bb"])
+        self.assertEqual(embeddings.cache.stats()["hits"], 2)
+
+    def test_persists_across_instances(self):
+        CachedEmbeddings(
+            self.model, EmbeddingCache(self.cache_dir, "model")
+        ).embed_documents(["a"])
+
+        cache = EmbeddingCache(self.cache_dir, "model")
+
+        self.assertEqual(cache.get("a"), [1.0, 1.0])
+
+    def test_keyed_by_model(self):
+        CachedEmbeddings(
+            self.model, EmbeddingCache(self.cache_dir, "model")
+        ).embed_documents(["a"])
+
+        cache = EmbeddingCache(self.cache_dir, "other-model")
+
+        self.assertIsNone(cache.get("a"))
+
+    def test_second_writer_stays_in_memory(self):
+        first = EmbeddingCache(self.cache_dir, "model")
+        second = EmbeddingCache(self.cache_dir, "model")
+        first.put("a", [1.0, 1.0])
+        first.flush()
+        second.put("a", [9.0, 9.0])
+        second.put("b", [2.0, 1.0])
+        second.flush()
+
+        self.assertFalse(second.stats()["persistent"])
+        self.assertEqual(first.get("a"), [1.0, 1.0])
+        first.close()
+        reopened = EmbeddingCache(self.cache_dir, "model")
+        self.assertEqual(reopened.get("a"), [1.0, 1.0])
+        self.assertIsNone(reopened.get("b"))
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(self.cache_dir, "model", capacity=2)
+        cache.put("a", [1.0, 1.0])
+        cache.put("b", [2.0, 1.0])
+        cache.get("a")
+        cache.put("c", [3.0, 1.0])
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [1.0, 1.0])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class TestEmbeddingService(unittest.TestCase):
+    def setUp(self):
+        self.model = MagicMock()
+        self.model.embed_documents.side_effect = lambda texts: [
+            [float(len(text)), 1.0] for text in texts
+        ]
+
+    def test_concurrent_calls_are_coalesced(self):
+        service = EmbeddingService(self.model, max_wait=0.05)
+        results = {}
+
+        def embed(i):
+            results[i] = service.embed_documents([str(i) * (i + 1), "shared"])
+
+        threads = [threading.Thread(target=embed, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.model.embed_documents.call_count, 1)
+        self.assertEqual(len(self.model.embed_documents.call_args[0][0]), 5)
+        self.assertEqual(results[2], [[3.0, 1.0], [6.0, 1.0]])
+
+    def test_shared_loads_model_once(self):
+        factory = MagicMock(return_value=self.model)
+
+        first = EmbeddingService.shared("test", factory)
+        second = EmbeddingService.shared("test", factory)
+
+        self.assertIs(first, second)
+        factory.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from rag.index import IVFIndex
+
+
+class TestIVFIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(16, 32))
+        self.vectors = centers[rng.integers(0, 16, 2000)] + rng.normal(
+            scale=0.3, size=(2000, 32)
+        )
+        self.ids = [str(i) for i in range(len(self.vectors))]
+
+    def test_exact_below_train_size(self):
+        index = IVFIndex(min_train_size=10000)
+        index.add(self.ids, self.vectors)
+
+        hits = index.search(self.vectors[7], k=3)
+
+        self.assertFalse(index.stats()["trained"])
+        self.assertEqual(hits[0][0], "7")
+        self.assertAlmostEqual(hits[0][1], 0.0, places=5)
+        self.assertEqual(
+            [distance for _, distance in hits], sorted(distance for _, distance in hits)
+        )
+
+    def test_trained_search_finds_neighbours(self):
+        index = IVFIndex(nprobe=4, min_train_size=1000)
+        index.add(self.ids, self.vectors)
+
+        self.assertTrue(index.stats()["trained"])
+        for i in range(0, 2000, 97):
+            self.assertEqual(index.search(self.vectors[i], k=1)[0][0], str(i))
+
+    def test_remove_and_clear(self):
+        index = IVFIndex(min_train_size=1000)
+        index.add(self.ids, self.vectors)
+        index.remove(["7", "1999"])
+
+        self.assertEqual(len(index), 1998)
+        self.assertNotIn("7", [id for id, _ in index.search(self.vectors[7], k=5)])
+        self.assertEqual(index.search(self.vectors[1998], k=1)[0][0], "1998")
+
+        index.clear()
+        self.assertEqual(index.search(self.vectors[0], k=1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
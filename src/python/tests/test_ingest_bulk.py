@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+pytest.importorskip("grongier.pex")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_iris")
+from langchain.docstore.document import Document
+
+from rag.business_operation import VectorBaseOperation
+from rag.manifest import DocumentManifest
+from rag.msg import BulkIngestionRequest
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class MemoryVectorOperation(VectorBaseOperation):
+    """
+    vector operation over a dict, enough to drive ingestion end to end
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.store = {}
+
+    def _delete_all(self):
+        self.store.clear()
+
+    def _delete_ids(self, ids: list):
+        for id in ids:
+            self.store.pop(id, None)
+
+    def _existing_ids(self, ids: list) -> set:
+        return set(ids) & set(self.store)
+
+    def _search(self, embedding: list, k: int) -> list:
+        return []
+
+    def _write_chunks(self, ids: list, chunks: list, embeddings: list):
+        # a primary key, like the IRIS table's
+        if set(ids) & set(self.store):
+            raise IntegrityError("INSERT", ids, Exception("duplicate id"))
+        self.store.update(zip(ids, chunks))
+
+
+class TestIngestBulk(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for i in range(3):
+            with open(os.path.join(self.directory.name, f"doc{i}.txt"), "w") as file:
+                file.write(f"Document {i}. " * 200)
+
+        self.operation = MemoryVectorOperation()
+        self.operation.ingest_workers = 2
+        self.operation.init_batch_size()
+        self.operation.embeddings = FakeEmbeddings()
+        self.operation.response_cache = MagicMock()
+        self.operation.manifest = DocumentManifest()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ingest(self):
+        return self.operation.ingest_bulk(
+            BulkIngestionRequest(directory=self.directory.name)
+        ).files
+
+    def test_worker_processes(self):
+        reports = self.ingest()
+
+        self.assertEqual(len(reports), 3)
+        self.assertFalse([report for report in reports if "error" in report])
+        self.assertEqual(
+            sum(report["stored"] for report in reports), len(self.operation.store)
+        )
+        self.assertTrue(self.operation.store)
+        # nothing changed, nothing is parsed again
+        self.assertTrue(all(report.get("unchanged") for report in self.ingest()))
+
+    def test_in_process_without_interpreter(self):
+        self.operation.ingest_python = "/nonexistent/python"
+
+        reports = self.ingest()
+
+        self.assertFalse([report for report in reports if "error" in report])
+        self.assertEqual(
+            sum(report["stored"] for report in reports), len(self.operation.store)
+        )
+
+    def test_hooks_required(self):
+        class PartialVectorOperation(VectorBaseOperation):
+            def _search(self, embedding: list, k: int) -> list:
+                return []
+
+        with self.assertRaises(TypeError):
+            PartialVectorOperation()
+
+    def test_duplicates_skipped_before_embedding(self):
+        stored_chunk = Document(page_content="chunk 0")
+        self.operation.store[self.operation._chunk_id(stored_chunk)] = stored_chunk
+        # a chunk repeated within the batch and one stored by an earlier batch
+        chunks = [
+            Document(page_content=text)
+            for text in ("chunk 0", "chunk 1", "chunk 1", "chunk 2")
+        ]
+
+        stored = self.operation._store_chunks(chunks)
+
+        self.assertEqual(stored, 2)
+        self.assertEqual(self.operation.embeddings.embedded, ["chunk 1", "chunk 2"])
+        self.assertEqual(len(self.operation.store), 3)
+        self.operation.response_cache.clear.assert_called_once()
+
+        # nothing new, nothing embedded or written and the cached answers stay valid
+        self.assertEqual(self.operation._store_chunks(chunks), 0)
+        self.assertEqual(len(self.operation.embeddings.embedded), 2)
+        self.operation.response_cache.clear.assert_called_once()
+
+    def test_duplicate_written_by_another_job(self):
+        chunks = [Document(page_content=f"chunk {i}") for i in range(4)]
+        existing_ids = self.operation._existing_ids
+
+        # the first chunk is stored by someone else between the existence check and the write
+        def racing_existing_ids(ids):
+            found = existing_ids(ids)
+            self.operation.store.setdefault(
+                self.operation._chunk_id(chunks[0]), chunks[0]
+            )
+            return found
+
+        self.operation._existing_ids = racing_existing_ids
+
+        write_chunks = MagicMock(side_effect=self.operation._write_chunks)
+        self.operation._write_chunks = write_chunks
+
+        stored = self.operation._store_chunks(chunks)
+
+        self.assertEqual(stored, 3)
+        self.assertEqual(len(self.operation.store), 4)
+        # the batch write failed, then only the chunks still missing were written, one by one
+        self.assertEqual(
+            [len(call.args[0]) for call in write_chunks.call_args_list], [4, 1, 1, 1]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
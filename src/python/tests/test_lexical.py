@@ -0,0 +1,49 @@
+import unittest
+
+from rag.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.add(
+            ["cost", "fit", "scope"],
+            [
+                "Colorectal cancer screening costs $50 at polyclinics",
+                "The FIT kit is free for Singaporeans aged 50 and above",
+                "A colonoscopy needs bowel preparation the day before",
+            ],
+        )
+
+    def test_tokenize_drops_stopwords_and_plurals(self):
+        self.assertEqual(
+            tokenize("How much does screening cost?"), ["much", "screening", "cost"]
+        )
+        self.assertEqual(tokenize("costs"), ["cost"])
+
+    def test_exact_terms_rank_first(self):
+        hits = self.index.search("How much does colorectal cancer screening cost?", k=3)
+
+        self.assertEqual(hits[0][0], "cost")
+        self.assertEqual(self.index.search("colonoscopy", k=3)[0][0], "scope")
+
+    def test_remove_and_replace(self):
+        self.index.remove(["cost"])
+        self.assertEqual(self.index.search("colorectal", k=3), [])
+
+        self.index.add(["fit"], ["colorectal screening kit"])
+        self.assertEqual(
+            [id for id, _ in self.index.search("colorectal", k=3)], ["fit"]
+        )
+        self.assertEqual(len(self.index), 2)
+
+
+class TestReciprocalRankFusion(unittest.TestCase):
+    def test_agreement_wins(self):
+        self.assertEqual(
+            reciprocal_rank_fusion(["a", "b", "c"], ["c", "d"]), ["c", "a", "b", "d"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
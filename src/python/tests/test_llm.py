@@ -0,0 +1,275 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("openai")
+from openai.types.chat import ChatCompletion
+
+from rag.llm import LLMGateway
+
+MESSAGES = [{"role": "user", "content": "How much does screening cost?"}]
+
+
+def completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-0",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+    )
+
+
+class FakeCompletions:
+    """
+    chat.completions of the OpenAI client: each call takes `latency` seconds, the first `hangs` calls never answer
+    """
+
+    def __init__(self, latency: float = 0.0, hangs: int = 0):
+        self.latency = latency
+        self.hangs = hangs
+        self.calls = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+    async def create(self, stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.calls <= self.hangs:
+            await asyncio.sleep(3600)
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.concurrent -= 1
+        return completion(f"answer {self.calls}")
+
+
+class FakeIris:
+    """
+    the parts of the iris module rag.limits uses: locks (owned per thread, like IRIS's per job) and one global
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def lock(self, names: list, timeout: float = None) -> bool:
+        with self._lock:
+            owner = threading.get_ident()
+            if any(self.locks.get(name, owner) != owner for name in names):
+                return False
+            self.locks.update({name: owner for name in names})
+            return True
+
+    def unlock(self, names: list):
+        with self._lock:
+            for name in names:
+                self.locks.pop(name, None)
+
+    def gref(self, name: str):
+        return self
+
+    def get(self, subscripts: list, default=None):
+        return self.nodes.get(tuple(subscripts), default)
+
+    def set(self, subscripts: list, value):
+        self.nodes[tuple(subscripts)] = value
+
+    def kill(self, subscripts: list):
+        self.nodes = {
+            key: value
+            for key, value in self.nodes.items()
+            if key[: len(subscripts)] != tuple(subscripts)
+        }
+
+    def order(self, subscripts: list) -> str:
+        *parent, after = subscripts
+        following = sorted(
+            key[len(parent)]
+            for key in self.nodes
+            if len(key) > len(parent)
+            and list(key[: len(parent)]) == parent
+            and key[len(parent)] > after
+        )
+        return following[0] if following else ""
+
+
+def gateway(client: FakeCompletions, **kwargs) -> LLMGateway:
+    llm = LLMGateway("sk-test", **kwargs)
+    llm.client = mock.Mock()
+    llm.client.chat.completions = client
+    return llm
+
+
+class TestBackoff(unittest.TestCase):
+    def test_full_jitter(self):
+        llm = gateway(FakeCompletions(), backoff_base=0.5, backoff_cap=4.0)
+        random.seed(0)
+
+        for attempt in range(6):
+            bound = min(4.0, 0.5 * 2**attempt)
+            delays = [llm._backoff(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= bound for delay in delays))
+            # spread over the whole range, not clustered at the bound
+            self.assertLess(min(delays), bound * 0.1)
+            self.assertGreater(max(delays), bound * 0.9)
+
+    def test_retries_then_succeeds(self):
+        client = FakeCompletions(hangs=2)
+        llm = gateway(client, timeout=0.05, max_retries=3, backoff_base=0.001)
+
+        result = llm.complete(model="gpt-4o", messages=MESSAGES)
+
+        self.assertEqual(result.choices[0].message.content, "answer 3")
+        self.assertEqual((client.calls, llm.retries, llm.failures), (3, 2, 0))
+
+    def test_gives_up_after_max_retries(self):
+        client = FakeCompletions(hangs=10)
+        llm = gateway(client, timeout=0.05, max_retries=2, backoff_base=0.001)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            llm.complete(model="gpt-4o", messages=MESSAGES)
+
+        self.assertEqual((client.calls, llm.retries, llm.failures), (3, 2, 1))
+
+
+class TestCoalescing(unittest.TestCase):
+    def test_identical_calls_in_flight(self):
+        client = FakeCompletions(latency=0.2)
+        llm = gateway(client)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(
+                    lambda _: llm.complete(model="gpt-4o", messages=MESSAGES), range(4)
+                )
+            )
+        other = llm.complete(
+            model="gpt-4o", messages=[{"role": "user", "content": "Something else"}]
+        )
+
+        self.assertEqual(
+            {result.choices[0].message.content for result in results}, {"answer 1"}
+        )
+        self.assertEqual(other.choices[0].message.content, "answer 2")
+        self.assertEqual((client.calls, llm.coalesced), (2, 3))
+        # nothing is kept once the calls are done, a later identical call goes upstream
+        self.assertEqual(
+            llm.complete(model="gpt-4o", messages=MESSAGES).choices[0].message.content,
+            "answer 3",
+        )
+
+    def test_identical_calls_in_flight_in_other_jobs(self):
+        fake_iris = FakeIris()
+        with mock.patch.dict(sys.modules, {"iris": fake_iris}):
+            from rag import limits
+        client = FakeCompletions(latency=0.2)
+        with mock.patch.object(limits, "iris", fake_iris):
+            # one gateway per job, each on its own loop thread
+            jobs = [
+                gateway(
+                    client,
+                    shared_semaphore=limits.SharedSemaphore("openai", 2),
+                    shared_calls=limits.SharedCalls(),
+                )
+                for _ in range(3)
+            ]
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                results = list(
+                    executor.map(
+                        lambda llm: llm.complete(model="gpt-4o", messages=MESSAGES),
+                        jobs,
+                    )
+                )
+
+        self.assertEqual(
+            {result.choices[0].message.content for result in results}, {"answer 1"}
+        )
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(sum(llm.coalesced for llm in jobs), 2)
+        self.assertFalse(fake_iris.locks)
+
+
+class TestConcurrencyLimit(unittest.TestCase):
+    def test_limit_shared_between_jobs(self):
+        fake_iris = FakeIris()
+        with mock.patch.dict(sys.modules, {"iris": fake_iris}):
+            from rag import limits
+        client = FakeCompletions(latency=0.1)
+        with mock.patch.object(limits, "iris", fake_iris):
+            jobs = [
+                gateway(client, shared_semaphore=limits.SharedSemaphore("openai", 2))
+                for _ in range(3)
+            ]
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                list(
+                    executor.map(
+                        lambda i: jobs[i % 3].complete(
+                            model="gpt-4o",
+                            messages=[{"role": "user", "content": str(i)}],
+                        ),
+                        range(6),
+                    )
+                )
+
+        self.assertEqual(client.calls, 6)
+        self.assertEqual(client.max_concurrent, 2)
+
+    def test_stream_holds_its_slot_until_the_end(self):
+        class FakeStream:
+            def __init__(self, client):
+                self.client = client
+
+            async def __aiter__(self):
+                for word in ("Screening", " is", " free"):
+                    await asyncio.sleep(0.05)
+                    yield word
+
+            async def close(self):
+                self.client.open -= 1
+
+        class FakeStreamingCompletions:
+            def __init__(self):
+                self.open = 0
+                self.max_open = 0
+
+            async def create(self, stream: bool = False, **kwargs):
+                self.open += 1
+                self.max_open = max(self.max_open, self.open)
+                return FakeStream(self)
+
+        client = FakeStreamingCompletions()
+        llm = gateway(client, max_concurrency=1)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            streams = list(
+                executor.map(
+                    lambda _: "".join(llm.stream(model="gpt-4o", messages=MESSAGES)),
+                    range(2),
+                )
+            )
+
+        self.assertEqual(streams, ["Screening is free"] * 2)
+        # the second stream was only opened once the first one was read to the end
+        self.assertEqual(client.max_open, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
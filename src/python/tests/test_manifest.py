@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+from rag.manifest import DocumentManifest
+
+
+class TestDocumentManifest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "manifest.json")
+
+    def test_unchanged_survives_reload(self):
+        DocumentManifest(self.path).set("a.pdf", "hash", ["1", "2"])
+
+        manifest = DocumentManifest(self.path)
+
+        self.assertTrue(manifest.is_unchanged("a.pdf", "hash"))
+        self.assertFalse(manifest.is_unchanged("a.pdf", "other"))
+        self.assertFalse(manifest.is_unchanged("b.pdf", "hash"))
+
+    def test_changed_when_chunks_are_gone(self):
+        manifest = DocumentManifest()
+        manifest.set("a.pdf", "hash", ["1", "2"])
+
+        self.assertTrue(manifest.is_unchanged("a.pdf", "hash", lambda ids: set(ids)))
+        # e.g. the vector table was dropped while the manifest file survived
+        self.assertFalse(manifest.is_unchanged("a.pdf", "hash", lambda ids: {"1"}))
+
+    def test_stale_ids_keep_shared_chunks(self):
+        manifest = DocumentManifest()
+        manifest.set("a.pdf", "hash", ["1", "2", "3"])
+        manifest.set("b.pdf", "hash", ["3"])
+
+        self.assertEqual(manifest.stale_ids("a.pdf", {"1", "4"}), {"2"})
+        self.assertEqual(manifest.stale_ids("c.pdf", {"1"}), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("grongier.pex")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_iris")
+from rag import business_operation
+from rag.business_operation import ScoreOperation
+from rag.context import count_message_tokens
+from rag.msg import ChatRequest
+
+SRC_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag"
+)
+QUERY = "I am worried screening will cost too much."
+
+
+def score_operation(**settings) -> ScoreOperation:
+    """
+    a ScoreOperation created the way PEX creates it, over the mock LLM and in-memory stores
+    """
+    operation = ScoreOperation.__new__(ScoreOperation)
+    operation.llm_backend = "mock"
+    operation.mock_latency = "fixed:0"
+    operation.session_store = "memory"
+    operation.score_store = "none"
+    for name, value in settings.items():
+        setattr(operation, name, value)
+    with mock.patch.object(business_operation, "SRC_PATH", SRC_PATH):
+        operation.on_init()
+    return operation
+
+
+class TestScoreModes(unittest.TestCase):
+    def test_defaults(self):
+        operation = score_operation()
+
+        self.assertEqual(operation.score_mode, "generate")
+        self.assertEqual(operation.score_model, business_operation.MODEL_NAME)
+
+    def test_same_belief_state_in_both_modes(self):
+        request = ChatRequest(
+            messages=[{"role": "user", "content": QUERY}], session_id="a"
+        )
+        template = score_operation(score_mode="template")
+        generate = score_operation(score_mode="generate")
+
+        template_response = template.ask(request)
+        generate_response = generate.ask(request)
+
+        # the mock answers a request deterministically, so both modes scored the same tool calls
+        self.assertEqual(template_response.scores, generate_response.scores)
+        self.assertEqual(list(template_response.scores), template.beliefs.keys)
+        template_state = template.sessions.get("a").scores.last_state()
+        generate_state = generate.sessions.get("a").scores.last_state()
+        self.assertEqual(template_state.shape, (len(template.beliefs.keys),))
+        self.assertEqual(template_state.shape, generate_state.shape)
+        self.assertEqual(template_state.tolist(), generate_state.tolist())
+        # only the advice differs: the belief prompt as is, or a completion written from it
+        self.assertEqual(template_response.response, template.belief_prompt)
+        self.assertNotEqual(generate_response.response, generate.belief_prompt)
+
+
+class TestScoringContext(unittest.TestCase):
+    def test_tool_call_keeps_the_pinned_prompt(self):
+        operation = score_operation(score_mode="template", context_budget="300")
+        operation.model.complete = mock.Mock(wraps=operation.model.complete)
+        pinned = operation.sessions.get("a").pinned
+        budget = operation.sessions.get("a").history.budget
+
+        for i in range(30):
+            operation.ask(
+                ChatRequest(
+                    messages=[{"role": "user", "content": f"{QUERY} ({i})"}],
+                    session_id="a",
+                )
+            )
+
+        messages = operation.model.complete.call_args.kwargs["messages"]
+        self.assertEqual(pinned[0]["role"], "system")
+        self.assertEqual(messages[: len(pinned)], pinned)
+        # the transcript is cut to what the budget leaves after the pinned prompt, newest turns kept
+        transcript = messages[len(pinned) :]
+        self.assertLess(len(transcript), 30)
+        self.assertEqual(transcript[-1]["content"], f"{QUERY} (29)")
+        self.assertLessEqual(
+            sum(count_message_tokens(message) for message in transcript), budget
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
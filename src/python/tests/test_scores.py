@@ -0,0 +1,60 @@
+import unittest
+
+from rag.scores import ScoreHistory
+
+CATEGORIES = {
+    "incentive": ["increase_cure", "gain_control"],
+    "barriers": ["financial_concerns", "time_constraints", "tendency_to_deny"],
+}
+
+
+class TestScoreHistory(unittest.TestCase):
+    def setUp(self):
+        self.history = ScoreHistory(CATEGORIES, capacity=4)
+
+    def test_category_means(self):
+        self.history.append(
+            {
+                "increase_cure": 1,
+                "gain_control": 0,
+                "financial_concerns": -1,
+                "time_constraints": -1,
+                "tendency_to_deny": 1,
+            }
+        )
+
+        delta = self.history.since(0)
+
+        self.assertEqual(delta["category_scores"]["incentive"], [0.5])
+        self.assertAlmostEqual(
+            delta["category_scores"]["barriers"][0], -1 / 3, places=5
+        )
+        self.assertEqual(self.history.last()["financial_concerns"], -1)
+
+    def test_since_cursor(self):
+        for value in (1, -1, 1):
+            self.history.append({"increase_cure": value})
+
+        delta = self.history.since(1)
+
+        self.assertEqual((delta["start"], delta["cursor"]), (1, 3))
+        self.assertEqual(delta["scores"]["increase_cure"], [-1, 1])
+        self.assertAlmostEqual(delta["running_means"]["incentive"], 1 / 6, places=5)
+        self.assertEqual(self.history.since(3)["scores"]["increase_cure"], [])
+
+    def test_capacity(self):
+        for value in range(6):
+            self.history.append({"increase_cure": value})
+
+        self.assertEqual(len(self.history), 4)
+        self.assertEqual(
+            [round["increase_cure"] for round in self.history.rounds()], [2, 3, 4, 5]
+        )
+        # rounds before the oldest kept one are gone, the delta starts where history does
+        self.assertEqual(self.history.since(0)["start"], 2)
+        # a cursor from beyond this history (e.g. a restarted session) starts over
+        self.assertEqual(self.history.since(10)["start"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pytest
+
+from rag.session import SessionStore
+
+PINNED = [{"role": "system", "content": "You are a helpful assistant."}]
+CATEGORIES = {"incentive": ["increase_cure", "gain_control"]}
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SessionStore(
+            pinned=PINNED, ttl=60, max_sessions=2, score_categories=CATEGORIES
+        )
+
+    def test_isolation(self):
+        self.store.get("a").add_message({"role": "user", "content": "hello from a"})
+        self.store.get("b").scores.append({"increase_cure": 1})
+
+        self.assertEqual(
+            [message["content"] for message in self.store.get("a").messages],
+            [PINNED[0]["content"], "hello from a"],
+        )
+        self.assertEqual(self.store.get("b").messages, PINNED)
+        self.assertFalse(self.store.get("a").scores)
+        # pinned messages are copied, a session changing them leaves the others alone
+        self.store.get("a").pinned[0]["content"] = "changed"
+        self.assertEqual(self.store.get("b").pinned, PINNED)
+
+    def test_idle_sessions_expire(self):
+        self.store.get("a").add_message({"role": "user", "content": "hello"})
+        self.store.get("a").last_seen -= 61
+
+        self.store.get("b")
+
+        self.assertNotIn("a", self.store.sessions)
+        self.assertEqual(self.store.get("a").messages, PINNED)
+
+    def test_least_recently_used_evicted(self):
+        self.store.get("a")
+        self.store.get("b")
+        # a is used again, so b is now the least recently used
+        self.store.get("a")
+
+        self.store.get("c")
+
+        self.assertEqual(list(self.store.sessions), ["a", "c"])
+        self.assertEqual(len(self.store), 2)
+
+    def test_reset(self):
+        self.store.get("a").add_message({"role": "user", "content": "hello"})
+
+        self.assertEqual(self.store.reset("a").messages, PINNED)
+
+
+class TestSharedSessionStore(unittest.TestCase):
+    #* The store only uses portable SQL, so it is exercised against SQLite here
+    def setUp(self):
+        pytest.importorskip("langchain_iris")
+        from rag.database import Database
+        from rag.session import SharedSessionStore
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = Database(f"sqlite:///{self.directory.name}/sessions.db")
+
+        # one store per job, all of them over the same table
+        def job(name="ChatOperation", **kwargs):
+            kwargs = {
+                "pinned": PINNED,
+                "ttl": 60,
+                "max_sessions": 2,
+                "score_categories": CATEGORIES,
+                **kwargs,
+            }
+            return SharedSessionStore(self.database, name, **kwargs)
+
+        self.job = job
+
+    def tearDown(self):
+        self.database.engine.dispose()
+        self.directory.cleanup()
+
+    def test_sessions_shared_between_jobs(self):
+        first, second = self.job(), self.job()
+        with first.session("a") as session:
+            session.add_message({"role": "user", "content": "hello"})
+            session.transcript.append({"role": "user", "content": "hello"})
+            session.scores.append({"increase_cure": 1})
+
+        with second.session("a") as session:
+            self.assertEqual(session.messages[-1]["content"], "hello")
+            self.assertEqual(
+                list(session.transcript), [{"role": "user", "content": "hello"}]
+            )
+            np.testing.assert_array_equal(session.scores.last_state(), [1, 0])
+            session.add_message({"role": "assistant", "content": "hi"})
+
+        self.assertEqual(
+            [message["content"] for message in first.get("a").messages[1:]],
+            ["hello", "hi"],
+        )
+        self.assertEqual(first.get("a").scores.since(0)["cursor"], 1)
+
+    def test_isolation(self):
+        with self.job().session("a") as session:
+            session.add_message({"role": "user", "content": "hello"})
+
+        self.assertEqual(self.job().get("b").messages, PINNED)
+        # another operation's sessions live under their own name
+        self.assertEqual(self.job("ScoreOperation").get("a").messages, PINNED)
+
+    def test_failed_request_not_saved(self):
+        store = self.job()
+        with self.assertRaises(RuntimeError):
+            with store.session("a") as session:
+                session.add_message({"role": "user", "content": "hello"})
+                raise RuntimeError("upstream failed")
+
+        self.assertEqual(len(store), 0)
+
+    def test_expiry_and_capacity(self):
+        store = self.job()
+        for session_id in ("a", "b", "c"):
+            with store.session(session_id) as session:
+                session.add_message({"role": "user", "content": session_id})
+
+        # a was the least recently used when c came
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get("a").messages, PINNED)
+        self.assertEqual(store.get("c").messages[-1]["content"], "c")
+
+        expired = self.job(ttl=0)
+        self.assertEqual(expired.get("c").messages, PINNED)
+
+    def test_reset(self):
+        store = self.job()
+        with store.session("a") as session:
+            session.add_message({"role": "user", "content": "hello"})
+
+        self.assertEqual(store.reset("a").messages, PINNED)
+        self.assertEqual(len(store), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
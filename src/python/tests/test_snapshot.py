@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pytest
+
+pytest.importorskip("grongier.pex")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_iris")
+from rag import business_operation
+from rag.business_operation import ChromaVectorOperation
+from rag.manifest import DocumentManifest
+from rag.msg import IndexRestoreRequest, IndexSnapshotRequest
+
+
+class FakeCollection:
+    """
+    the parts of a Chroma collection snapshots use, records kept in insertion order
+    """
+
+    def __init__(self):
+        self.records = {}
+
+    def count(self) -> int:
+        return len(self.records)
+
+    def get(
+        self, ids: list = None, limit: int = None, offset: int = 0, include: list = ()
+    ):
+        ids = [id for id in (ids or self.records) if id in self.records]
+        ids = ids[offset : offset + limit] if limit else ids[offset:]
+        result = {"ids": ids}
+        for field in include:
+            result[field] = [self.records[id][field] for id in ids]
+        return result
+
+    def add(self, ids: list, embeddings: list, metadatas: list, documents: list):
+        for id, embedding, metadata, document in zip(
+            ids, embeddings, metadatas, documents
+        ):
+            self.records[id] = {
+                "embeddings": list(embedding),
+                "metadatas": metadata,
+                "documents": document,
+            }
+
+    def delete(self, ids: list):
+        for id in ids:
+            self.records.pop(id, None)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        # created the way PEX creates components, without a model or a Chroma client
+        self.operation = ChromaVectorOperation.__new__(ChromaVectorOperation)
+        self.operation.vector_store = mock.Mock()
+        self.operation.vector_store._collection = FakeCollection()
+        self.operation.vector_store.get.side_effect = (
+            self.operation.vector_store._collection.get
+        )
+        self.operation.manifest = DocumentManifest()
+        self.operation.response_cache = mock.Mock()
+        self.operation.log_info = mock.Mock()
+
+        self.collection = self.operation.vector_store._collection
+        self.collection.add(
+            ids=[f"id{i}" for i in range(5)],
+            embeddings=np.random.default_rng(0)
+            .random((5, 4))
+            .astype(np.float32)
+            .tolist(),
+            metadatas=[{"source": "factsheet.pdf", "page": i} for i in range(5)],
+            documents=[f"chunk {i}" for i in range(5)],
+        )
+        self.operation.manifest.set(
+            "factsheet.pdf", "abc123", {f"id{i}" for i in range(5)}
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        path = f"{self.directory.name}/snapshot"
+        records = dict(self.collection.records)
+        documents = dict(self.operation.manifest.documents)
+
+        # read in batches smaller than the collection
+        with mock.patch.object(business_operation, "SNAPSHOT_BATCH_SIZE", 2):
+            snapshot = self.operation.snapshot(IndexSnapshotRequest(path=path))
+        self.assertEqual(snapshot.count, 5)
+        self.assertEqual(
+            sorted(os.listdir(path)),
+            ["embeddings.npy", "manifest.json", "records.json"],
+        )
+        self.assertEqual(np.load(f"{path}/embeddings.npy").shape, (5, 4))
+
+        # the knowledge base changes after the snapshot
+        self.collection.delete(["id0", "id1"])
+        self.collection.add(
+            ids=["other"], embeddings=[[0.0] * 4], metadatas=[{}], documents=["other"]
+        )
+        self.operation.manifest.clear()
+        self.operation.manifest.set("other.pdf", "def456", {"other"})
+
+        with mock.patch.object(business_operation, "SNAPSHOT_BATCH_SIZE", 2):
+            restored = self.operation.restore(IndexRestoreRequest(path=path))
+
+        self.assertEqual(restored.count, 5)
+        self.assertEqual(list(self.collection.records), list(records))
+        for id, record in records.items():
+            self.assertEqual(
+                self.collection.records[id]["documents"], record["documents"]
+            )
+            self.assertEqual(
+                self.collection.records[id]["metadatas"], record["metadatas"]
+            )
+            np.testing.assert_allclose(
+                self.collection.records[id]["embeddings"],
+                record["embeddings"],
+                rtol=1e-6,
+            )
+        self.assertEqual(set(self.operation.manifest.documents), set(documents))
+        self.assertEqual(
+            set(self.operation.manifest.documents["factsheet.pdf"]["chunk_ids"]),
+            {f"id{i}" for i in range(5)},
+        )
+        self.operation.response_cache.clear.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
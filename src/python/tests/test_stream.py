@@ -0,0 +1,164 @@
+import json
+import sys
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import pytest
+
+
+class FakeGlobal:
+    """
+    iris.gref of an IRIS global: nodes keyed by their subscripts, kill removes a node and everything under it
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def get(self, subscripts: list, default=None):
+        with self._lock:
+            return self.nodes.get(tuple(subscripts), default)
+
+    def set(self, subscripts: list, value):
+        with self._lock:
+            self.nodes[tuple(subscripts)] = value
+
+    def kill(self, subscripts: list):
+        with self._lock:
+            self.nodes = {
+                key: value
+                for key, value in self.nodes.items()
+                if key[: len(subscripts)] != tuple(subscripts)
+            }
+
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ref = FakeGlobal()
+        fake_iris = mock.Mock()
+        fake_iris.gref.return_value = self.ref
+        with mock.patch.dict(sys.modules, {"iris": fake_iris}):
+            from rag import stream
+        patcher = mock.patch.object(stream, "iris", fake_iris)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.StreamChannel = stream.StreamChannel
+
+
+class TestStreamChannel(StreamTestCase):
+    def test_round_trip(self):
+        writer, reader = self.StreamChannel("turn"), self.StreamChannel("turn")
+        for chunk in ("Screening", " is", " free"):
+            writer.write(chunk)
+        writer.close()
+
+        self.assertEqual(list(reader.read()), ["Screening", " is", " free"])
+        self.assertFalse(self.ref.nodes)
+
+    def test_concurrent_writer(self):
+        writer = self.StreamChannel("turn")
+
+        def write():
+            for i in range(50):
+                writer.write(str(i))
+            writer.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        chunks = list(self.StreamChannel("turn").read(poll_interval=0.001))
+        thread.join()
+
+        self.assertEqual(chunks, [str(i) for i in range(50)])
+
+    def test_writer_failed_part_way(self):
+        # the writer died before closing the channel, the request is over all the same
+        writer = self.StreamChannel("turn")
+        writer.write("Screening")
+
+        chunks = list(self.StreamChannel("turn").read(until=lambda: True))
+
+        self.assertEqual(chunks, ["Screening"])
+        self.assertFalse(self.ref.nodes)
+
+    def test_other_channels_untouched(self):
+        self.StreamChannel("other").write("kept")
+        channel = self.StreamChannel("turn")
+        channel.write("dropped")
+
+        channel.discard()
+
+        self.assertEqual(list(self.ref.nodes), [("other", 1), ("other", "count")])
+
+    def test_discard_after_request(self):
+        channel = self.StreamChannel("turn")
+        request = Future()
+        channel.write("Screening")
+
+        # the reader gave up, the request is still writing
+        channel.discard(after=request)
+        channel.write(" is free")
+        self.assertTrue(self.ref.nodes)
+
+        request.set_result("Screening is free")
+        self.assertFalse(self.ref.nodes)
+
+
+class TestIngestProgress(StreamTestCase):
+    def setUp(self):
+        super().setUp()
+        pytest.importorskip("grongier.pex")
+        from rag.business_service import ChatService
+
+        self.service = ChatService.__new__(ChatService)
+        self.service.on_init()
+        self.events = [{"pages": page, "total_pages": 3} for page in (1, 2, 3)]
+
+    def send_request_sync(self, fail_after: int = None):
+        def send(target, request):
+            channel = self.StreamChannel(request.progress_id)
+            try:
+                for i, event in enumerate(self.events):
+                    if i == fail_after:
+                        raise RuntimeError("parser crashed")
+                    channel.write(json.dumps(event))
+            finally:
+                channel.close()
+
+        return send
+
+    def test_progress(self):
+        self.service.send_request_sync = self.send_request_sync()
+        progress = []
+
+        self.service.ingest("factsheet.pdf", on_progress=progress.append)
+
+        self.assertEqual(progress, self.events)
+        self.assertFalse(self.ref.nodes)
+
+    def test_request_failed_part_way(self):
+        self.service.send_request_sync = self.send_request_sync(fail_after=1)
+        progress = []
+
+        with self.assertRaises(RuntimeError):
+            self.service.ingest("factsheet.pdf", on_progress=progress.append)
+
+        self.assertEqual(progress, self.events[:1])
+        self.assertFalse(self.ref.nodes)
+
+    def test_progress_callback_failed(self):
+        self.service.send_request_sync = self.send_request_sync()
+
+        def on_progress(event):
+            raise ValueError("page closed")
+
+        with self.assertRaises(ValueError):
+            self.service.ingest("factsheet.pdf", on_progress=on_progress)
+
+        # the request ran to the end, and its events were dropped after it
+        self.assertFalse(self.ref.nodes)
+
+
+if __name__ == "__main__":
+    unittest.main()